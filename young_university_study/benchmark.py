@@ -0,0 +1,126 @@
+"""
+性能测试工具
+
+benchmark_*命令都在临时的测试数据库中运行，不会影响现有数据
+"""
+
+import json
+import os
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import connections
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+
+@contextmanager
+def benchmark_database():
+    """
+    创建一个临时的测试数据库，结束后删除
+    """
+    # DEBUG模式下会记录所有SQL，影响内存和耗时
+    with override_settings(DEBUG=False):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            yield
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+
+def measure(func, *args, **kwargs):
+    """
+    运行func，返回耗时（秒）和这次运行中Python内存的峰值（字节）
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": seconds, "peak_memory": peak}
+
+
+def _reset_connections():
+    for connection in connections.all():
+        # 内存中的SQLite测试数据库只能通过继承的连接访问，
+        # 其他数据库不能和父进程共用socket，在子进程中重新连接
+        if not (connection.vendor == "sqlite" and connection.is_in_memory_db()):
+            connection.connection = None
+
+
+def measure_in_subprocess(func, *args, **kwargs):
+    """
+    在fork出的子进程中运行measure(func)，额外返回子进程的最大RSS（字节），
+    包括openpyxl等在C中分配、tracemalloc统计不到的内存。
+    每次运行使用新的子进程，起点都是fork时父进程的内存，不受之前运行的影响
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.close(read_fd)
+            _reset_connections()
+            with os.fdopen(write_fd, "w") as f:
+                json.dump(measure(func, *args, **kwargs), f)
+            code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(code)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        data = f.read()
+    _, status, usage = os.wait4(pid, 0)
+    if status != 0:
+        raise RuntimeError("子进程运行失败")
+    result = json.loads(data)
+    result["max_rss"] = usage.ru_maxrss * 1024
+    return result
+
+
+def percentile(values, p):
+    """
+    已排序的values的p分位数
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run_requests(requests):
+    """
+    依次发送requests中的请求并统计延迟和吞吐量
+
+    requests为[(client, method, url, data)]，返回请求数、每秒请求数、
+    p50/p95/p99延迟（毫秒）以及各状态码的数量
+    """
+    latencies = []
+    statuses = Counter()
+    start = time.perf_counter()
+    for client, method, url, data in requests:
+        begin = time.perf_counter()
+        response = getattr(client, method)(url, data, format="json")
+        if response.streaming:
+            # 流式响应需要读完才算结束
+            for _ in response.streaming_content:
+                pass
+        latencies.append(time.perf_counter() - begin)
+        statuses[response.status_code] += 1
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "seconds": seconds,
+        "throughput": len(latencies) / seconds if seconds else 0.0,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "statuses": {str(code): num for code, num in sorted(statuses.items())},
+    }
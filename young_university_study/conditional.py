@@ -0,0 +1,52 @@
+"""
+条件GET
+
+学院、团支部、期数、商品列表很少变化，但小程序每次启动都会请求。
+ETag根据请求的URL和数据的版本号（或最大修改时间等很容易查询到的值）生成，
+请求带上的If-None-Match或If-Modified-Since与之相同时直接返回304，不需要查询列表和序列化
+"""
+
+import hashlib
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+
+
+def conditional_response(request, validator, render, last_modified=None):
+    """
+    validator需要包含所有会影响响应内容的值，相同时返回304，否则调用render生成响应
+    """
+    etag = quote_etag(
+        hashlib.md5(repr((request.get_full_path(), validator)).encode()).hexdigest()
+    )
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = render()
+    if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+class ConditionalListMixin:
+    """
+    list支持条件GET，子类需要设置list_validator，
+    为没有参数、返回validator的函数，例如staticmethod(get_org_version)
+    """
+
+    list_validator = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not callable(cls.list_validator):
+            raise ImproperlyConfigured("%s需要设置list_validator" % cls.__name__)
+
+    def list(self, request, *args, **kwargs):
+        return conditional_response(
+            request,
+            self.list_validator(),
+            lambda: super(ConditionalListMixin, self).list(request, *args, **kwargs),
+        )
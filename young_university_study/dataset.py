@@ -0,0 +1,296 @@
+"""
+模拟数据
+
+按照给定的规模生成学院、团支部、学生、青年大学习期数、学习记录、商品和兑换记录，
+用于查询次数测试和性能测试。同一个seed生成的数据完全相同，不同提交上的测试结果可以比较。
+
+数据使用bulk_create分批写入，不会触发post_save，写入后统一重建排行榜、汇总表、搜索索引并更新版本号
+"""
+
+import datetime
+import random
+from collections import Counter, defaultdict, namedtuple
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .store.models import Commodity, PurchaseRecord
+from .study import rollup
+from .study.models import StudyPeriod, StudyRecording, get_continue_study
+from .user import leaderboard, search
+from .user.models import College, LeagueBranch, Permission, User
+from .versions import bump
+
+Scale = namedtuple(
+    "Scale",
+    ["colleges", "league_branches", "users", "periods", "commodities", "purchases"],
+)
+
+SCALES = {
+    # 查询次数测试默认使用的规模
+    "small": Scale(
+        colleges=3,
+        league_branches=12,
+        users=120,
+        periods=6,
+        commodities=6,
+        purchases=40,
+    ),
+    "medium": Scale(
+        colleges=30,
+        league_branches=600,
+        users=3000,
+        periods=40,
+        commodities=50,
+        purchases=2000,
+    ),
+    # 约100万条学习记录
+    "large": Scale(
+        colleges=30,
+        league_branches=600,
+        users=30000,
+        periods=40,
+        commodities=100,
+        purchases=20000,
+    ),
+}
+
+# 常见的姓和名字中的字，用于生成姓名
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹"
+GIVEN_NAMES = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉萍红兰浩宇轩子涵欣怡博文"
+
+# 学号至少从这里开始编号
+FIRST_USER_ID = 2020000001
+
+Dataset = namedtuple(
+    "Dataset",
+    [
+        "superuser",
+        "college_admin",
+        "league_admin",
+        "student",
+        "college",
+        "league_branch",
+        "periods",
+    ],
+)
+
+
+def _next_id(model):
+    return (model.objects.aggregate(id=Max("id"))["id"] or 0) + 1
+
+
+def _create_colleges(scale):
+    first = _next_id(College)
+    colleges = College.objects.bulk_create(
+        College(id=first + i, name="学院%d" % (i + 1)) for i in range(scale.colleges)
+    )
+    first = _next_id(LeagueBranch)
+    league_branches = LeagueBranch.objects.bulk_create(
+        LeagueBranch(
+            id=first + i,
+            college=colleges[i % len(colleges)],
+            name="团支部%d" % (i + 1),
+        )
+        for i in range(scale.league_branches)
+    )
+    return colleges, league_branches
+
+
+def _create_periods(scale):
+    first = _next_id(StudyPeriod)
+    return StudyPeriod.objects.bulk_create(
+        StudyPeriod(
+            id=first + i,
+            season=i // 10 + 1,
+            period=i % 10 + 1,
+            name="第%d季第%d期" % (i // 10 + 1, i % 10 + 1),
+            url="https://h5.cyol.com/special/daxuexi/%d/m.html" % (first + i),
+            time=600,
+        )
+        for i in range(scale.periods)
+    )
+
+
+def _create_commodities(scale, colleges):
+    now = timezone.now()
+    first = _next_id(Commodity)
+    return Commodity.objects.bulk_create(
+        Commodity(
+            id=first + i,
+            title="商品%d" % (i + 1),
+            describe="商品描述",
+            location="兑换地点",
+            cost=(i % 5 + 1) * 2,
+            # 一半为校级商品
+            owner=None if i % 2 == 0 else colleges[i // 2 % len(colleges)],
+            start_time=now - datetime.timedelta(days=10),
+            deadline=now + datetime.timedelta(days=30),
+        )
+        for i in range(scale.commodities)
+    )
+
+
+def _study(user, study_periods, rng):
+    """
+    生成学生的学习记录，并计算学习期数、连续学习期数和积分
+
+    每个学生有自己的学习频率，大部分学生经常学习；上一期学习了的学生更可能接着学习，
+    中断之后较难恢复，因此连续学习期数呈现较长的连续段
+    """
+    probability = rng.betavariate(5, 1.5)
+    keep = min(probability + 0.15, 0.98)
+    resume = probability * 0.6
+    recordings = []
+    for period in study_periods:
+        studied_last = user.last_study is not None and user.last_study == period.id - 1
+        if rng.random() >= (keep if studied_last else resume):
+            continue
+        index = get_continue_study(user.continue_study, user.last_study, period.id)
+        score = min(index, 5)
+        recordings.append(
+            StudyRecording(
+                user_id=user,
+                study_id=period,
+                score=score,
+                detail="连续学习%d期" % index,
+            )
+        )
+        user.continue_study = index
+        user.last_study = period.id
+        user.total_study += 1
+        user.total_score += score
+    return recordings
+
+
+def _purchase(user, commodities, rng):
+    """
+    学生兑换一件商品，热门商品被兑换的次数更多，积分不足时不兑换
+    """
+    choices = commodities.get(user.college_id, []) + commodities[None]
+    if not choices:
+        return None
+    commodity = rng.choices(choices, weights=[c.popularity for c in choices])[0]
+    if user.total_score < commodity.cost:
+        return None
+    user.total_score -= commodity.cost
+    return PurchaseRecord(
+        customer=user,
+        commodity=commodity,
+        help_text="花费%d积分购买%s" % (commodity.cost, commodity.title),
+        cost=commodity.cost,
+        is_exchanged=rng.random() < 0.5,
+    )
+
+
+def _create_users(
+    scale, rng, first, league_branches, study_periods, commodities, batch_size
+):
+    purchase_rate = scale.purchases / max(scale.users, 1)
+    # 学生可以兑换校级商品和本学院的商品
+    by_college = defaultdict(list)
+    for i, commodity in enumerate(commodities):
+        commodity.popularity = 1 / (i % 10 + 1)
+        by_college[commodity.owner_id].append(commodity)
+    exchanged = Counter()
+    for start in range(0, scale.users, batch_size):
+        users, recordings, purchases = [], [], []
+        for i in range(start, min(start + batch_size, scale.users)):
+            league_branch = league_branches[rng.randrange(len(league_branches))]
+            user = User(
+                id=first + i,
+                name=rng.choice(SURNAMES)
+                + "".join(rng.choices(GIVEN_NAMES, k=rng.choice((1, 2, 2)))),
+                college_id=league_branch.college_id,
+                # 少数学生还没有选择团支部
+                league_branch=league_branch if rng.random() >= 0.03 else None,
+                identity=rng.choices((1, 2, 3), weights=(70, 10, 20))[0],
+                code="openid-%d" % (first + i),
+                uid=first + i,
+            )
+            recordings += _study(user, study_periods, rng)
+            if rng.random() < purchase_rate:
+                purchase = _purchase(user, by_college, rng)
+                if purchase is not None:
+                    exchanged[purchase.commodity.pk] += 1
+                    purchases.append(purchase)
+            users.append(user)
+        User.objects.bulk_create(users)
+        StudyRecording.objects.bulk_create(recordings, batch_size=batch_size)
+        PurchaseRecord.objects.bulk_create(purchases, batch_size=batch_size)
+    for commodity_id, num in exchanged.items():
+        Commodity.all_objects.filter(pk=commodity_id).update(exchanged=num)
+
+
+def _create_admins(first, colleges, league_branches):
+    admins = [
+        User.objects.create(
+            id=first + i,
+            name=name,
+            identity=2,
+            code="admin-%d" % (first + i),
+            uid=first + i,
+            is_superuser=i == 0,
+        )
+        for i, name in enumerate(("管理员", "院管理员", "团支部管理员"))
+    ]
+    superuser, college_admin, league_admin = admins
+    Permission.objects.bulk_create(
+        [
+            Permission(
+                user_id=college_admin,
+                permission_type=ContentType.objects.get_for_model(College),
+                permission_id=colleges[0].id,
+            ),
+            Permission(
+                user_id=league_admin,
+                permission_type=ContentType.objects.get_for_model(LeagueBranch),
+                permission_id=league_branches[0].id,
+            ),
+        ]
+    )
+    return superuser, college_admin, league_admin
+
+
+def generate(scale, seed=0, batch_size=2000):
+    """
+    生成scale规模的数据，返回Dataset，其中包括各种身份的用户用于测试
+    """
+    rng = random.Random(seed)
+    with transaction.atomic():
+        colleges, league_branches = _create_colleges(scale)
+        study_periods = _create_periods(scale)
+        commodities = _create_commodities(scale, colleges)
+        first = max(FIRST_USER_ID, _next_id(User))
+        _create_users(
+            scale, rng, first, league_branches, study_periods, commodities, batch_size
+        )
+        superuser, college_admin, league_admin = _create_admins(
+            first + scale.users, colleges, league_branches
+        )
+        leaderboard.rebuild()
+        rollup.rebuild()
+        search.rebuild()
+
+    # bulk_create不会发送信号，需要手动更新版本号
+    bump(
+        College,
+        LeagueBranch,
+        User,
+        Permission,
+        StudyPeriod,
+        StudyRecording,
+        Commodity,
+        PurchaseRecord,
+    )
+    return Dataset(
+        superuser=superuser,
+        college_admin=college_admin,
+        league_admin=league_admin,
+        student=User.objects.get(pk=first),
+        college=colleges[0],
+        league_branch=league_branches[0],
+        periods=study_periods,
+    )
@@ -0,0 +1,293 @@
+"""
+请求指标
+
+MetricsMiddleware记录每个视图的请求数、耗时、SQL查询次数和耗时、渲染耗时以及响应大小，
+按METRICS_SAMPLE_RATE抽样，只有抽中的请求才会统计SQL，不抽样的请求只计数，
+因此可以在生产环境中一直开启。开启METRICS_SERVER_TIMING时，或者请求可以读取/api/metrics时，
+抽中的请求会带上Server-Timing头，浏览器的开发者工具中可以直接看到。
+超过METRICS_SLOW_QUERY_MS的SQL会记录日志。
+
+/api/metrics 以Prometheus文本格式返回汇总的结果（包括外部服务的请求情况），
+指标保存在进程内，多进程部署时每个进程分别统计
+"""
+
+import hmac
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework import exceptions
+
+from .upstream import get_upstream_clients
+from .user.tokens import TokenAuthentication
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetrics:
+    """
+    一个请求中的SQL查询次数、耗时和慢查询数
+    """
+
+    def __init__(self, slow_query_seconds):
+        self.slow_query_seconds = slow_query_seconds
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.slow_queries = 0
+        self.render_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = time.perf_counter() - start
+            self.queries += 1
+            self.sql_seconds += seconds
+            if seconds >= self.slow_query_seconds:
+                self.slow_queries += 1
+                logger.warning("慢查询 %.1f ms：%s", seconds * 1000, sql)
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.sampled = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.slow_queries = 0
+        self.render_seconds = 0.0
+        self.response_bytes = 0
+
+
+class MetricsRegistry:
+    """
+    按(视图, 请求方法, 状态码)汇总的指标
+    """
+
+    def __init__(self):
+        self._views = defaultdict(ViewMetrics)
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds=None, request_metrics=None, response_bytes=0):
+        with self._lock:
+            view = self._views[key]
+            view.requests += 1
+            if request_metrics is None:
+                return
+            view.sampled += 1
+            view.seconds += seconds
+            view.queries += request_metrics.queries
+            view.sql_seconds += request_metrics.sql_seconds
+            view.slow_queries += request_metrics.slow_queries
+            view.render_seconds += request_metrics.render_seconds
+            view.response_bytes += response_bytes
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(vars(view)) for key, view in self._views.items()}
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = MetricsRegistry()
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match.route
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            response = self.get_response(request)
+            registry.record((_view_name(request), request.method, response.status_code))
+            return response
+
+        request_metrics = RequestMetrics(settings.METRICS_SLOW_QUERY_MS / 1000)
+        request._metrics = request_metrics
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(request_metrics))
+            response = self.get_response(request)
+        seconds = time.perf_counter() - start
+
+        size = 0 if response.streaming else len(response.content)
+        registry.record(
+            (_view_name(request), request.method, response.status_code),
+            seconds,
+            request_metrics,
+            size,
+        )
+        # 查询次数和耗时不发送给其他客户端，DRF认证后的用户会设置到request.user上
+        if settings.METRICS_SERVER_TIMING or _can_read_metrics(request):
+            timing = 'db;dur=%.1f;desc="%d queries", render;dur=%.1f, total;dur=%.1f'
+            response["Server-Timing"] = timing % (
+                request_metrics.sql_seconds * 1000,
+                request_metrics.queries,
+                request_metrics.render_seconds * 1000,
+                seconds * 1000,
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF的Response在所有中间件之后才渲染，用回调记录渲染（序列化为JSON）的耗时
+        request_metrics = getattr(request, "_metrics", None)
+        if request_metrics is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                request_metrics.render_seconds += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return ",".join('%s="%s"' % (k, _escape(v)) for k, v in labels.items())
+
+
+def render_metrics():
+    """
+    Prometheus文本格式的指标
+    """
+    lines = []
+
+    def metric(name, kind, help, samples):
+        lines.append("# HELP %s %s" % (name, help))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for labels, value in samples:
+            lines.append("%s{%s} %s" % (name, labels, value))
+
+    views = sorted(registry.snapshot().items())
+    view_labels = [
+        (_labels(view=view, method=method, status=status), data)
+        for (view, method, status), data in views
+    ]
+    for name, field, kind, help in (
+        ("http_requests_total", "requests", "counter", "Requests."),
+        ("http_sampled_requests_total", "sampled", "counter", "Sampled requests."),
+        (
+            "http_request_duration_seconds_total",
+            "seconds",
+            "counter",
+            "Time spent on sampled requests.",
+        ),
+        ("db_queries_total", "queries", "counter", "SQL queries of sampled requests."),
+        (
+            "db_query_duration_seconds_total",
+            "sql_seconds",
+            "counter",
+            "Time spent on SQL of sampled requests.",
+        ),
+        (
+            "db_slow_queries_total",
+            "slow_queries",
+            "counter",
+            "Slow SQL queries of sampled requests.",
+        ),
+        (
+            "http_render_duration_seconds_total",
+            "render_seconds",
+            "counter",
+            "Time spent on rendering sampled responses.",
+        ),
+        (
+            "http_response_bytes_total",
+            "response_bytes",
+            "counter",
+            "Response size of sampled requests.",
+        ),
+    ):
+        metric(
+            name, kind, help, [(labels, data[field]) for labels, data in view_labels]
+        )
+
+    upstreams = [
+        (_labels(upstream=client.name), client.metrics.snapshot())
+        for client in get_upstream_clients()
+    ]
+    for name, field, kind, help in (
+        ("upstream_requests_total", "requests", "counter", "Upstream requests."),
+        ("upstream_errors_total", "errors", "counter", "Failed upstream requests."),
+        (
+            "upstream_rejected_total",
+            "rejected",
+            "counter",
+            "Requests rejected by the circuit breaker.",
+        ),
+        (
+            "upstream_duration_seconds_total",
+            "seconds",
+            "counter",
+            "Time spent on upstream requests.",
+        ),
+        ("upstream_latency_p50_seconds", "p50", "gauge", "Recent p50 latency."),
+        ("upstream_latency_p99_seconds", "p99", "gauge", "Recent p99 latency."),
+    ):
+        metric(name, kind, help, [(labels, data[field]) for labels, data in upstreams])
+
+    return "\n".join(lines) + "\n"
+
+
+def _has_metrics_token(request):
+    token = settings.METRICS_TOKEN
+    return bool(token) and hmac.compare_digest(
+        request.META.get("HTTP_AUTHORIZATION", ""), "Bearer " + token
+    )
+
+
+def _can_read_metrics(request):
+    user = getattr(request, "user", None)
+    return (
+        request.META.get("REMOTE_ADDR") in settings.METRICS_ALLOWED_IPS
+        or _has_metrics_token(request)
+        or (user is not None and user.is_superuser)
+    )
+
+
+def _authenticate_token(request):
+    """
+    小程序使用的token认证，返回token中的用户，没有token或者token无效时返回None
+    """
+    try:
+        result = TokenAuthentication().authenticate(request)
+    except exceptions.AuthenticationFailed:
+        return None
+    return result and result[0]
+
+
+def metrics_view(request):
+    """
+    只允许METRICS_ALLOWED_IPS中的地址、带上METRICS_TOKEN的请求（Prometheus）
+    和超级管理员（session或token）访问
+    """
+    if not _can_read_metrics(request):
+        user = _authenticate_token(request)
+        if user is None or not user.is_superuser:
+            return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,150 @@
+"""
+分页
+
+KeysetPagination按照queryset的排序字段分页：游标记录上一页最后一条数据的排序字段值，
+下一页只需要查询排在它后面的数据，翻到很深的页也不需要像OFFSET一样先扫描前面的所有数据。
+排序字段最后总会加上主键，排序字段相同（例如学习期数相同）的数据顺序也是确定的。
+
+为了兼容旧版小程序，请求中没有page_size和cursor参数时不分页，返回所有数据
+"""
+
+import base64
+import binascii
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder只保留到毫秒，游标需要完整的时间
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "cursor无效"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if (
+            self.page_size_query_param not in params
+            and self.cursor_query_param not in params
+        ):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.fields = self.get_ordering_fields(queryset)
+        queryset = queryset.order_by(
+            *[("-" if desc else "") + name for name, desc in self.ordering]
+        )
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            queryset = queryset.filter(self.get_after_filter(cursor))
+
+        # 多取一条用于判断是否还有下一页
+        results = list(queryset[: self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[: self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, queryset):
+        """
+        返回[(字段, 是否降序)]，最后一个字段为主键
+        """
+        ordering = []
+        for field in queryset.query.order_by or queryset.model._meta.ordering:
+            if not isinstance(field, str):
+                raise ImproperlyConfigured("KeysetPagination只支持按字段名排序")
+            desc = field.startswith("-")
+            ordering.append((field.lstrip("-"), desc))
+        pk_name = queryset.model._meta.pk.name
+        if not any(name in ("pk", pk_name) for name, _ in ordering):
+            ordering.append(("pk", False))
+        return ordering
+
+    def get_ordering_fields(self, queryset):
+        """
+        排序字段对应的模型字段（注解为它的output_field），用于检查游标中的值
+        """
+        # resolve_ref可能会添加关联表，在复制的query上解析
+        query = queryset.query.chain()
+        return [query.resolve_ref(name).output_field for name, _ in self.ordering]
+
+    def get_after_filter(self, cursor):
+        """
+        排在cursor之后的数据：前面的字段都相等，并且当前字段排在后面
+        """
+        after = Q(pk__in=[])
+        equal = Q()
+        for (name, desc), value in zip(self.ordering, cursor):
+            after |= equal & Q(**{"%s__%s" % (name, "lt" if desc else "gt"): value})
+            equal &= Q(**{name: value})
+        return after
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (binascii.Error, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(cursor, list) or len(cursor) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        # 游标可以被客户端修改，值的类型不对时数据库查询会出错
+        try:
+            return [field.to_python(value) for field, value in zip(self.fields, cursor)]
+        except (ValueError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, item):
+        values = [getattr(item, name) for name, _ in self.ordering]
+        return base64.urlsafe_b64encode(
+            json.dumps(values, cls=CursorEncoder).encode()
+        ).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict([("next", self.get_next_link()), ("results", data)])
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
@@ -0,0 +1,64 @@
+"""
+响应缓存
+
+全校的学院、团支部排行是很大的聚合查询，管理员和大屏会反复刷新，但只有打卡后数据才会变化。
+缓存的值为(数据版本号, 响应数据)，缓存键中不包含版本号：
+
+- 版本号（见versions）相同时直接返回缓存的数据
+- 版本号不同时只有拿到锁（cache.add）的请求重新计算，其他请求先返回旧数据，
+  没有旧数据时等待计算完成，同时刷新的请求只会执行一次聚合查询
+"""
+
+import hashlib
+import time
+
+from django.core.cache import cache
+
+from .versions import get_versions
+
+CACHE_KEY = "response:%s:%s"
+CACHE_TIMEOUT = 60 * 60
+# 计算超过这个时间认为拿到锁的请求已经失败，其他请求可以重新计算
+LOCK_TIMEOUT = 30
+# 没有旧数据时等待其他请求计算完成的间隔
+WAIT_INTERVAL = 0.05
+
+
+def _cache_key(name, params):
+    return CACHE_KEY % (
+        name,
+        hashlib.md5(repr(sorted(params.items())).encode()).hexdigest(),
+    )
+
+
+def _compute(key, version, compute):
+    data = compute()
+    cache.set(key, (version, data), CACHE_TIMEOUT)
+    return data
+
+
+def get_or_compute(name, params, models, compute):
+    """
+    name、params相同并且models的版本号没有变化时返回缓存的compute()的结果，
+    compute的结果需要可以pickle
+    """
+    # 先取版本号再计算，计算期间数据变化时版本号也会改变，下一次请求会重新计算
+    version = get_versions(*models)
+    key = _cache_key(name, params)
+    lock_key = key + ":lock"
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        entry = cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        if cache.add(lock_key, True, LOCK_TIMEOUT):
+            try:
+                return _compute(key, version, compute)
+            finally:
+                cache.delete(lock_key)
+        if entry is not None:
+            # 其他请求正在重新计算，先返回旧数据
+            return entry[1]
+        if time.monotonic() >= deadline:
+            return _compute(key, version, compute)
+        time.sleep(WAIT_INTERVAL)
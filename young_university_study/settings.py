@@ -9,8 +9,12 @@ https://docs.djangoproject.com/en/3.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
+import datetime
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
 
@@ -59,6 +63,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "young_university_study.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -74,7 +79,10 @@ REST_FRAMEWORK = {
     ),
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework.authentication.SessionAuthentication",
+        "young_university_study.user.tokens.TokenAuthentication",
     ),
+    # 请求带上page_size或cursor参数时按排序字段分页
+    "DEFAULT_PAGINATION_CLASS": "young_university_study.pagination.KeysetPagination",
 }
 
 ROOT_URLCONF = "young_university_study.urls"
@@ -108,6 +116,91 @@ DATABASES = {
     }
 }
 
+# DJANGO_DATABASE=postgresql时使用PostgreSQL（需要安装psycopg2），
+# 例如在本地的PostgreSQL上运行benchmark_suite
+if os.environ.get("DJANGO_DATABASE") == "postgresql":
+    DATABASES["default"] = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.environ.get("POSTGRES_DB", "young_university_study"),
+        "USER": os.environ.get("POSTGRES_USER", "postgres"),
+        "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+        "HOST": os.environ.get("POSTGRES_HOST", "127.0.0.1"),
+        "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+    }
+
+
+# Cache and session
+# DJANGO_CACHE选择缓存后端：
+#   locmem（DEBUG时默认）：进程内缓存，只用于开发和测试
+#   file（DEBUG为False时默认）：缓存在CACHE_ROOT下，同一台机器上的多个进程共享，不需要额外的服务
+#   redis：多台机器共享，需要安装django-redis，地址由DJANGO_REDIS_URL指定
+# 期数、权限、组织结构、token_version、数据版本号等缓存都依靠共享缓存在进程间失效，
+# locmem只能让处理写请求的进程看到变化，因此DEBUG为False时不能使用
+# session单独使用一个缓存，清空业务缓存时不会让用户退出登录
+# file和locmem的条目数上限由CACHE_MAX_ENTRIES指定，Django默认的300条远远不够，
+# 超过后会随机删除条目（包括session和版本号）。file的add不是原子的，
+# 响应缓存的锁和版本号的初始化只能尽量避免重复，多台机器或要求严格时使用redis
+
+CACHE_ROOT = BASE_DIR / "cache"
+DJANGO_CACHE = os.environ.get("DJANGO_CACHE", "locmem" if DEBUG else "file")
+if DJANGO_CACHE == "locmem" and not DEBUG:
+    raise ImproperlyConfigured("DJANGO_CACHE=locmem时缓存不能在进程间共享，生产环境请使用file或redis")
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 1000000))
+# 达到上限时删除1/CACHE_CULL_FREQUENCY的条目
+CACHE_CULL_FREQUENCY = 10
+
+
+def _cache_config(backend, name):
+    if backend == "redis":
+        return {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": os.environ.get("DJANGO_REDIS_URL", "redis://127.0.0.1:6379/0"),
+            "KEY_PREFIX": name,
+        }
+    options = {
+        "MAX_ENTRIES": CACHE_MAX_ENTRIES,
+        "CULL_FREQUENCY": CACHE_CULL_FREQUENCY,
+    }
+    if backend == "file":
+        return {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": str(CACHE_ROOT / name),
+            "OPTIONS": options,
+        }
+    return {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": name,
+        "OPTIONS": options,
+    }
+
+
+CACHES = {
+    "default": _cache_config(DJANGO_CACHE, "default"),
+    "session": _cache_config(DJANGO_CACHE, "session"),
+}
+
+
+def _session_engine(engine, backend):
+    if engine == "cache" and backend != "redis":
+        raise ImproperlyConfigured(
+            "DJANGO_SESSION_ENGINE=cache需要DJANGO_CACHE=redis，否则请使用cached_db"
+        )
+    return {
+        "db": "django.contrib.sessions.backends.db",
+        "cached_db": "django.contrib.sessions.backends.cached_db",
+        "cache": "django.contrib.sessions.backends.cache",
+    }[engine]
+
+
+# DJANGO_SESSION_ENGINE选择session的保存方式：
+#   db（默认）：每个请求都要查询一次session表
+#   cached_db：先读缓存，未命中时再查询数据库，写入时同时写数据库和缓存
+#   cache：只保存在缓存中，必须使用redis，file和locmem的条目被删除或丢失时用户会退出登录
+SESSION_ENGINE = _session_engine(
+    os.environ.get("DJANGO_SESSION_ENGINE", "db"), DJANGO_CACHE
+)
+SESSION_CACHE_ALIAS = "session"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -152,5 +245,68 @@ STATICFILES_DIRS = ["./media"]
 AUTH_USER_MODEL = "user.User"
 
 
+# 查询次数测试使用的模拟数据规模（young_university_study.dataset.SCALES）
+TEST_DATASET_SCALE = os.environ.get("TEST_DATASET_SCALE", "small")
+
 # 上传图像大小限制（单位为MB
 UPLOAD_IMAGE_LIMIT = 10
+
+# 导出任务生成的文件存放的目录
+EXPORT_ROOT = BASE_DIR / "export"
+# 为True时在web进程的后台线程中执行导出任务，否则需要运行run_export_worker
+EXPORT_JOB_IN_PROCESS = False
+# 导出任务执行超过这个时间（秒）认为worker已经退出，任务可以被重新领取
+EXPORT_JOB_TIMEOUT = 30 * 60
+# 导出文件保留的时间（秒），过期的文件由run_export_worker删除
+EXPORT_FILE_MAX_AGE = 24 * 60 * 60
+
+# 为True时学习记录先放入缓冲区，再批量写入数据库
+STUDY_RECORDING_WRITE_BEHIND = False
+# 缓冲区写入数据库的间隔（毫秒），为0时只在缓冲区满时写入
+STUDY_RECORDING_FLUSH_INTERVAL = 200
+# 缓冲区最多保存的学习记录数
+STUDY_RECORDING_BUFFER_SIZE = 500
+
+# 微信登录换取openid的地址
+WECHAT_INFO_URL = "https://youth.bupt.edu.cn/token/wx_info"
+# 请求外部服务的连接、读取超时（秒）
+UPSTREAM_CONNECT_TIMEOUT = 3
+UPSTREAM_READ_TIMEOUT = 5
+# 外部服务连续失败多少次后熔断，以及熔断的秒数
+UPSTREAM_BREAKER_FAILURES = 5
+UPSTREAM_BREAKER_RESET = 30
+
+# uid校验的实现，本地开发时可以使用young_university_study.user.uid.StubUidBackend
+UID_VERIFY_BACKEND = "young_university_study.user.uid.HttpUidBackend"
+UID_VERIFY_URL = "http://app.bjtitle.com/rui/bj-band.php"
+# uid校验结果的缓存时间（秒），校验失败的结果缓存时间较短
+UID_VERIFY_CACHE_TIMEOUT = 24 * 60 * 60
+UID_VERIFY_NEGATIVE_CACHE_TIMEOUT = 10 * 60
+# 同时请求uid校验服务的数量上限，以及排队等待的秒数
+UID_VERIFY_MAX_CONCURRENCY = 10
+UID_VERIFY_QUEUE_TIMEOUT = 2
+
+# 注册、登录时外部校验（微信code、uid）的总时限（秒），以及同时进行的校验数量上限
+REMOTE_VALIDATION_TIMEOUT = 6
+REMOTE_VALIDATION_WORKERS = 20
+
+# 登录凭证（token）以及refresh token的有效期
+TOKEN_LIFETIME = datetime.timedelta(hours=2)
+REFRESH_TOKEN_LIFETIME = datetime.timedelta(days=30)
+
+# 是否记录请求指标（/api/metrics）
+METRICS_ENABLED = True
+# 统计SQL、渲染耗时的请求比例，其余请求只计数
+METRICS_SAMPLE_RATE = 0.1
+# 超过该耗时（毫秒）的SQL会记录日志
+METRICS_SLOW_QUERY_MS = 100
+# 不需要登录就可以读取/api/metrics的地址（逗号分隔），默认为空。
+# 在反向代理后面时REMOTE_ADDR都是代理的地址，这时不要填127.0.0.1，使用METRICS_TOKEN
+METRICS_ALLOWED_IPS = [
+    ip for ip in os.environ.get("METRICS_ALLOWED_IPS", "").split(",") if ip
+]
+# 请求头带上Authorization: Bearer <METRICS_TOKEN>时可以读取/api/metrics，为空时不启用
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+# 抽中的请求是否都带上Server-Timing头（包含查询次数和耗时），
+# 关闭时只有可以读取/api/metrics的请求才会带上
+METRICS_SERVER_TIMING = DEBUG
@@ -3,6 +3,7 @@ from model_utils.models import SoftDeletableModel
 from young_university_study.user.models import College, User
 
 from ..utils import get_Hashids
+from ..versions import track
 
 
 class Commodity(SoftDeletableModel):
@@ -64,3 +65,6 @@ class PurchaseRecord(models.Model):
 
     def get_code(self) -> str:
         return get_Hashids().encode(self.id)
+
+
+track(Commodity, PurchaseRecord)
@@ -6,6 +6,7 @@ from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from ..testing import QueryCountTestMixin
 from ..user.models import College, LeagueBranch, Permission, User
 from ..utils import get_Hashids
 from .models import Commodity, PurchaseRecord
@@ -168,12 +169,45 @@ class SuperUserTests(APITestCase):
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]["id"], 1)
 
+    def test_list_commdity_not_modified(self):
+        url = "/api/commodity/"
+        response: Any = self.client.get(url)
+        etag = response["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # 兑换后已兑换数量改变
+        commodity = Commodity.objects.get(pk=self.commodity1.id)
+        commodity.exchanged += 1
+        commodity.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]["exchanged"], 1)
+        etag = response["ETag"]
+
+        commodity.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [])
+
     def test_list_my_commdity_1(self):
         url = "/api/commodity/my_commodity/"
         response: Any = self.client.get(url, format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 5)
 
+    def test_list_my_commdity_pagination(self):
+        response: Any = self.client.get("/api/commodity/my_commodity/")
+        expected = [c["id"] for c in response.data]
+        results = []
+        response = self.client.get("/api/commodity/my_commodity/", {"page_size": 1})
+        while True:
+            results.extend(c["id"] for c in response.data["results"])
+            if response.data["next"] is None:
+                break
+            response = self.client.get(response.data["next"])
+        self.assertEqual(results, expected)
+
     def test_create_commdity(self):
         url = "/api/commodity/"
         data = {
@@ -398,3 +432,28 @@ class CommonUserTests(APITestCase):
         url = "/api/purchase/22222/"
         response: Any = self.client.get(url, format="json")
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class QueryCountTests(QueryCountTestMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        commodity = Commodity.objects.filter(owner__isnull=True).first()
+        for _ in range(3):
+            PurchaseRecord.objects.create(
+                customer=cls.data.student,
+                commodity=commodity,
+                help_text="",
+                cost=commodity.cost,
+            )
+
+    def test_commodity(self):
+        response = self.assertMaxQueries(1, self.data.student, "/api/commodity/")
+        self.assertGreater(len(response.data), 1)
+        self.assertMaxQueries(
+            1, self.data.college_admin, "/api/commodity/my_commodity/"
+        )
+
+    def test_purchase(self):
+        response = self.assertMaxQueries(1, self.data.student, "/api/purchase/")
+        self.assertGreaterEqual(len(response.data), 3)
@@ -2,7 +2,6 @@ import os
 
 import nanoid
 from django.conf import settings
-from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
 from django.db.models import Q
 from django.http import JsonResponse
@@ -13,8 +12,10 @@ from rest_framework.decorators import action
 from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
 
-from ..user.models import College, User, user_has_college_permission
+from ..conditional import conditional_response
+from ..user.models import User, get_permission_set, user_has_college_permission
 from ..utils import get_Hashids
+from ..versions import get_version
 from .models import Commodity, PurchaseRecord
 from .serializers import (
     CommoditySerializers,
@@ -34,9 +35,7 @@ class CommodityViewSetPermission(permissions.BasePermission):
                 request.method in SAFE_METHODS
                 # 只有超级管理员和院管理员可以创建
                 or user.is_superuser
-                or user.permissions.filter(
-                    permission_type=ContentType.objects.get_for_model(College),
-                ).exists()
+                or bool(get_permission_set(user).college_ids)
             )
         )
 
@@ -66,13 +65,21 @@ class CommodityViewSet(
         user: User = request.user
 
         # 防止user.college为空报错
-        if user.college:
+        if user.college_id:
             queryset = Commodity.available_objects.filter(
-                Q(owner__isnull=True) | Q(owner=user.college.id)
+                Q(owner__isnull=True) | Q(owner=user.college_id)
             )
         else:
             queryset = Commodity.available_objects.filter(Q(owner__isnull=True))
+        queryset = queryset.order_by("-created")
 
+        return conditional_response(
+            request,
+            (user.college_id, get_version(Commodity)),
+            lambda: self.list_response(queryset),
+        )
+
+    def list_response(self, queryset):
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -89,23 +96,10 @@ class CommodityViewSet(
         if user.is_superuser:
             queryset = Commodity.all_objects.all()
         else:
-            queryset = Commodity.all_objects.raw(
-                "SELECT pr.* from store_commodity as pr "
-                "inner join user_permission p on pr.owner_id = p.permission_id "
-                "where p.user_id_id = %s and p.permission_type_id = %s",
-                [
-                    str(user.id),
-                    str(ContentType.objects.get_for_model(College).id),
-                ],
+            queryset = Commodity.all_objects.filter(
+                owner__in=get_permission_set(user).college_ids
             )
-
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.list_response(queryset.order_by("-created"))
 
 
 class PurchaseViewSetPermission(permissions.BasePermission):
@@ -147,7 +141,9 @@ class PurchaseViewSet(
 
     def get_queryset(self):
         if self.action == "list":
-            return self.queryset.filter(customer=self.request.user)
+            return self.queryset.filter(customer=self.request.user).select_related(
+                "commodity", "customer"
+            )
         else:
             return self.queryset
 
@@ -208,9 +204,7 @@ def upload_image(request):
         and (
             # 只有超级管理员和院管理员可以创建
             user.is_superuser
-            or user.permissions.filter(
-                permission_type=ContentType.objects.get_for_model(College),
-            ).exists()
+            or get_permission_set(user).college_ids
         )
     ):
         return HttpResponseForbidden()
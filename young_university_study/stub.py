@@ -0,0 +1,85 @@
+"""
+本地模拟的上游服务，用于测试和性能测试
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubServer:
+    """
+    routes为{路径: func(参数字典) -> (状态码, 返回内容)}，返回内容为dict时按JSON返回，
+    每个请求先等待delay秒，用于模拟上游的延迟
+
+        with StubServer({"/token/wx_info": handler}) as server:
+            requests.get(server.url + "/token/wx_info")
+    """
+
+    def __init__(self, routes, delay=0):
+        self.routes = routes
+        self.delay = delay
+        self.hits = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # 使用keep-alive，才能测试连接复用
+            protocol_version = "HTTP/1.1"
+            # 头部和内容分两次发送，不关闭Nagle算法时复用的连接每次会多等待40ms
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                stub.hits += 1
+                url = urlsplit(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if stub.delay:
+                    time.sleep(stub.delay)
+                route = stub.routes.get(url.path)
+                if route is None:
+                    status, body = 404, ""
+                else:
+                    status, body = route(params)
+                if isinstance(body, dict):
+                    body = json.dumps(body)
+                data = body.encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except ConnectionError:
+                    # 客户端已经超时断开
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -2,4 +2,9 @@ from django.apps import AppConfig
 
 
 class StudyConfig(AppConfig):
-    name = "study"
+    name = "young_university_study.study"
+    label = "study"
+
+    def ready(self):
+        # 注册signal
+        from . import rollup  # noqa: F401
@@ -0,0 +1,278 @@
+"""
+学习打卡
+
+打卡不再锁住用户行，重复打卡由StudyRecording的(user_id, study_id)唯一约束挡住，
+用户的积分和学习期数使用F()更新。
+
+STUDY_RECORDING_WRITE_BEHIND开启时学习记录先放入进程内的缓冲区，
+每隔STUDY_RECORDING_FLUSH_INTERVAL毫秒（或缓冲区满时）在一个事务中批量写入，
+汇总表、连续学习期数和排行榜也按批更新。写入失败时记录留在缓冲区中，下次写入时重试，
+进程退出或收到SIGTERM时写入剩余的记录
+"""
+
+import atexit
+import logging
+import os
+import signal
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from ..user import leaderboard
+from ..user.models import User
+from ..versions import bump
+from . import rollup
+from .models import StudyRecording, get_continue_study, set_last_study
+
+logger = logging.getLogger(__name__)
+
+
+class AlreadyStudied(Exception):
+    pass
+
+
+def new_recording(user, period, previous=None):
+    """
+    根据用户当前的连续学习期数生成学习记录（未保存），
+    previous为该用户在缓冲区中还没有写入的上一条学习记录
+    """
+    if previous is None:
+        index = get_continue_study(user.continue_study, user.last_study, period.id)
+    else:
+        index = get_continue_study(
+            previous.continue_study, previous.study_id_id, period.id
+        )
+    recording = StudyRecording(
+        user_id=user,
+        study_id=period,
+        score=min(index, 5),
+        detail="连续学习%d期" % index,
+    )
+    recording.continue_study = index
+    return recording
+
+
+def _update_users(recordings):
+    """
+    学习记录写入后更新用户的积分、学习期数和排行榜，每个用户最多一条记录
+    """
+    user_ids = defaultdict(list)
+    for recording in recordings:
+        user_ids[recording.score].append(recording.user_id.pk)
+    for score, ids in user_ids.items():
+        User.objects.filter(pk__in=ids).update(
+            total_score=F("total_score") + score,
+            total_study=F("total_study") + 1,
+        )
+    bump(User)
+    leaderboard.add_study(recording.user_id.total_study for recording in recordings)
+
+
+def check_in(user, period):
+    """
+    学习period，已经学习过时抛出AlreadyStudied
+    """
+    recording = new_recording(user, period)
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                # continue_study和last_study由StudyRecording的post_save维护
+                recording.save(force_insert=True)
+        except IntegrityError:
+            # 只有(user_id, study_id)重复时才是已经学习过，post_save中的其他错误直接抛出
+            if StudyRecording.objects.filter(
+                user_id=user.pk, study_id=period.id
+            ).exists():
+                raise AlreadyStudied()
+            raise
+        _update_users([recording])
+    return recording
+
+
+def _save_recordings(recordings):
+    """
+    批量写入同一期的学习记录，返回写入成功的记录，已经存在的记录会被忽略
+    """
+    existed = set(
+        StudyRecording.objects.filter(
+            user_id__in=[recording.user_id.pk for recording in recordings],
+            study_id=recordings[0].study_id_id,
+        ).values_list("user_id", flat=True)
+    )
+    recordings = [
+        recording for recording in recordings if recording.user_id.pk not in existed
+    ]
+    try:
+        with transaction.atomic():
+            StudyRecording.objects.bulk_create(recordings)
+    except IntegrityError:
+        # 其他进程同时写入了相同的记录，逐条写入
+        saved = []
+        for recording in recordings:
+            try:
+                with transaction.atomic():
+                    StudyRecording.objects.bulk_create([recording])
+            except IntegrityError:
+                continue
+            saved.append(recording)
+        recordings = saved
+    if not recordings:
+        return recordings
+
+    # bulk_create不会发送post_save，在这里维护汇总表、连续学习期数和版本号
+    bump(StudyRecording)
+    rollup.add_recordings(recordings)
+    set_last_study(
+        [recording.user_id.pk for recording in recordings], recordings[0].study_id_id
+    )
+    _update_users(recordings)
+    return recordings
+
+
+class RecordingBuffer:
+    """
+    学习记录写缓冲区
+    """
+
+    def __init__(self, interval, max_size):
+        self.interval = interval
+        self.max_size = max_size
+        self._pending = {}
+        # 每个用户在缓冲区中期数最大的记录，连续学习期数需要在它的基础上计算
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add(self, user, period):
+        """
+        放入一条学习记录，同一个用户同一期已经在缓冲区中时返回None
+        """
+        key = (user.pk, period.id)
+        with self._lock:
+            if key in self._pending:
+                return None
+            previous = self._latest.get(user.pk)
+            if previous is not None and previous.study_id_id > period.id:
+                previous = None
+            recording = new_recording(user, period, previous)
+            self._pending[key] = recording
+            if previous is not None or user.pk not in self._latest:
+                self._latest[user.pk] = recording
+            full = len(self._pending) >= self.max_size
+            if self.interval and self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        if full:
+            if self.interval:
+                self._wakeup.set()
+            else:
+                try:
+                    self.flush()
+                except Exception:
+                    # 记录已经在缓冲区中，下次写入时重试
+                    logger.exception("写入学习记录失败")
+        return recording
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        """
+        写入缓冲区中的所有记录，返回写入的数量
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = dict(self._pending)
+            if not batch:
+                return 0
+            # 新的一期发布时缓冲区中可能有两期的记录，按期数分别写入
+            by_study = defaultdict(list)
+            for recording in batch.values():
+                by_study[recording.study_id_id].append(recording)
+            num = 0
+            studied = Counter()
+            total_study = {
+                key: recording.user_id.total_study for key, recording in batch.items()
+            }
+            try:
+                with transaction.atomic():
+                    for study_id in sorted(by_study):
+                        recordings = by_study[study_id]
+                        for recording in recordings:
+                            recording.user_id.total_study += studied[
+                                recording.user_id.pk
+                            ]
+                        for recording in _save_recordings(recordings):
+                            studied[recording.user_id.pk] += 1
+                            num += 1
+            except Exception:
+                # 事务已经回滚，恢复记录的状态，记录留在缓冲区中下次重试
+                for key, recording in batch.items():
+                    recording.user_id.total_study = total_study[key]
+                    recording.pk = None
+                raise
+            # 写入成功后才从缓冲区移除，期间重复的打卡会被拒绝
+            with self._lock:
+                for key, recording in batch.items():
+                    self._pending.pop(key, None)
+                    if self._latest.get(key[0]) is recording:
+                        del self._latest[key[0]]
+            return num
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval / 1000)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # 写入失败的记录留在缓冲区中，下一次写入时重试
+                logger.exception("写入学习记录失败")
+            finally:
+                connection.close()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = RecordingBuffer(
+                settings.STUDY_RECORDING_FLUSH_INTERVAL,
+                settings.STUDY_RECORDING_BUFFER_SIZE,
+            )
+            # 进程退出前写入剩余的记录
+            atexit.register(_buffer.flush)
+            _handle_sigterm(_buffer)
+        return _buffer
+
+
+def _handle_sigterm(buffer):
+    """
+    收到SIGTERM时先写入剩余的记录，再交给原来的处理函数
+    """
+    if threading.current_thread() is not threading.main_thread():
+        # 只能在主线程中设置信号处理函数，这时只依赖atexit
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handler(signum, frame):
+        try:
+            buffer.flush()
+        except Exception:
+            logger.exception("写入学习记录失败")
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    signal.signal(signal.SIGTERM, handler)
@@ -0,0 +1,101 @@
+"""
+学习情况导出
+
+按学号分批读取学生，每批只查询范围内的学习记录，
+逐行生成表格，CSV和XLSX都不需要在内存中保存整张表
+"""
+
+import csv
+import tempfile
+from collections import defaultdict
+
+from django.http import FileResponse, StreamingHttpResponse
+from openpyxl import Workbook
+
+from ..user.models import User
+from .models import StudyPeriod, StudyRecording
+
+# 每次从数据库读取的学生数量
+EXPORT_CHUNK_SIZE = 2000
+
+
+def iter_export_rows(college_id, study_min, study_max, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    逐行生成导出表格，第一行为表头，college_id为-1时导出全校
+    """
+    periods = list(
+        StudyPeriod.objects.filter(id__gte=study_min, id__lte=study_max).order_by("id")
+    )
+    header = ["学号", "姓名", "学院", "团支部"]
+    for period in periods:
+        header.append("第%d季第%d期完成情况" % (period.season, period.period))
+    yield header
+
+    users = User.objects.order_by("id").values_list(
+        "id", "name", "college__name", "league_branch__name"
+    )
+    if college_id != -1:
+        users = users.filter(college=college_id)
+
+    last_id = None
+    while True:
+        chunk = users if last_id is None else users.filter(id__gt=last_id)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+
+        finished = defaultdict(set)
+        for user_id, study_id in StudyRecording.objects.filter(
+            user_id__in=[user[0] for user in chunk],
+            study_id__gte=study_min,
+            study_id__lte=study_max,
+        ).values_list("user_id", "study_id"):
+            finished[user_id].add(study_id)
+
+        for user_id, name, college, league_branch in chunk:
+            row = [str(user_id), name, college or "", league_branch or ""]
+            for period in periods:
+                row.append("已完成" if period.id in finished[user_id] else "未完成")
+            yield row
+
+
+class _Echo:
+    """
+    csv.writer需要一个文件对象，直接把写入的内容返回
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_response(rows, file_name):
+    writer = csv.writer(_Echo())
+
+    def stream():
+        # 加上BOM，Excel打开时才能正确识别utf-8
+        yield "\ufeff"
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(stream(), content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = 'attachment; filename="%s"' % file_name
+    return response
+
+
+def write_xlsx(rows, file):
+    """
+    使用openpyxl的write_only模式写入file，已经写入的行不会保留在内存中
+    """
+    book = Workbook(write_only=True)
+    sheet = book.create_sheet("main")
+    for row in rows:
+        sheet.append(row)
+    book.save(file)
+
+
+def xlsx_response(rows, file_name):
+    file = tempfile.TemporaryFile()
+    write_xlsx(rows, file)
+    file.seek(0)
+    return FileResponse(file, as_attachment=True, filename=file_name)
@@ -0,0 +1,182 @@
+"""
+导出任务
+
+任务保存在ExportJob表中，run_export_worker命令（或者EXPORT_JOB_IN_PROCESS开启时
+web进程的后台线程）领取等待中的任务并生成文件。
+相同参数的任务在导出的数据没有变化时直接复用已经生成的文件。
+
+执行超过EXPORT_JOB_TIMEOUT秒的任务认为worker已经退出，可以被重新领取；
+生成超过EXPORT_FILE_MAX_AGE秒的文件由prune_files删除，对应的任务标记为失败
+"""
+
+import csv
+import hashlib
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..user.models import College, LeagueBranch, User
+from ..versions import get_versions
+from .export import iter_export_rows, write_xlsx
+from .models import ExportJob, StudyPeriod, StudyRecording
+
+
+def get_data_version():
+    """
+    导出数据的版本，学习记录、期数、学生以及学院、团支部（见versions）变化时都会发生变化，
+    版本号不区分范围，任何变化都会重新导出
+    """
+    versions = get_versions(StudyRecording, StudyPeriod, User, College, LeagueBranch)
+    return hashlib.md5(repr(versions).encode()).hexdigest()
+
+
+def _stale_running():
+    """
+    执行超时的任务，领取任务时会更新updated，可以作为开始执行的时间
+    """
+    deadline = timezone.now() - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT)
+    return Q(status=ExportJob.RUNNING, updated__lt=deadline)
+
+
+def enqueue(owner, college_id, study_min, study_max, file_format):
+    """
+    创建导出任务，已经有相同的任务时直接返回
+    """
+    data_version = get_data_version()
+    job = (
+        ExportJob.objects.filter(
+            college_id=college_id,
+            study_min=study_min,
+            study_max=study_max,
+            file_format=file_format,
+            data_version=data_version,
+        )
+        .exclude(Q(status=ExportJob.FAILED) | _stale_running())
+        .order_by("-id")
+        .first()
+    )
+    if job is not None and (
+        job.status != ExportJob.FINISHED or os.path.exists(get_file_path(job))
+    ):
+        return job
+
+    job = ExportJob.objects.create(
+        owner=owner,
+        college_id=college_id,
+        study_min=study_min,
+        study_max=study_max,
+        file_format=file_format,
+        data_version=data_version,
+    )
+    if settings.EXPORT_JOB_IN_PROCESS:
+        transaction.on_commit(_start_thread)
+    return job
+
+
+def claim_job():
+    """
+    领取一个等待中或者执行超时的任务，多个worker同时运行时每个任务只会被领取一次
+    """
+    queryset = ExportJob.objects.filter(Q(status=ExportJob.PENDING) | _stale_running())
+    for job in queryset.order_by("id")[:10]:
+        now = timezone.now()
+        # 状态和updated都没有变化时才能领取，超时的任务也只会被一个worker重新领取
+        if ExportJob.objects.filter(
+            pk=job.pk, status=job.status, updated=job.updated
+        ).update(status=ExportJob.RUNNING, updated=now):
+            job.status = ExportJob.RUNNING
+            job.updated = now
+            return job
+    return None
+
+
+def get_file_path(job):
+    return os.path.join(settings.EXPORT_ROOT, job.file)
+
+
+def run_job(job):
+    file_name = "%d.%s" % (job.id, job.file_format)
+    os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+    try:
+        rows = iter_export_rows(job.college_id, job.study_min, job.study_max)
+        path = os.path.join(settings.EXPORT_ROOT, file_name)
+        if job.file_format == "csv":
+            with open(path, "w", encoding="utf-8-sig", newline="") as f:
+                csv.writer(f).writerows(rows)
+        else:
+            with open(path, "wb") as f:
+                write_xlsx(rows, f)
+    except Exception as e:
+        job.status = ExportJob.FAILED
+        job.error = str(e)[:200]
+    else:
+        job.status = ExportJob.FINISHED
+        job.file = file_name
+    job.save(update_fields=["status", "file", "error", "updated"])
+    return job
+
+
+def _mark_file_missing(queryset):
+    # 导出文件已经被删除，之后相同参数的任务会重新导出
+    queryset.filter(status=ExportJob.FINISHED).update(
+        status=ExportJob.FAILED, error="导出文件已删除", updated=timezone.now()
+    )
+
+
+def mark_file_missing(job):
+    _mark_file_missing(ExportJob.objects.filter(pk=job.pk))
+
+
+def prune_files():
+    """
+    删除EXPORT_ROOT中生成超过EXPORT_FILE_MAX_AGE秒的文件，返回删除的数量
+    """
+    try:
+        entries = list(os.scandir(settings.EXPORT_ROOT))
+    except FileNotFoundError:
+        return 0
+    deadline = time.time() - settings.EXPORT_FILE_MAX_AGE
+    files = []
+    for entry in entries:
+        try:
+            if not entry.is_file() or entry.stat().st_mtime >= deadline:
+                continue
+            os.remove(entry.path)
+        except FileNotFoundError:
+            # 其他worker已经删除
+            continue
+        files.append(entry.name)
+    if files:
+        _mark_file_missing(ExportJob.objects.filter(file__in=files))
+    return len(files)
+
+
+def run_pending_jobs():
+    """
+    执行所有等待中的任务，返回执行的任务数
+    """
+    num = 0
+    while True:
+        job = claim_job()
+        if job is None:
+            return num
+        run_job(job)
+        num += 1
+
+
+def _run_in_thread():
+    try:
+        run_pending_jobs()
+        prune_files()
+    finally:
+        connection.close()
+
+
+def _start_thread():
+    threading.Thread(target=_run_in_thread, daemon=True).start()
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ....benchmark import benchmark_database, measure
+from ....user import leaderboard
+from ....user.models import User
+from ...checkin import RecordingBuffer, check_in
+from ...models import StudyPeriod, StudyRecording, get_continue_study
+from ...periods import get_lastst_period
+from .benchmark_export import seed
+
+
+@transaction.atomic
+def legacy_check_in(user_id):
+    """
+    原来的打卡实现：锁住用户行，重新查询最新一期，再写入学习记录和用户
+    """
+    user = User.objects.select_for_update().get(pk=user_id)
+    lastst_study = StudyPeriod.objects.latest("id")
+    if user.last_study == lastst_study.id:
+        return
+    index = get_continue_study(user.continue_study, user.last_study, lastst_study.id)
+    score = min(index, 5)
+    StudyRecording.objects.create(
+        user_id=user, study_id=lastst_study, score=score, detail="连续学习%d期" % index
+    )
+    user.total_score += score
+    user.total_study += 1
+    user.save(update_fields=["total_score", "total_study"])
+
+
+def run_legacy(users):
+    for user in users:
+        legacy_check_in(user.pk)
+
+
+def run_idempotent(users):
+    period = get_lastst_period()
+    for user in users:
+        check_in(user, period)
+
+
+def run_write_behind(users, batch_size):
+    period = get_lastst_period()
+    buffer = RecordingBuffer(interval=0, max_size=batch_size)
+    for user in users:
+        buffer.add(user, period)
+    buffer.flush()
+
+
+class Command(BaseCommand):
+    help = "在临时数据库中比较每秒能处理的打卡数"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=5000, help="每轮打卡的学生人数")
+        parser.add_argument("--periods", type=int, default=5, help="已有的期数")
+        parser.add_argument("--batch-size", type=int, default=500, help="缓冲区大小")
+
+    def handle(self, *args, **options):
+        user_num = options["users"]
+        with benchmark_database():
+            # 每种实现使用一批不同的学生，都打卡最新的一期
+            seed(user_num * 3, options["periods"], rate=0.5)
+            leaderboard.rebuild()
+            StudyPeriod.objects.create(season=99, period=1, name="", url="", time=0)
+            users = list(User.objects.order_by("id"))
+            for i, (name, func, args) in enumerate(
+                (
+                    ("legacy", run_legacy, ()),
+                    ("idempotent", run_idempotent, ()),
+                    ("write-behind", run_write_behind, (options["batch_size"],)),
+                )
+            ):
+                start, end = i * user_num, (i + 1) * user_num
+                result = measure(func, users[start:end], *args)
+                self.stdout.write(
+                    "%-13s %8.2fs  %8.0f 次/秒"
+                    % (name, result["seconds"], user_num / result["seconds"])
+                )
@@ -0,0 +1,128 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from ....benchmark import benchmark_database, measure_in_subprocess
+from ....user.models import College, LeagueBranch, User
+from ...export import csv_response, iter_export_rows, xlsx_response
+from ...models import StudyPeriod, StudyRecording
+
+
+def legacy_export(college_id, study_min, study_max):
+    """
+    原来的导出实现：先在内存中生成整张表，再交给django_excel
+    """
+    import django_excel as excel
+
+    periods = StudyPeriod.objects.filter(id__gte=study_min, id__lte=study_max)
+
+    excel_data = []
+    excel_header = ["学号", "姓名", "学院", "团支部"]
+    for period in periods:
+        excel_header.append("第%d季第%d期完成情况" % (period.season, period.period))
+    excel_data.append(excel_header)
+
+    users = User.objects.select_related("college").select_related("league_branch")
+    if college_id != -1:
+        users = users.filter(college=college_id)
+    users = users.prefetch_related("recording")
+
+    for user in users:
+        excel_iter = ["未完成"] * len(excel_header)
+        excel_iter[0] = str(user.id)
+        excel_iter[1] = user.name
+        excel_iter[2] = user.college.name if user.college is not None else ""
+        excel_iter[3] = (
+            user.league_branch.name if user.league_branch is not None else ""
+        )
+        for r in user.recording.all():
+            if study_min <= r.study_id_id <= study_max:
+                excel_iter[r.study_id_id - periods[0].id + 4] = "已完成"
+        excel_data.append(excel_iter)
+
+    sheet = excel.pe.Sheet(excel_data)
+    book = excel.pe.Book({"sheet1": sheet})
+    response = excel.make_response(book, "xlsx", file_name="main.xlsx")
+    return len(response.content)
+
+
+def streaming_csv(college_id, study_min, study_max):
+    response = csv_response(iter_export_rows(college_id, study_min, study_max), "")
+    return sum(len(chunk) for chunk in response.streaming_content)
+
+
+def streaming_xlsx(college_id, study_min, study_max):
+    response = xlsx_response(iter_export_rows(college_id, study_min, study_max), "")
+    size = sum(len(chunk) for chunk in response.streaming_content)
+    response.close()
+    return size
+
+
+def seed(user_num, period_num, rate=0.7, seed=0):
+    rand = random.Random(seed)
+    colleges = College.objects.bulk_create(
+        College(id=i + 1, name="学院%d" % i) for i in range(30)
+    )
+    league_branches = LeagueBranch.objects.bulk_create(
+        LeagueBranch(id=i + 1, college=colleges[i % 30], name="团支部%d" % i)
+        for i in range(600)
+    )
+    periods = StudyPeriod.objects.bulk_create(
+        StudyPeriod(
+            id=i + 1, season=i // 10 + 1, period=i % 10 + 1, name="", url="", time=0
+        )
+        for i in range(period_num)
+    )
+    users = []
+    for i in range(user_num):
+        league_branch = league_branches[i % len(league_branches)]
+        users.append(
+            User(
+                id=2020000000 + i,
+                name="学生%d" % i,
+                college_id=league_branch.college_id,
+                league_branch=league_branch,
+                identity=1,
+                code="code%d" % i,
+                uid=i,
+            )
+        )
+    User.objects.bulk_create(users, batch_size=5000)
+    recordings = [
+        StudyRecording(user_id=user, study_id=period, score=1, detail="")
+        for user in users
+        for period in periods
+        if rand.random() < rate
+    ]
+    StudyRecording.objects.bulk_create(recordings, batch_size=5000)
+
+
+class Command(BaseCommand):
+    help = "在临时数据库中比较导出学习情况的耗时和内存，" "每种导出在单独的子进程中运行，报告Python内存峰值和子进程最大RSS"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=30000, help="学生人数")
+        parser.add_argument("--periods", type=int, default=20, help="期数")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            self.stdout.write(
+                "生成%d名学生、%d期的数据..." % (options["users"], options["periods"])
+            )
+            seed(options["users"], options["periods"])
+            # 每个子进程的RSS都包括fork时继承的内存，相互之间的差值就是各自多用的内存
+            for name, func in (
+                ("streaming csv", streaming_csv),
+                ("streaming xlsx", streaming_xlsx),
+                ("legacy xlsx", legacy_export),
+            ):
+                result = measure_in_subprocess(func, -1, 1, options["periods"])
+                self.stdout.write(
+                    "%-15s %8.2fs  内存峰值 %8.1f MB  子进程最大RSS %8.1f MB"
+                    % (
+                        name,
+                        result["seconds"],
+                        result["peak_memory"] / 1024 / 1024,
+                        result["max_rss"] / 1024 / 1024,
+                    )
+                )
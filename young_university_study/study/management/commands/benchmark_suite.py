@@ -0,0 +1,226 @@
+import datetime
+import json
+import random
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ....benchmark import benchmark_database, run_requests
+from ....dataset import SCALES, generate
+from ....store.models import Commodity
+from ....user.models import User
+from ....user.tokens import issue_tokens
+from ...models import StudyPeriod
+
+
+class Clients:
+    """
+    每个用户一个使用token登录的客户端，请求经过完整的中间件和URL路由
+    """
+
+    def __init__(self):
+        self._clients = {}
+
+    def __getitem__(self, user):
+        client = self._clients.get(user.pk)
+        if client is None:
+            client = APIClient(
+                HTTP_HOST="localhost",
+                HTTP_AUTHORIZATION="Bearer " + issue_tokens(user)["token"],
+            )
+            self._clients[user.pk] = client
+        return client
+
+
+def checkin(data, clients, students, rng, num):
+    # 发布新的一期后所有学生集中打卡
+    StudyPeriod.objects.create(season=99, period=1, name="新的一期", url="", time=600)
+    return [(clients[user], "post", "/api/study_recording/", {}) for user in students]
+
+
+def leaderboard(data, clients, students, rng, num):
+    league_branch = data.league_branch
+    requests = []
+    for _ in range(num):
+        requests.append((clients[rng.choice(students)], "get", "/api/user/rank/", None))
+        requests.append(
+            (
+                clients[data.league_admin],
+                "get",
+                "/api/user/ranks/?college_id=%d&league_branch_id=%d"
+                % (league_branch.college_id, league_branch.id),
+                None,
+            )
+        )
+        requests.append((clients[data.superuser], "get", "/api/college/ranks/", None))
+        requests.append(
+            (
+                clients[data.superuser],
+                "get",
+                "/api/league_branch/ranks/?college_id=-1",
+                None,
+            )
+        )
+    return requests
+
+
+def range_report(data, clients, students, rng, num):
+    ids = [period.id for period in data.periods]
+    league_branch = data.league_branch
+    requests = []
+    for _ in range(num):
+        study_min, study_max = sorted(rng.sample(ids, 2))
+        params = "study_min=%d&study_max=%d" % (study_min, study_max)
+        requests.append(
+            (
+                clients[data.league_admin],
+                "get",
+                "/api/user/ranks_in_range/?college_id=%d&league_branch_id=%d&%s"
+                % (league_branch.college_id, league_branch.id, params),
+                None,
+            )
+        )
+        requests.append(
+            (
+                clients[data.superuser],
+                "get",
+                "/api/college/ranks_in_range/?" + params,
+                None,
+            )
+        )
+        requests.append(
+            (
+                clients[data.superuser],
+                "get",
+                "/api/league_branch/ranks_in_range/?college_id=%d&%s"
+                % (league_branch.college_id, params),
+                None,
+            )
+        )
+    return requests
+
+
+def flash_sale(data, clients, students, rng, num):
+    # 限量商品开始兑换，学生数是库存的两倍
+    now = timezone.now()
+    commodity = Commodity.objects.create(
+        title="限量商品",
+        describe="",
+        location="",
+        cost=1,
+        limit=max(len(students) // 2, 1),
+        start_time=now,
+        deadline=now + datetime.timedelta(days=1),
+    )
+    return [
+        (clients[user], "post", "/api/purchase/", {"commodity": commodity.pk})
+        for user in students
+    ]
+
+
+def export(data, clients, students, rng, num):
+    ids = [period.id for period in data.periods]
+    client = clients[data.superuser]
+    requests = []
+    for _ in range(max(num // 10, 1)):
+        response = client.post(
+            "/api/study_recording/as_excel/?college_id=%d&study_min=%d&study_max=%d"
+            % (data.college.id, ids[0], ids[-1])
+        )
+        requests.append(
+            (client, "get", "/api/study_recording/as_excel/", {"token": response.data})
+        )
+    return requests
+
+
+SCENARIOS = {
+    "checkin": checkin,
+    "leaderboard": leaderboard,
+    "range_report": range_report,
+    "flash_sale": flash_sale,
+    "export": export,
+}
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "在临时数据库中生成模拟数据，通过URL路由发送请求，" "统计各场景的p50/p95/p99延迟和吞吐量，结果可以保存为JSON用于比较不同提交"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale", choices=sorted(SCALES), default="medium", help="模拟数据规模"
+        )
+        parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+        parser.add_argument("--requests", type=int, default=200, help="读取类场景每轮的请求数")
+        parser.add_argument("--students", type=int, default=1000, help="打卡、兑换场景的学生数")
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            choices=sorted(SCENARIOS),
+            help="只运行指定的场景，可以指定多次",
+        )
+        parser.add_argument("--output", help="保存结果的JSON文件，-为标准输出")
+
+    def handle(self, *args, **options):
+        names = options["scenario"] or list(SCENARIOS)
+        rng = random.Random(options["seed"])
+        results = {}
+        with benchmark_database():
+            data = generate(SCALES[options["scale"]], seed=options["seed"])
+            students = list(
+                User.objects.filter(
+                    is_superuser=False, permissions__isnull=True
+                ).order_by("id")[: options["students"]]
+            )
+            clients = Clients()
+            for name in names:
+                requests = SCENARIOS[name](
+                    data, clients, students, rng, options["requests"]
+                )
+                results[name] = result = run_requests(requests)
+                self.stdout.write(
+                    "%-13s %6d 次  %8.1f 次/秒  p50 %7.2f ms  p95 %7.2f ms  "
+                    "p99 %7.2f ms  %s"
+                    % (
+                        name,
+                        result["requests"],
+                        result["throughput"],
+                        result["p50_ms"],
+                        result["p95_ms"],
+                        result["p99_ms"],
+                        result["statuses"],
+                    )
+                )
+            vendor = connection.vendor
+
+        output = options["output"]
+        if output:
+            report = {
+                "commit": get_commit(),
+                "database": vendor,
+                "scale": options["scale"],
+                "seed": options["seed"],
+                "created": timezone.now().isoformat(),
+                "scenarios": results,
+            }
+            if output == "-":
+                self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            else:
+                with open(output, "w") as f:
+                    json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,73 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ....dataset import SCALES, Scale, generate
+from ....store.models import PurchaseRecord
+from ....user.models import User
+from ...models import StudyRecording
+
+
+class Command(BaseCommand):
+    help = (
+        "在当前数据库中生成模拟的学院、团支部、学生、学习记录、商品和兑换记录，"
+        "相同的规模和seed生成的数据相同。"
+        "DEBUG为False或者数据库中已经有用户时需要--force"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale", choices=sorted(SCALES), default="medium", help="数据规模"
+        )
+        parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="在非DEBUG环境或者非空的数据库中也生成数据",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=2000, help="每次bulk_create的行数"
+        )
+        for field in Scale._fields:
+            parser.add_argument(
+                "--" + field.replace("_", "-"),
+                type=int,
+                dest=field,
+                help="覆盖数据规模中的%s" % field,
+            )
+
+    def handle(self, *args, **options):
+        # 避免把模拟数据写入生产数据库
+        if not options["force"]:
+            if not settings.DEBUG:
+                raise CommandError("DEBUG为False，确认不是生产数据库后使用--force")
+            if User.objects.exists():
+                raise CommandError("数据库中已经有用户，确认后使用--force")
+
+        scale = SCALES[options["scale"]]._replace(
+            **{
+                field: options[field]
+                for field in Scale._fields
+                if options[field] is not None
+            }
+        )
+        users = User.objects.count()
+        recordings = StudyRecording.objects.count()
+        purchases = PurchaseRecord.objects.count()
+
+        start = time.perf_counter()
+        generate(scale, seed=options["seed"], batch_size=options["batch_size"])
+        seconds = time.perf_counter() - start
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "%.1fs 生成 %d 名用户、%d 条学习记录、%d 条兑换记录"
+                % (
+                    seconds,
+                    User.objects.count() - users,
+                    StudyRecording.objects.count() - recordings,
+                    PurchaseRecord.objects.count() - purchases,
+                )
+            )
+        )
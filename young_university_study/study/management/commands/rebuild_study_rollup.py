@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...rollup import rebuild
+
+
+class Command(BaseCommand):
+    help = "根据学习记录重建学院、团支部的学习汇总表"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild()
+        self.stdout.write(self.style.SUCCESS("学习汇总表重建完成"))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...jobs import prune_files, run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "执行等待中的导出任务"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="执行完当前等待中的任务后退出")
+        parser.add_argument("--interval", type=float, default=1, help="轮询间隔（秒）")
+        parser.add_argument(
+            "--prune-interval",
+            type=float,
+            default=60,
+            help="清理过期导出文件的间隔（秒）",
+        )
+
+    def handle(self, *args, **options):
+        last_prune = None
+        while True:
+            num = run_pending_jobs()
+            if num:
+                self.stdout.write("完成%d个导出任务" % num)
+            now = time.monotonic()
+            if last_prune is None or now - last_prune >= options["prune_interval"]:
+                last_prune = now
+                num = prune_files()
+                if num:
+                    self.stdout.write("删除%d个过期的导出文件" % num)
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
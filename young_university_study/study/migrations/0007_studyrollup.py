@@ -0,0 +1,50 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:53
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def fill_rollup(apps, schema_editor):
+    StudyRecording = apps.get_model('study', 'StudyRecording')
+    StudyRollup = apps.get_model('study', 'StudyRollup')
+    StudyRollup.objects.bulk_create(
+        StudyRollup(
+            college_id=row['user_id__college'],
+            league_branch_id=row['user_id__league_branch'],
+            study_id=row['study_id'],
+            finished=row['finished'],
+        )
+        for row in StudyRecording.objects.values(
+            'user_id__college', 'user_id__league_branch', 'study_id'
+        )
+        .annotate(finished=Count('id'))
+        .order_by()
+        if row['user_id__college'] is not None
+        or row['user_id__league_branch'] is not None
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0007_totalstudybucket'),
+        ('study', '0006_studyperiod_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudyRollup',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('finished', models.IntegerField(default=0, verbose_name='完成学习的人数')),
+                ('college', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='user.college')),
+                ('league_branch', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='user.leaguebranch')),
+                ('study', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='study.studyperiod')),
+            ],
+            options={
+                'unique_together': {('college', 'league_branch', 'study')},
+            },
+        ),
+        migrations.RunPython(fill_rollup, migrations.RunPython.noop),
+    ]
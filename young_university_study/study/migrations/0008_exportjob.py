@@ -0,0 +1,33 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('study', '0007_studyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('college_id', models.IntegerField(verbose_name='学院，-1为全校')),
+                ('study_min', models.IntegerField()),
+                ('study_max', models.IntegerField()),
+                ('file_format', models.CharField(max_length=10, verbose_name='导出格式')),
+                ('status', models.SmallIntegerField(choices=[(0, '等待中'), (1, '导出中'), (2, '已完成'), (3, '导出失败')], db_index=True, default=0, verbose_name='任务状态')),
+                ('data_version', models.CharField(max_length=50, verbose_name='创建任务时学习记录的版本')),
+                ('file', models.CharField(blank=True, max_length=200, verbose_name='导出文件')),
+                ('error', models.CharField(blank=True, max_length=200, verbose_name='失败原因')),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
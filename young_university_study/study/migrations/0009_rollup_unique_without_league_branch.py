@@ -0,0 +1,40 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:41
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    # 没有团支部的汇总行可能因为同时插入而重复，合并为一行
+    StudyRollup = apps.get_model('study', 'StudyRollup')
+    duplicates = (
+        StudyRollup.objects.filter(league_branch__isnull=True)
+        .values('college_id', 'study_id')
+        .annotate(rows=Count('id'), total=Sum('finished'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    for row in duplicates:
+        rows = StudyRollup.objects.filter(
+            college_id=row['college_id'],
+            league_branch__isnull=True,
+            study_id=row['study_id'],
+        ).order_by('id')
+        keep = rows.first()
+        rows.exclude(pk=keep.pk).delete()
+        StudyRollup.objects.filter(pk=keep.pk).update(finished=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('study', '0008_exportjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='studyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(league_branch__isnull=True), fields=('college', 'study'), name='study_rollup_unique_without_league_branch'),
+        ),
+    ]
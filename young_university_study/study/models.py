@@ -1,4 +1,10 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from ..user.models import User
+from ..versions import track
 
 
 class StudyPeriod(models.Model):
@@ -38,5 +44,91 @@ class StudyRecording(models.Model):
         unique_together = (("user_id", "study_id"),)
 
 
-def get_recording_num(study_min, study_max):
-    return StudyPeriod.objects.filter(id__gte=study_min, id__lte=study_max).count()
+track(StudyPeriod, StudyRecording)
+
+
+def get_continue_study(continue_study, last_study, study_id):
+    """
+    上一次学习的期数为last_study时，学习study_id之后的连续学习期数
+    """
+    if last_study is not None and study_id - last_study == 1:
+        return continue_study + 1
+    return 1
+
+
+@receiver(post_save, sender=StudyRecording)
+def update_continue_study(sender, instance, created, **kwargs):
+    """
+    按照学习记录的创建顺序维护User.continue_study和User.last_study
+    """
+    if created:
+        set_last_study([instance.user_id_id], instance.study_id_id)
+
+
+def set_last_study(user_ids, study_id):
+    """
+    user_ids中的学生学习了study_id，更新连续学习期数
+    """
+    users = User.objects.filter(pk__in=user_ids)
+    users.filter(last_study=study_id - 1).update(
+        continue_study=F("continue_study") + 1, last_study=study_id
+    )
+    users.exclude(last_study=study_id).update(continue_study=1, last_study=study_id)
+
+
+class StudyRollup(models.Model):
+    """
+    按学院、团支部、期数汇总的学习人数，由rollup.py维护
+    """
+
+    id = models.AutoField(primary_key=True)
+    college = models.ForeignKey("user.College", null=True, on_delete=models.CASCADE)
+    league_branch = models.ForeignKey(
+        "user.LeagueBranch", null=True, on_delete=models.CASCADE
+    )
+    study = models.ForeignKey(StudyPeriod, null=False, on_delete=models.CASCADE)
+    finished = models.IntegerField("完成学习的人数", default=0)
+
+    class Meta:
+        unique_together = (("college", "league_branch", "study"),)
+        constraints = [
+            # unique_together中的团支部为NULL时不会冲突，没有团支部的学生单独约束
+            models.UniqueConstraint(
+                fields=["college", "study"],
+                condition=models.Q(league_branch__isnull=True),
+                name="study_rollup_unique_without_league_branch",
+            )
+        ]
+
+
+class ExportJob(models.Model):
+    """
+    学习情况导出任务，由jobs.py在后台生成导出文件
+    """
+
+    PENDING = 0
+    RUNNING = 1
+    FINISHED = 2
+    FAILED = 3
+    STATUS_CHOICES = [
+        (PENDING, "等待中"),
+        (RUNNING, "导出中"),
+        (FINISHED, "已完成"),
+        (FAILED, "导出失败"),
+    ]
+
+    id = models.AutoField(primary_key=True)
+    owner = models.ForeignKey("user.User", null=True, on_delete=models.SET_NULL)
+    college_id = models.IntegerField("学院，-1为全校")
+    study_min = models.IntegerField()
+    study_max = models.IntegerField()
+    file_format = models.CharField("导出格式", max_length=10)
+    status = models.SmallIntegerField(
+        "任务状态", choices=STATUS_CHOICES, default=PENDING, db_index=True
+    )
+    data_version = models.CharField("创建任务时学习记录的版本", max_length=50)
+    file = models.CharField("导出文件", max_length=200, blank=True)
+    error = models.CharField("失败原因", max_length=200, blank=True)
+
+    updated = models.DateTimeField(auto_now=True)
+    created = models.DateTimeField(auto_now_add=True)
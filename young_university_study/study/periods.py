@@ -0,0 +1,58 @@
+"""
+青年大学习期数缓存
+
+所有期数保存在共享缓存中，进程内再保留一份，
+每次读取只需要从共享缓存中取出期数的版本号（见versions），版本号不变时直接使用进程内的数据
+"""
+
+from django.core.cache import cache
+
+from ..versions import VERSION_TIMEOUT, get_version
+from .models import StudyPeriod
+
+PERIOD_LIST_KEY = "study:periods"
+
+# 进程内缓存 (版本号, 所有期数)
+_local = (None, [])
+
+
+def get_periods():
+    """
+    按id排序的所有期数，返回的对象在多个请求间共享，不能修改
+    """
+    global _local
+    version = get_version(StudyPeriod)
+    if _local[0] == version:
+        return _local[1]
+
+    data = cache.get(PERIOD_LIST_KEY)
+    if data is None or data[0] != version:
+        # 先取版本号再查询，查询期间期数变化时版本号也会改变，不会一直使用旧数据
+        data = (version, list(StudyPeriod.objects.order_by("id")))
+        cache.set(PERIOD_LIST_KEY, data, VERSION_TIMEOUT)
+    _local = data
+    return data[1]
+
+
+def get_period_version():
+    """
+    期数的版本号，期数变化后改变
+    """
+    return get_version(StudyPeriod)
+
+
+def get_lastst_period():
+    """
+    最新的一期青年大学习，没有期数时抛出StudyPeriod.DoesNotExist
+    """
+    periods = get_periods()
+    if not periods:
+        raise StudyPeriod.DoesNotExist("StudyPeriod matching query does not exist.")
+    return periods[-1]
+
+
+def get_period_num(study_min, study_max):
+    """
+    [study_min, study_max]中的期数数量
+    """
+    return sum(1 for period in get_periods() if study_min <= period.id <= study_max)
@@ -0,0 +1,145 @@
+"""
+学习汇总表
+
+StudyRollup按(学院, 团支部, 期数)记录完成学习的人数，
+学院、团支部的*_in_range统计只需要对汇总表求和，不再关联所有学习记录
+"""
+
+from collections import Counter
+
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from ..user.models import LeagueBranch, User
+from .models import StudyRecording, StudyRollup
+
+
+def _add(college_id, league_branch_id, study_ids, delta):
+    if college_id is None and league_branch_id is None:
+        # 不属于任何学院、团支部的学习记录不参与统计
+        return
+    rows = StudyRollup.objects.filter(
+        college_id=college_id,
+        league_branch_id=league_branch_id,
+        study_id__in=study_ids,
+    )
+    if delta > 0:
+        existed = set(rows.values_list("study_id", flat=True))
+        # 其他请求可能同时插入了同一行，忽略冲突后再一起更新
+        StudyRollup.objects.bulk_create(
+            (
+                StudyRollup(
+                    college_id=college_id,
+                    league_branch_id=league_branch_id,
+                    study_id=study_id,
+                )
+                for study_id in study_ids
+                if study_id not in existed
+            ),
+            ignore_conflicts=True,
+        )
+    rows.update(finished=F("finished") + delta)
+
+
+def add_recordings(recordings):
+    """
+    批量写入学习记录后更新汇总表（bulk_create不会发送post_save）
+    """
+    finished = Counter(
+        (
+            recording.user_id.college_id,
+            recording.user_id.league_branch_id,
+            recording.study_id_id,
+        )
+        for recording in recordings
+    )
+    for (college_id, league_branch_id, study_id), num in finished.items():
+        _add(college_id, league_branch_id, [study_id], num)
+
+
+def finished_in_range(group, study_min=None, study_max=None):
+    """
+    用于annotate学院或团支部在[study_min, study_max]中的学习人次
+
+    group为"college"或者"league_branch"，不传范围时统计所有期数
+    """
+    rollup = StudyRollup.objects.filter(**{group: OuterRef("pk")})
+    if study_min is not None:
+        rollup = rollup.filter(study_id__gte=study_min)
+    if study_max is not None:
+        rollup = rollup.filter(study_id__lte=study_max)
+    rollup = rollup.order_by().values(group).annotate(total=Sum("finished"))
+    return Coalesce(Subquery(rollup.values("total")), 0)
+
+
+def rebuild():
+    """
+    根据学习记录重建汇总表
+    """
+    StudyRollup.objects.all().delete()
+    StudyRollup.objects.bulk_create(
+        StudyRollup(
+            college_id=row["user_id__college"],
+            league_branch_id=row["user_id__league_branch"],
+            study_id=row["study_id"],
+            finished=row["finished"],
+        )
+        for row in StudyRecording.objects.values(
+            "user_id__college", "user_id__league_branch", "study_id"
+        )
+        .annotate(finished=Count("id"))
+        .order_by()
+        if row["user_id__college"] is not None
+        or row["user_id__league_branch"] is not None
+    )
+
+
+@receiver(post_save, sender=StudyRecording)
+def on_recording_saved(sender, instance, created, **kwargs):
+    if created:
+        user = instance.user_id
+        _add(user.college_id, user.league_branch_id, [instance.study_id_id], 1)
+
+
+@receiver(post_delete, sender=StudyRecording)
+def on_recording_deleted(sender, instance, **kwargs):
+    group = (
+        User.objects.filter(pk=instance.user_id_id)
+        .values_list("college_id", "league_branch_id")
+        .first()
+    )
+    if group is not None:
+        _add(*group, [instance.study_id_id], -1)
+
+
+@receiver(post_save, sender=User)
+def on_user_saved(sender, instance, created, **kwargs):
+    if created:
+        return
+    old_group = (
+        instance.tracker.previous("college_id"),
+        instance.tracker.previous("league_branch_id"),
+    )
+    new_group = (instance.college_id, instance.league_branch_id)
+    if old_group == new_group:
+        return
+    # 学生换了学院或团支部，把他的学习记录转移到新的分组
+    study_ids = list(
+        StudyRecording.objects.filter(user_id=instance).values_list(
+            "study_id", flat=True
+        )
+    )
+    if study_ids:
+        _add(*old_group, study_ids, -1)
+        _add(*new_group, study_ids, 1)
+
+
+@receiver(pre_delete, sender=LeagueBranch)
+def on_league_branch_deleted(sender, instance, **kwargs):
+    # 团支部被删除后学生的团支部会被置空，学习人数转移到学院下
+    for college_id, study_id, finished in StudyRollup.objects.filter(
+        league_branch=instance
+    ).values_list("college_id", "study_id", "finished"):
+        _add(college_id, None, [study_id], finished)
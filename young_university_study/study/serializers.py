@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from .models import StudyPeriod, StudyRecording
+from .models import ExportJob, StudyPeriod, StudyRecording
 
 
 class StudyPeriodSerializer(serializers.ModelSerializer):
@@ -21,3 +21,27 @@ class StudyRecordingListSerializer(serializers.Serializer):
     college_id = serializers.IntegerField()
     study_min = serializers.IntegerField()
     study_max = serializers.IntegerField()
+    file_format = serializers.ChoiceField(choices=["xlsx", "csv"], default="xlsx")
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ExportJob
+        fields = [
+            "id",
+            "college_id",
+            "study_min",
+            "study_max",
+            "file_format",
+            "status",
+            "error",
+            "updated",
+            "created",
+        ]
+        read_only_fields = ["id", "status", "error", "updated", "created"]
+        extra_kwargs = {"file_format": {"default": "xlsx"}}
+
+    def validate_file_format(self, value):
+        if value not in ("xlsx", "csv"):
+            raise serializers.ValidationError("只支持xlsx和csv格式")
+        return value
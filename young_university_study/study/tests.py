@@ -1,11 +1,34 @@
+import csv
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
 from typing import Any
+from unittest import mock
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError
+from django.db.models.query import QuerySet
+from django.test import override_settings
+from django.utils import timezone
+from openpyxl import load_workbook
 from rest_framework import status
 from rest_framework.test import APITestCase
 from young_university_study.study.models import StudyRecording
 
-from ..user.models import User
-from .models import StudyPeriod
+from .. import versions
+from ..dataset import SCALES, generate
+from ..testing import QueryCountTestMixin
+from ..user import leaderboard
+from ..user.models import College, LeagueBranch, User
+from . import checkin, jobs, periods, rollup
+from .export import iter_export_rows
+from .models import ExportJob, StudyPeriod, StudyRollup, get_continue_study
 
 
 class StudyPeriodTests(APITestCase):
@@ -31,6 +54,7 @@ class StudyPeriodTests(APITestCase):
         )
 
     def setUp(self):
+        cache.clear()
         self.client.force_login(user=self.superuser)
 
     def test_period_create(self):
@@ -52,12 +76,58 @@ class StudyPeriodTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 2)
 
+    def test_period_list_not_modified(self):
+        url = "/api/study_period/"
+        response: Any = self.client.get(url, format="json")
+        etag = response["ETag"]
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        StudyPeriod.objects.get(pk=1).delete()
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
     def test_period_lastst(self):
         url = "/api/study_period/lastst/"
         response: Any = self.client.get(url, format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["id"], 2)
 
+    def test_period_lastst_not_modified(self):
+        url = "/api/study_period/lastst/"
+        response: Any = self.client.get(url, format="json")
+        etag = response["ETag"]
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(
+            url, format="json", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # 发布新的一期后ETag改变
+        data = {"season": 1, "period": 3, "name": "test3", "url": "url", "time": 300}
+        self.client.post("/api/study_period/", data, format="json")
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["id"], 3)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_period_cache(self):
+        self.assertEqual(periods.get_lastst_period().id, 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(periods.get_lastst_period().id, 2)
+            self.assertEqual(periods.get_period_num(1, 2), 2)
+
+        StudyPeriod.objects.filter(pk=2).get().delete()
+        self.assertEqual(periods.get_lastst_period().id, 1)
+        self.assertEqual(len(self.client.get("/api/study_period/").data), 1)
+
+        StudyPeriod.objects.all().delete()
+        with self.assertRaises(StudyPeriod.DoesNotExist):
+            periods.get_lastst_period()
+
 
 class StudyPeriodCommonUserTests(APITestCase):
     @classmethod
@@ -231,3 +301,665 @@ class StudyRecordingTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(response.data["score"], 1)
         self.assertEqual(response.data["detail"], "连续学习1期")
+
+    def test_create_counters(self):
+        StudyRecording.objects.create(
+            user_id=self.superuser, study_id=self.study_period5, score=1
+        )
+        url = "/api/study_recording/"
+        response: Any = self.client.post(url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        user = User.objects.get(pk=self.superuser.pk)
+        self.assertEqual(user.total_study, 5)
+        self.assertEqual(user.total_score, 2)
+        self.assertEqual(user.last_study, self.study_period6.id)
+        self.assertEqual(leaderboard.check(), [])
+
+    def test_create_duplicate(self):
+        # 两个同时发送的请求读到的用户都还没有学习过
+        user = User.objects.get(pk=self.superuser.pk)
+        checkin.check_in(user, self.study_period6)
+        with self.assertRaises(checkin.AlreadyStudied):
+            checkin.check_in(user, self.study_period6)
+
+        User.objects.filter(pk=user.pk).update(last_study=None)
+        url = "/api/study_recording/"
+        response: Any = self.client.post(url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(User.objects.get(pk=user.pk).total_study, 5)
+        self.assertEqual(leaderboard.check(), [])
+
+    def test_create_other_integrity_error(self):
+        # post_save中的其他错误不能当作已经学习过
+        user = User.objects.get(pk=self.superuser.pk)
+        with mock.patch(
+            "young_university_study.study.rollup._add", side_effect=IntegrityError
+        ):
+            with self.assertRaises(IntegrityError):
+                checkin.check_in(user, self.study_period6)
+        self.assertFalse(StudyRecording.objects.filter(user_id=user).exists())
+        self.assertEqual(User.objects.get(pk=user.pk).total_study, 4)
+
+    @override_settings(STUDY_RECORDING_WRITE_BEHIND=True)
+    def test_create_write_behind(self):
+        buffer = checkin.RecordingBuffer(interval=0, max_size=2)
+        url = "/api/study_recording/"
+        with mock.patch.object(checkin, "get_buffer", return_value=buffer):
+            response: Any = self.client.post(url, format="json")
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual(response.data["score"], 1)
+            self.assertFalse(StudyRecording.objects.exists())
+
+            response = self.client.post(url, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+            # 缓冲区满时写入数据库
+            self.client.force_login(user=self.user1)
+            response = self.client.post(url, format="json")
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual(len(buffer), 0)
+
+            response = self.client.post(url, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(StudyRecording.objects.count(), 2)
+        user = User.objects.get(pk=self.superuser.pk)
+        self.assertEqual(user.total_study, 5)
+        self.assertEqual(user.last_study, self.study_period6.id)
+        self.assertEqual(user.continue_study, 1)
+        self.assertEqual(leaderboard.check(), [])
+
+    def test_write_behind_ignores_existing(self):
+        buffer = checkin.RecordingBuffer(interval=0, max_size=100)
+        buffer.add(User.objects.get(pk=self.user1.pk), self.study_period6)
+        buffer.add(User.objects.get(pk=self.superuser.pk), self.study_period6)
+        checkin.check_in(User.objects.get(pk=self.user1.pk), self.study_period6)
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(StudyRecording.objects.count(), 2)
+        self.assertEqual(User.objects.get(pk=self.user1.pk).total_study, 3)
+        self.assertEqual(leaderboard.check(), [])
+
+    def test_write_behind_retry(self):
+        buffer = checkin.RecordingBuffer(interval=0, max_size=100)
+        buffer.add(User.objects.get(pk=self.user1.pk), self.study_period6)
+        with mock.patch.object(
+            checkin.rollup, "add_recordings", side_effect=OperationalError
+        ):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        # 写入失败的记录留在缓冲区中，重复的打卡仍然会被拒绝
+        self.assertEqual(len(buffer), 1)
+        self.assertIsNone(
+            buffer.add(User.objects.get(pk=self.user1.pk), self.study_period6)
+        )
+        self.assertFalse(StudyRecording.objects.exists())
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(len(buffer), 0)
+        user = User.objects.get(pk=self.user1.pk)
+        self.assertEqual(user.total_study, 3)
+        self.assertEqual(leaderboard.check(), [])
+
+    def test_write_behind_versions(self):
+        # bulk_create和update不会发送信号，写入后需要更新版本号
+        buffer = checkin.RecordingBuffer(interval=0, max_size=100)
+        buffer.add(User.objects.get(pk=self.user1.pk), self.study_period6)
+        before = versions.get_versions(StudyRecording, User)
+        self.assertEqual(buffer.flush(), 1)
+        after = versions.get_versions(StudyRecording, User)
+        self.assertNotEqual(before[0], after[0])
+        self.assertNotEqual(before[1], after[1])
+
+    def test_write_behind_two_periods(self):
+        # 缓冲区中同一个学生有两期的学习记录
+        buffer = checkin.RecordingBuffer(interval=0, max_size=100)
+        total_score = User.objects.get(pk=self.user1.pk).total_score
+        buffer.add(User.objects.get(pk=self.user1.pk), self.study_period5)
+        # 第二条记录的连续学习期数基于缓冲区中的第一条记录
+        recording = buffer.add(User.objects.get(pk=self.user1.pk), self.study_period6)
+        self.assertEqual(recording.score, 2)
+        self.assertEqual(recording.detail, "连续学习2期")
+
+        self.assertEqual(buffer.flush(), 2)
+        user = User.objects.get(pk=self.user1.pk)
+        self.assertEqual(user.total_study, 4)
+        self.assertEqual(user.last_study, self.study_period6.id)
+        self.assertEqual(user.continue_study, 2)
+        self.assertEqual(user.total_score, total_score + 3)
+        recording = StudyRecording.objects.get(
+            user_id=self.user1.pk, study_id=self.study_period6
+        )
+        self.assertEqual(recording.score, 2)
+        self.assertEqual(recording.detail, "连续学习2期")
+        self.assertEqual(leaderboard.check(), [])
+
+        # 写入后使用数据库中的连续学习期数
+        self.assertEqual(len(buffer._latest), 0)
+
+
+class StudyRollupTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.college1 = College.objects.create(name="test学院1")
+        cls.college2 = College.objects.create(name="test学院2")
+        cls.league_branch1 = LeagueBranch.objects.create(
+            college=cls.college1, name="test团支部1"
+        )
+        cls.league_branch2 = LeagueBranch.objects.create(
+            college=cls.college2, name="test团支部2"
+        )
+        cls.study_period1 = StudyPeriod.objects.create(
+            season=1, period=1, name="test1", url="url", time=300
+        )
+        cls.study_period2 = StudyPeriod.objects.create(
+            season=1, period=2, name="test2", url="url", time=300
+        )
+        cls.user1 = User.objects.create(
+            id=10001,
+            name="test用户1",
+            identity=1,
+            code="111",
+            uid=111,
+            college=cls.college1,
+            league_branch=cls.league_branch1,
+        )
+        cls.user2 = User.objects.create(
+            id=10002,
+            name="test用户2",
+            identity=1,
+            code="112",
+            uid=112,
+            college=cls.college1,
+            league_branch=cls.league_branch1,
+        )
+        for user in (cls.user1, cls.user2):
+            StudyRecording.objects.create(
+                user_id=user, study_id=cls.study_period1, score=1
+            )
+        StudyRecording.objects.create(
+            user_id=cls.user1, study_id=cls.study_period2, score=1
+        )
+
+    def rollup(self):
+        return set(
+            StudyRollup.objects.exclude(finished=0).values_list(
+                "college_id", "league_branch_id", "study_id", "finished"
+            )
+        )
+
+    def test_recording_create(self):
+        self.assertEqual(
+            self.rollup(),
+            {
+                (self.college1.id, self.league_branch1.id, self.study_period1.id, 2),
+                (self.college1.id, self.league_branch1.id, self.study_period2.id, 1),
+            },
+        )
+
+    def test_concurrent_insert(self):
+        for league_branch_id in (self.league_branch1.id, None):
+            args = (self.college1.id, league_branch_id, [self.study_period2.id], 1)
+            rollup._add(*args)
+            # 另一个请求在读取已有的行之后插入了同一行
+            with mock.patch.object(QuerySet, "values_list", return_value=[]):
+                rollup._add(*args)
+        self.assertEqual(
+            self.rollup(),
+            {
+                (self.college1.id, self.league_branch1.id, self.study_period1.id, 2),
+                (self.college1.id, self.league_branch1.id, self.study_period2.id, 3),
+                (self.college1.id, None, self.study_period2.id, 2),
+            },
+        )
+
+    def test_recording_delete(self):
+        StudyRecording.objects.filter(study_id=self.study_period2).delete()
+        self.assertEqual(
+            self.rollup(),
+            {(self.college1.id, self.league_branch1.id, self.study_period1.id, 2)},
+        )
+
+    def test_user_move(self):
+        user = User.objects.get(pk=self.user1.pk)
+        user.college = self.college2
+        user.league_branch = self.league_branch2
+        user.save()
+        self.assertEqual(
+            self.rollup(),
+            {
+                (self.college1.id, self.league_branch1.id, self.study_period1.id, 1),
+                (self.college2.id, self.league_branch2.id, self.study_period1.id, 1),
+                (self.college2.id, self.league_branch2.id, self.study_period2.id, 1),
+            },
+        )
+
+    def test_league_branch_delete(self):
+        LeagueBranch.objects.get(pk=self.league_branch1.pk).delete()
+        self.assertEqual(
+            self.rollup(),
+            {
+                (self.college1.id, None, self.study_period1.id, 2),
+                (self.college1.id, None, self.study_period2.id, 1),
+            },
+        )
+
+    def test_rebuild(self):
+        expected = self.rollup()
+        StudyRollup.objects.all().delete()
+        call_command("rebuild_study_rollup", stdout=StringIO())
+        self.assertEqual(self.rollup(), expected)
+
+    def test_ranks_in_range(self):
+        User.objects.filter(pk=self.user1.pk).update(is_superuser=True)
+        self.client.force_login(user=User.objects.get(pk=self.user1.pk))
+        url = "/api/college/ranks_in_range/?study_min=1&study_max=2"
+        response: Any = self.client.get(url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]["id"], self.college1.id)
+        self.assertEqual(response.data[0]["user_num"], 2)
+        self.assertEqual(response.data[0]["total_study_in_range"], 3)
+        self.assertEqual(response.data[0]["finish_rate"], 0.75)
+        self.assertEqual(response.data[1]["total_study_in_range"], 0)
+
+
+class StudyRecordingExportTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.college1 = College.objects.create(name="test学院1")
+        cls.league_branch1 = LeagueBranch.objects.create(
+            college=cls.college1, name="test团支部1"
+        )
+        cls.study_period1 = StudyPeriod.objects.create(
+            season=1, period=1, name="test1", url="url", time=300
+        )
+        cls.study_period2 = StudyPeriod.objects.create(
+            season=1, period=2, name="test2", url="url", time=300
+        )
+        cls.study_period3 = StudyPeriod.objects.create(
+            season=1, period=3, name="test3", url="url", time=300
+        )
+        cls.user1 = User.objects.create(
+            id=10001,
+            name="test用户1",
+            identity=1,
+            code="111",
+            uid=111,
+            college=cls.college1,
+            league_branch=cls.league_branch1,
+        )
+        cls.superuser = User.objects.create(
+            id=10002,
+            name="super用户",
+            identity=1,
+            code="1111",
+            uid=1111,
+            is_superuser=True,
+        )
+        StudyRecording.objects.create(
+            user_id=cls.user1, study_id=cls.study_period2, score=1
+        )
+        StudyRecording.objects.create(
+            user_id=cls.superuser, study_id=cls.study_period3, score=1
+        )
+
+    def setUp(self):
+        self.client.force_login(user=self.superuser)
+
+    def export(self, college_id, file_format):
+        url = "/api/study_recording/as_excel/?college_id=%d&study_min=2&study_max=3"
+        if file_format is not None:
+            url += "&file_format=" + file_format
+        response: Any = self.client.post(url % college_id, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(
+            "/api/study_recording/as_excel/?token=" + response.data
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b"".join(response.streaming_content)
+
+    def test_export_csv(self):
+        content = self.export(-1, "csv").decode("utf-8-sig")
+        self.assertEqual(
+            list(csv.reader(StringIO(content))),
+            [
+                [
+                    "学号",
+                    "姓名",
+                    "学院",
+                    "团支部",
+                    "第1季第2期完成情况",
+                    "第1季第3期完成情况",
+                ],
+                ["10001", "test用户1", "test学院1", "test团支部1", "已完成", "未完成"],
+                ["10002", "super用户", "", "", "未完成", "已完成"],
+            ],
+        )
+
+    def test_export_xlsx(self):
+        book = load_workbook(BytesIO(self.export(self.college1.id, None)))
+        self.assertEqual(
+            list(book.active.values),
+            [
+                (
+                    "学号",
+                    "姓名",
+                    "学院",
+                    "团支部",
+                    "第1季第2期完成情况",
+                    "第1季第3期完成情况",
+                ),
+                ("10001", "test用户1", "test学院1", "test团支部1", "已完成", "未完成"),
+            ],
+        )
+
+    def test_export_invalid_token(self):
+        response: Any = self.client.get("/api/study_recording/as_excel/?token=xxx")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_rows_in_chunks(self):
+        # 每批学生只需要两次查询
+        with self.assertNumQueries(1 + 2 * 2 + 1):
+            rows = list(iter_export_rows(-1, 2, 3, chunk_size=1))
+        self.assertEqual(len(rows), 3)
+
+
+class ExportJobTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        StudyRecordingExportTests.setUpTestData.__func__(cls)
+
+    def setUp(self):
+        self.client.force_login(user=self.superuser)
+        export_root = tempfile.TemporaryDirectory()
+        self.addCleanup(export_root.cleanup)
+        export_settings = override_settings(EXPORT_ROOT=export_root.name)
+        export_settings.enable()
+        self.addCleanup(export_settings.disable)
+
+    def create_job(self, college_id=-1, file_format="csv"):
+        data = {
+            "college_id": college_id,
+            "study_min": 2,
+            "study_max": 3,
+            "file_format": file_format,
+        }
+        response: Any = self.client.post("/api/export_job/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+
+    def test_job(self):
+        job = self.create_job()
+        self.assertEqual(job["status"], ExportJob.PENDING)
+        url = "/api/export_job/%d/" % job["id"]
+        response: Any = self.client.get(url + "download/")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        call_command("run_export_worker", once=True, stdout=StringIO())
+        response = self.client.get(url)
+        self.assertEqual(response.data["status"], ExportJob.FINISHED)
+
+        response = self.client.get(url + "download/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b"".join(response.streaming_content).decode("utf-8-sig")
+        self.assertEqual(len(list(csv.reader(StringIO(content)))), 3)
+        response.close()
+
+    def test_job_xlsx(self):
+        job = self.create_job(college_id=self.college1.id, file_format="xlsx")
+        self.assertEqual(jobs.run_pending_jobs(), 1)
+        response: Any = self.client.get("/api/export_job/%d/download/" % job["id"])
+        book = load_workbook(BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(book.active.max_row, 2)
+        response.close()
+
+    def test_job_reuse(self):
+        job = self.create_job()
+        self.assertEqual(self.create_job()["id"], job["id"])
+        self.assertNotEqual(self.create_job(file_format="xlsx")["id"], job["id"])
+        jobs.run_pending_jobs()
+        self.assertEqual(self.create_job()["id"], job["id"])
+
+        # 有新的学习记录后重新导出
+        StudyRecording.objects.create(
+            user_id=self.user1, study_id=self.study_period3, score=1
+        )
+        self.assertNotEqual(self.create_job()["id"], job["id"])
+
+    def test_job_data_changed(self):
+        job = self.create_job()
+        jobs.run_pending_jobs()
+
+        # 导出不使用的字段变化时复用已经生成的文件
+        self.user1.total_score += 10
+        self.user1.identity = 2
+        self.user1.save()
+        self.assertEqual(self.create_job()["id"], job["id"])
+
+        # 学生改名后重新导出
+        self.user1.name = "新名字"
+        self.user1.save()
+        new_job = self.create_job()
+        self.assertNotEqual(new_job["id"], job["id"])
+        jobs.run_pending_jobs()
+        response: Any = self.client.get("/api/export_job/%d/download/" % new_job["id"])
+        content = b"".join(response.streaming_content).decode("utf-8-sig")
+        self.assertIn("新名字", content)
+        response.close()
+
+        # 新的期数
+        StudyPeriod.objects.create(
+            season=1, period=10, name="test10", url="url", time=300
+        )
+        self.assertNotEqual(self.create_job()["id"], new_job["id"])
+
+    def test_stale_running_job(self):
+        job = self.create_job()
+        self.assertEqual(jobs.claim_job().id, job["id"])
+        # 执行中的任务没有超时时不会被重新领取，也会被复用
+        self.assertIsNone(jobs.claim_job())
+        self.assertEqual(self.create_job()["id"], job["id"])
+
+        # worker退出后任务执行超时
+        ExportJob.objects.filter(pk=job["id"]).update(
+            updated=timezone.now() - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT + 1)
+        )
+        new_job = self.create_job()
+        self.assertNotEqual(new_job["id"], job["id"])
+        claimed = jobs.claim_job()
+        self.assertEqual(claimed.id, job["id"])
+        self.assertEqual(jobs.claim_job().id, new_job["id"])
+        self.assertIsNone(jobs.claim_job())
+        jobs.run_job(claimed)
+        self.assertEqual(ExportJob.objects.get(pk=job["id"]).status, ExportJob.FINISHED)
+
+    def test_file_missing(self):
+        job = self.create_job()
+        jobs.run_pending_jobs()
+        os.remove(jobs.get_file_path(ExportJob.objects.get(pk=job["id"])))
+        url = "/api/export_job/%d/download/" % job["id"]
+        response: Any = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(ExportJob.objects.get(pk=job["id"]).status, ExportJob.FAILED)
+        self.assertNotEqual(self.create_job()["id"], job["id"])
+
+    def test_file_missing_reuse(self):
+        # 文件被删除后相同参数的任务重新导出
+        job = self.create_job()
+        jobs.run_pending_jobs()
+        os.remove(jobs.get_file_path(ExportJob.objects.get(pk=job["id"])))
+        self.assertNotEqual(self.create_job()["id"], job["id"])
+
+    def test_prune_files(self):
+        old_job = self.create_job()
+        jobs.run_pending_jobs()
+        new_job = self.create_job(file_format="xlsx")
+        jobs.run_pending_jobs()
+        path = jobs.get_file_path(ExportJob.objects.get(pk=old_job["id"]))
+        mtime = time.time() - settings.EXPORT_FILE_MAX_AGE - 1
+        os.utime(path, (mtime, mtime))
+
+        self.assertEqual(jobs.prune_files(), 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(
+            ExportJob.objects.get(pk=old_job["id"]).status, ExportJob.FAILED
+        )
+        self.assertEqual(
+            ExportJob.objects.get(pk=new_job["id"]).status, ExportJob.FINISHED
+        )
+        self.assertNotEqual(self.create_job()["id"], old_job["id"])
+        self.assertEqual(jobs.prune_files(), 0)
+
+    def test_job_permission(self):
+        job = self.create_job()
+        self.client.force_login(user=self.user1)
+        response: Any = self.client.get("/api/export_job/%d/" % job["id"])
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        data = {"college_id": -1, "study_min": 2, "study_max": 3}
+        response = self.client.post("/api/export_job/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+def legacy_get_index(recordings, last_id):
+    """
+    原来StudyRecordingViewSet.get_index的实现，recordings按创建顺序倒序
+    """
+    if len(recordings) == 0:
+        return 1
+    if last_id - recordings[0] != 1:
+        return 1
+    i = 1
+    while True:
+        try:
+            if recordings[i - 1] - recordings[i] != 1:
+                break
+        except Exception:
+            break
+        i += 1
+    return i + 1
+
+
+class ContinueStudyTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.study_periods = [
+            StudyPeriod.objects.create(
+                season=1, period=i, name="test", url="url", time=300
+            )
+            for i in range(1, 13)
+        ]
+        cls.user1 = User.objects.create(
+            id=10001, name="test用户", identity=1, code="111", uid=111
+        )
+
+    def test_equivalence(self):
+        rand = random.Random(0)
+        for _ in range(2000):
+            history = rand.sample(range(1, 20), rand.randint(0, 10))
+            if rand.random() < 0.5:
+                history.sort()
+            continue_study, last_study = 0, None
+            for study_id in history:
+                continue_study = get_continue_study(
+                    continue_study, last_study, study_id
+                )
+                last_study = study_id
+            study_id = rand.randint(1, 21)
+            if study_id in history:
+                continue
+            self.assertEqual(
+                get_continue_study(continue_study, last_study, study_id),
+                legacy_get_index(history[::-1], study_id),
+                (history, study_id),
+            )
+
+    def test_recordings(self):
+        rand = random.Random(1)
+        for _ in range(20):
+            StudyRecording.objects.filter(user_id=self.user1).delete()
+            User.objects.filter(pk=self.user1.pk).update(
+                continue_study=0, last_study=None
+            )
+            periods = rand.sample(self.study_periods, rand.randint(1, 11))
+            if rand.random() < 0.5:
+                periods.sort(key=lambda period: period.id)
+            for period in periods:
+                StudyRecording.objects.create(
+                    user_id=self.user1, study_id=period, score=1
+                )
+
+            user = User.objects.get(pk=self.user1.pk)
+            self.assertEqual(user.last_study, periods[-1].id)
+            history = [period.id for period in reversed(periods[:-1])]
+            self.assertEqual(
+                user.continue_study, legacy_get_index(history, periods[-1].id)
+            )
+
+
+class QueryCountTests(QueryCountTestMixin, APITestCase):
+    def test_study_period(self):
+        self.assertMaxQueries(0, self.data.student, "/api/study_period/")
+        self.assertMaxQueries(0, self.data.student, "/api/study_period/lastst/")
+
+    def test_study_recording(self):
+        self.assertMaxQueries(1, self.data.student, "/api/study_recording/")
+
+
+class DatasetTests(APITestCase):
+    def signature(self, data, num):
+        users = User.objects.filter(
+            id__gte=data.student.id, id__lt=data.student.id + num
+        ).order_by("id")
+        return [
+            (
+                u.league_branch_id is None,
+                u.identity,
+                u.total_study,
+                u.continue_study,
+                u.total_score,
+            )
+            for u in users
+        ]
+
+    @override_settings(DEBUG=True)
+    def test_generate_dataset(self):
+        out = StringIO()
+        call_command(
+            "generate_dataset", "--scale", "small", "--users", "50", stdout=out
+        )
+        # 包括3名管理员
+        self.assertIn("53 名用户", out.getvalue())
+        # 派生数据与学习记录一致
+        self.assertEqual(leaderboard.check(), [])
+        for user in User.objects.all():
+            self.assertEqual(user.recording.count(), user.total_study)
+        self.assertEqual(
+            sum(StudyRollup.objects.values_list("finished", flat=True)),
+            StudyRecording.objects.filter(user_id__college__isnull=False).count(),
+        )
+
+    def test_generate_dataset_guard(self):
+        args = ("generate_dataset", "--scale", "small", "--users", "10")
+        # 测试中DEBUG为False
+        with self.assertRaises(CommandError):
+            call_command(*args, stdout=StringIO())
+        self.assertFalse(User.objects.exists())
+
+        User.objects.create(id=1, name="test", identity=1, code="1", uid=1)
+        with override_settings(DEBUG=True), self.assertRaises(CommandError):
+            call_command(*args, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 1)
+
+        call_command(*args, "--force", stdout=StringIO())
+        self.assertEqual(User.objects.count(), 1 + 10 + 3)
+
+    def test_deterministic(self):
+        num = SCALES["small"].users
+        first = self.signature(generate(SCALES["small"], seed=1), num)
+        second = self.signature(generate(SCALES["small"], seed=1), num)
+        other = self.signature(generate(SCALES["small"], seed=2), num)
+        self.assertEqual(len(first), num)
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
@@ -1,8 +1,9 @@
 from rest_framework.routers import SimpleRouter
 
-from .views import StudyPeriodViewSet, StudyRecordingViewSet
+from .views import ExportJobViewSet, StudyPeriodViewSet, StudyRecordingViewSet
 
 router = SimpleRouter()
 router.register(r"study_period", StudyPeriodViewSet)
 router.register(r"study_recording", StudyRecordingViewSet)
+router.register(r"export_job", ExportJobViewSet)
 urlpatterns = router.urls
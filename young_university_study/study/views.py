@@ -1,21 +1,24 @@
 import datetime
 
 # import grpc
-import django_excel as excel
-
 # from .grpc import api_pb2_grpc, api_pb2
 import jwt
 from django.conf import settings
-from django.db import transaction
+from django.http import FileResponse
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import mixins, permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.status import HTTP_400_BAD_REQUEST
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND
 
+from ..conditional import conditional_response
 from ..user.models import User, user_has_college_permission
-from .models import StudyPeriod, StudyRecording
+from . import checkin, jobs
+from .export import csv_response, iter_export_rows, xlsx_response
+from .models import ExportJob, StudyPeriod, StudyRecording
+from .periods import get_lastst_period, get_period_version, get_periods
 from .serializers import (
+    ExportJobSerializer,
     StudyPeriodSerializer,
     StudyRecordingListSerializer,
     StudyRecordingSerializer,
@@ -47,13 +50,26 @@ class StudyPeriodViewSet(
     permission_classes = (StudyPeriodViewSetPermission,)
 
     @swagger_auto_schema(
-        operation_description="获取最新的一期青年大学习", responses={200: StudyPeriodSerializer()}
+        operation_description="获取最新的一期青年大学习",
+        responses={200: StudyPeriodSerializer()},
     )
     @action(methods=["GET"], detail=False)
     def lastst(self, request):
-        lastst_study = StudyPeriod.objects.latest("id")
-        serializer = self.get_serializer(lastst_study)
-        return Response(serializer.data)
+        lastst_study = get_lastst_period()
+        # 小程序带上If-None-Match或If-Modified-Since时，没有新的一期直接返回304
+        return conditional_response(
+            request,
+            get_period_version(),
+            lambda: Response(self.get_serializer(lastst_study).data),
+            last_modified=int(lastst_study.created.timestamp()),
+        )
+
+    def list(self, request, *args, **kwargs):
+        return conditional_response(
+            request,
+            get_period_version(),
+            lambda: Response(self.get_serializer(get_periods(), many=True).data),
+        )
 
 
 class StudyRecordingViewSet(
@@ -82,6 +98,7 @@ class StudyRecordingViewSet(
                     "college_id": college_id,
                     "study_min": study_min,
                     "study_max": study_max,
+                    "file_format": serializer.validated_data["file_format"],
                     "exp": datetime.datetime.utcnow() + datetime.timedelta(minutes=5),
                 },
                 settings.SECRET_KEY,
@@ -94,78 +111,52 @@ class StudyRecordingViewSet(
                 return Response(status=status.HTTP_403_FORBIDDEN)
 
             try:
-                decoded = jwt.decode(token, settings.SECRET_KEY, algorithm="HS256")
+                decoded = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
             except (jwt.ExpiredSignatureError, jwt.DecodeError):
                 return Response(status=status.HTTP_403_FORBIDDEN)
 
             study_min = decoded["study_min"]
             study_max = decoded["study_max"]
             college_id = decoded["college_id"]
+            file_format = decoded.get("file_format", "xlsx")
 
-            periods = StudyPeriod.objects.filter(id__gte=study_min, id__lte=study_max)
+            rows = iter_export_rows(college_id, study_min, study_max)
+            if file_format == "csv":
+                return csv_response(rows, "main.csv")
+            return xlsx_response(rows, "main.xlsx")
 
-            excel_data = []
-            excel_header = ["学号", "姓名", "学院", "团支部"]
-            for period in periods:
-                excel_header.append("第%d季第%d期完成情况" % (period.season, period.period))
-            excel_data.append(excel_header)
-
-            users = User.objects.select_related("college").select_related(
-                "league_branch"
-            )
-
-            if college_id != -1:
-                users = users.filter(college=college_id)
-
-            users = users.prefetch_related("recording")
-
-            for user in users:
-                excel_iter = ["未完成"] * len(excel_header)
-                excel_iter[0] = str(user.id)
-                excel_iter[1] = user.name
-                excel_iter[2] = user.college.name if user.college is not None else ""
-                excel_iter[3] = (
-                    user.league_branch.name if user.league_branch is not None else ""
-                )
-                for r in user.recording.all():
-                    if study_min <= r.study_id_id <= study_max:
-                        excel_iter[r.study_id_id - periods[0].id + 4] = "已完成"
-
-                excel_data.append(excel_iter)
-
-            sheet = excel.pe.Sheet(excel_data)
-            book = excel.pe.Book({"sheet1": sheet})
-            return excel.make_response(
-                book, "xlsx", file_name="main.xlsx", sheet_name="main"
-            )
-
-    @transaction.atomic
+    @swagger_auto_schema(
+        operation_description=(
+            "学习最新的一期青年大学习。开启STUDY_RECORDING_WRITE_BEHIND时"
+            "学习记录稍后批量写入，返回202，此时记录还没有写入数据库，id为null"
+        ),
+        responses={
+            201: StudyRecordingSerializer(),
+            202: StudyRecordingSerializer(),
+        },
+    )
     def create(self, request, *args, **kwargs):
-        user: User = User.objects.select_for_update().get(pk=request.user.id)
-        lastst_study = StudyPeriod.objects.latest("id")
-        recordings = self.get_queryset().order_by("-id")
-        if len(recordings) == 0:
-            index = 1
-            score = 1
-        else:
-            if recordings[0].study_id.id == lastst_study.id:
+        user: User = request.user
+        lastst_study = get_lastst_period()
+        if user.last_study == lastst_study.id:
+            return Response("已经学习过啦！", status=HTTP_400_BAD_REQUEST)
+
+        if settings.STUDY_RECORDING_WRITE_BEHIND:
+            # 学习记录稍后批量写入，先返回202，返回的记录还没有id
+            recording = checkin.get_buffer().add(user, lastst_study)
+            if recording is None:
                 return Response("已经学习过啦！", status=HTTP_400_BAD_REQUEST)
-            index = self.get_index(recordings, lastst_study.id)
-            score = min(index, 5)
-
-        recording = StudyRecording.objects.create(
-            user_id=user,
-            study_id=lastst_study,
-            score=score,
-            detail="连续学习%d期" % index,
-        )
+            serializer = self.get_serializer(recording)
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+        try:
+            recording = checkin.check_in(user, lastst_study)
+        except checkin.AlreadyStudied:
+            # 同时发送的重复请求
+            return Response("已经学习过啦！", status=HTTP_400_BAD_REQUEST)
 
         # self.send_grpc(recording)
 
-        user.total_score += score
-        user.continue_study = index
-        user.total_study += 1
-        user.save()
         serializer = self.get_serializer(recording)
         headers = self.get_success_headers(serializer.data)
         return Response(
@@ -173,20 +164,52 @@ class StudyRecordingViewSet(
         )
 
     def get_queryset(self):
-        return StudyRecording.objects.filter(user_id=self.request.user)
-
-    # 得到连续签到次数
-    def get_index(self, recordings, last_id):
-        if len(recordings) == 0:
-            return 1
-        if last_id - recordings[0].study_id.id != 1:
-            return 1
-        i = 1
-        while True:
-            try:
-                if recordings[i - 1].study_id.id - recordings[i].study_id.id != 1:
-                    break
-            except Exception:
-                break
-            i += 1
-        return i + 1
+        return StudyRecording.objects.filter(user_id=self.request.user).order_by(
+            "-created"
+        )
+
+
+class ExportJobViewSetPermission(permissions.BasePermission):
+    def has_permission(self, request, view):
+        return request.user.is_authenticated
+
+    def has_object_permission(self, request, view, obj: ExportJob):
+        # 只有校级管理员和对应学院的管理员可以查看
+        return user_has_college_permission(request.user, obj.college_id)
+
+
+class ExportJobViewSet(
+    mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+):
+    queryset = ExportJob.objects.all()
+    serializer_class = ExportJobSerializer
+    permission_classes = (ExportJobViewSetPermission,)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not user_has_college_permission(
+            request.user, serializer.validated_data["college_id"]
+        ):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        job = jobs.enqueue(owner=request.user, **serializer.validated_data)
+        serializer = self.get_serializer(job)
+        headers = self.get_success_headers(serializer.data)
+        return Response(
+            serializer.data, status=status.HTTP_201_CREATED, headers=headers
+        )
+
+    @swagger_auto_schema(operation_description="下载导出任务生成的文件")
+    @action(methods=["GET"], detail=True)
+    def download(self, request, *args, **kwargs):
+        job: ExportJob = self.get_object()
+        if job.status != ExportJob.FINISHED:
+            return Response("导出尚未完成！", status=HTTP_400_BAD_REQUEST)
+        try:
+            f = open(jobs.get_file_path(job), "rb")
+        except FileNotFoundError:
+            # 文件已经过期删除，重新创建任务时会重新导出
+            jobs.mark_file_missing(job)
+            return Response("导出文件已删除，请重新导出！", status=HTTP_404_NOT_FOUND)
+        return FileResponse(f, as_attachment=True, filename="main." + job.file_format)
@@ -0,0 +1,46 @@
+"""
+测试使用的工具
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .dataset import SCALES, generate
+from .versions import bump
+
+
+class QueryCountTestMixin:
+    """
+    查询次数测试，在TEST_DATASET_SCALE规模的模拟数据上检查每个接口的查询次数上限，
+    出现N+1查询时查询次数会随数据量增长而超过上限
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.data = generate(SCALES[settings.TEST_DATASET_SCALE])
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def assertMaxQueries(self, num, user, url, bump_models=()):
+        """
+        user请求url的查询次数不超过num，第一次请求用于预热缓存，不计入查询次数，
+        预热后更新bump_models的版本号，使响应缓存失效，检查的是重新计算时的查询次数
+        """
+        self.client.force_authenticate(user)
+        self.client.get(url)
+        bump(*bump_models)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertLessEqual(
+            len(queries),
+            num,
+            "%s的查询次数超过%d次：\n%s"
+            % (url, num, "\n".join(query["sql"] for query in queries)),
+        )
+        return response
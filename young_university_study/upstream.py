@@ -0,0 +1,173 @@
+"""
+外部服务客户端
+
+每个上游服务使用一个UpstreamClient：连接池复用TCP连接，连接和读取都有超时，
+连续失败时熔断一段时间，期间直接失败而不再占用worker等待上游，
+同时记录请求次数、失败次数和耗时
+"""
+
+import threading
+import time
+import weakref
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class UpstreamError(Exception):
+    """
+    上游服务请求失败（超时、连接失败、5xx）
+    """
+
+
+class CircuitOpenError(UpstreamError):
+    """
+    熔断中，请求没有发送
+    """
+
+
+class CircuitBreaker:
+    """
+    连续失败failure_threshold次后熔断reset_timeout秒，
+    之后放行一个请求试探，成功则恢复，失败则继续熔断
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (
+                self.state == self.OPEN
+                and time.monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                self.state = self.HALF_OPEN
+                return True
+            # 半开状态下只放行一个请求
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class UpstreamMetrics:
+    """
+    请求次数、失败次数、熔断次数以及最近的请求耗时
+    """
+
+    def __init__(self, window=1000):
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.seconds = 0.0
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, error):
+        with self._lock:
+            self.requests += 1
+            self.seconds += seconds
+            self.latencies.append(seconds)
+            if error:
+                self.errors += 1
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+
+            def percentile(p):
+                if not latencies:
+                    return 0.0
+                return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "seconds": self.seconds,
+                "p50": percentile(0.5),
+                "p99": percentile(0.99),
+            }
+
+
+# 所有的UpstreamClient，用于导出指标
+_clients = weakref.WeakSet()
+
+
+def get_upstream_clients():
+    return sorted(_clients, key=lambda client: client.name)
+
+
+class UpstreamClient:
+    """
+    上游服务客户端，可以在多个线程中共用
+    """
+
+    def __init__(
+        self,
+        name,
+        connect_timeout=3,
+        read_timeout=5,
+        pool_size=10,
+        breaker=None,
+    ):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = UpstreamMetrics()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        _clients.add(self)
+
+    def get(self, url, params=None):
+        """
+        发送GET请求，失败时抛出UpstreamError，4xx由调用者处理
+        """
+        if not self.breaker.allow():
+            self.metrics.record_rejected()
+            raise CircuitOpenError("%s暂时不可用" % self.name)
+
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+            if response.status_code >= 500:
+                raise UpstreamError("%s返回%d" % (self.name, response.status_code))
+        except (requests.RequestException, UpstreamError) as e:
+            self.metrics.record(time.perf_counter() - start, True)
+            self.breaker.record_failure()
+            if isinstance(e, UpstreamError):
+                raise
+            raise UpstreamError("%s请求失败：%s" % (self.name, e)) from e
+
+        self.metrics.record(time.perf_counter() - start, False)
+        self.breaker.record_success()
+        return response
@@ -16,6 +16,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 
+from .metrics import metrics_view
 from .store.urls import urlpatterns as store_url
 from .store.views import upload_image
 from .study.urls import urlpatterns as study_url
@@ -25,4 +26,5 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include((user_url + study_url + store_url))),
     path("api/image/", upload_image),
+    path("api/metrics", metrics_view),
 ]
@@ -0,0 +1 @@
+default_app_config = "young_university_study.user.apps.UserConfig"
@@ -2,4 +2,9 @@ from django.apps import AppConfig
 
 
 class UserConfig(AppConfig):
-    name = "user"
+    name = "young_university_study.user"
+    label = "user"
+
+    def ready(self):
+        # 注册signal
+        from . import leaderboard, search, tokens  # noqa: F401
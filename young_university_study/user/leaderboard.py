@@ -0,0 +1,131 @@
+"""
+学生排行榜
+
+按照total_study维护一个直方图（每个总学习期数对应的学生人数），
+排名只需要对直方图求和，不再扫描用户表
+"""
+
+from collections import Counter
+
+from django.db.models import Count, F, Q, Subquery, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import TotalStudyBucket, User
+
+
+def _add(total_study, delta):
+    updated = TotalStudyBucket.objects.filter(total_study=total_study).update(
+        user_num=F("user_num") + delta
+    )
+    if not updated:
+        TotalStudyBucket.objects.get_or_create(total_study=total_study)
+        TotalStudyBucket.objects.filter(total_study=total_study).update(
+            user_num=F("user_num") + delta
+        )
+
+
+def move(old_total_study, new_total_study):
+    """
+    学生的总学习期数从old_total_study变为new_total_study
+    """
+    if old_total_study == new_total_study:
+        return
+    _add(old_total_study, -1)
+    _add(new_total_study, 1)
+
+
+def add_study(total_studies):
+    """
+    总学习期数为total_studies的学生各学习了一期
+    """
+    delta = Counter()
+    for total_study in total_studies:
+        delta[total_study] -= 1
+        delta[total_study + 1] += 1
+    for total_study, num in delta.items():
+        if num:
+            _add(total_study, num)
+
+
+def get_rank(total_study):
+    """
+    返回(排名, 学生总数)，排名为学习期数比自己多的人数+1
+    """
+    result = TotalStudyBucket.objects.aggregate(
+        ahead=Sum("user_num", filter=Q(total_study__gt=total_study)),
+        total=Sum("user_num"),
+    )
+    return (result["ahead"] or 0) + 1, result["total"] or 0
+
+
+def get_group_rank(queryset, pk, field="total_study"):
+    """
+    学院、团支部排名，queryset需要annotate出field字段
+
+    名次为比pk对应分组的field更大的不同取值个数+1，并列的分组名次相同，
+    pk不在queryset中时返回None，整个计算只有一次查询
+    """
+    target = queryset.filter(pk=pk).values(field)
+    result = queryset.aggregate(
+        ahead=Count(
+            field, distinct=True, filter=Q(**{field + "__gt": Subquery(target)})
+        ),
+        found=Count("pk", filter=Q(pk=pk)),
+    )
+    if not result["found"]:
+        return None
+    return result["ahead"] + 1
+
+
+def _count_users():
+    return dict(
+        User.objects.values_list("total_study")
+        .annotate(user_num=Count("id"))
+        .order_by()
+    )
+
+
+def rebuild():
+    """
+    根据用户表重建排行榜
+    """
+    TotalStudyBucket.objects.all().delete()
+    TotalStudyBucket.objects.bulk_create(
+        TotalStudyBucket(total_study=total_study, user_num=user_num)
+        for total_study, user_num in _count_users().items()
+    )
+
+
+def check():
+    """
+    检查排行榜与用户表是否一致，返回[(总学习期数, 用户表人数, 排行榜人数)]
+    """
+    expected = _count_users()
+    actual = dict(
+        TotalStudyBucket.objects.exclude(user_num=0).values_list(
+            "total_study", "user_num"
+        )
+    )
+    return [
+        (total_study, expected.get(total_study, 0), actual.get(total_study, 0))
+        for total_study in sorted(expected.keys() | actual.keys())
+        if expected.get(total_study, 0) != actual.get(total_study, 0)
+    ]
+
+
+@receiver(post_save, sender=User)
+def on_user_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        _add(instance.total_study, 1)
+        return
+    # update_fields中没有total_study时内存中的值没有写入数据库
+    if update_fields is not None and "total_study" not in update_fields:
+        return
+    if instance.tracker.has_changed("total_study"):
+        move(instance.tracker.previous("total_study"), instance.total_study)
+
+
+@receiver(post_delete, sender=User)
+def on_user_deleted(sender, instance, **kwargs):
+    _add(instance.total_study, -1)
@@ -0,0 +1,75 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from ....benchmark import benchmark_database
+from ....stub import StubServer
+from ...models import College, LeagueBranch
+from ...serializers import UserCreateSerializer
+
+
+class SequentialUserCreateSerializer(UserCreateSerializer):
+    """
+    原来的实现：依次请求微信和uid校验服务
+    """
+
+    remote_concurrent = False
+
+
+def register(serializer_class, users, college, league_branch):
+    for i in users:
+        serializer = serializer_class(
+            data={
+                "id": i,
+                "name": "学生%d" % i,
+                "college": college.id,
+                "league_branch": league_branch.id,
+                "identity": 1,
+                "uid": i,
+                "code": str(i),
+            }
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+
+class Command(BaseCommand):
+    help = "使用注入延迟的本地模拟服务，比较依次校验和同时校验时注册的耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20, help="注册的学生人数")
+        parser.add_argument("--latency", type=float, default=0.2, help="模拟服务的延迟（秒）")
+
+    def handle(self, *args, **options):
+        user_num, latency = options["users"], options["latency"]
+        wechat = StubServer(
+            {"/token/wx_info": lambda params: (200, {"openid": params["code"]})},
+            delay=latency,
+        )
+        bj_band = StubServer(
+            {"/rui/bj-band.php": lambda params: (200, "ok")}, delay=latency
+        )
+        with wechat, bj_band, benchmark_database(), override_settings(
+            WECHAT_INFO_URL=wechat.url + "/token/wx_info",
+            UID_VERIFY_URL=bj_band.url + "/rui/bj-band.php",
+        ):
+            college = College.objects.create(name="学院")
+            league_branch = LeagueBranch.objects.create(college=college, name="团支部")
+            for i, (name, serializer_class) in enumerate(
+                (
+                    ("sequential", SequentialUserCreateSerializer),
+                    ("concurrent", UserCreateSerializer),
+                )
+            ):
+                # uid校验结果会被缓存，每轮使用不同的学生
+                cache.clear()
+                users = range(i * user_num + 1, (i + 1) * user_num + 1)
+                start = time.perf_counter()
+                register(serializer_class, users, college, league_branch)
+                seconds = (time.perf_counter() - start) / user_num
+                self.stdout.write(
+                    "%-11s 平均每次注册 %6.0f ms（模拟服务延迟 %.0f ms）"
+                    % (name, seconds * 1000, latency * 1000)
+                )
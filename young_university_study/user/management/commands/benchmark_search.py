@@ -0,0 +1,68 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from ....benchmark import benchmark_database, percentile
+from ....dataset import SCALES, generate
+from ...models import User
+from ...search import search_users
+
+
+def legacy_search(name):
+    """
+    不使用索引，扫描用户表匹配姓名片段
+    """
+    return User.objects.filter(name__contains=name)
+
+
+def ngram_search(name):
+    return search_users(User.objects.all(), name=name)
+
+
+class Command(BaseCommand):
+    help = "在临时数据库中比较扫描用户表和使用n-gram索引搜索姓名片段的耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100000, help="学生人数")
+        parser.add_argument("--queries", type=int, default=200, help="搜索次数")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            generate(
+                SCALES["small"]._replace(
+                    colleges=30,
+                    league_branches=600,
+                    users=options["users"],
+                    periods=1,
+                    commodities=0,
+                    purchases=0,
+                )
+            )
+            rng = random.Random(0)
+            names = list(User.objects.values_list("name", flat=True))
+            queries = []
+            for _ in range(options["queries"]):
+                name = rng.choice(names)
+                # 随机取姓名中相邻的两个字
+                start = rng.randrange(len(name) - 1)
+                queries.append(name[start] + name[start + 1])
+
+            for label, func in (("contains", legacy_search), ("ngram", ngram_search)):
+                latencies = []
+                for query in queries:
+                    begin = time.perf_counter()
+                    users = func(query).order_by("id")
+                    users.count()
+                    list(users[:20])
+                    latencies.append(time.perf_counter() - begin)
+                latencies.sort()
+                self.stdout.write(
+                    "%-9s p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms"
+                    % (
+                        label,
+                        percentile(latencies, 0.5) * 1000,
+                        percentile(latencies, 0.95) * 1000,
+                        percentile(latencies, 0.99) * 1000,
+                    )
+                )
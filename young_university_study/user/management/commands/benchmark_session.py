@@ -0,0 +1,52 @@
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from ....benchmark import benchmark_database
+from ...models import User
+
+ENGINES = (
+    ("db", "django.contrib.sessions.backends.db"),
+    ("cached_db", "django.contrib.sessions.backends.cached_db"),
+    ("cache", "django.contrib.sessions.backends.cache"),
+)
+
+
+class Command(BaseCommand):
+    help = "比较不同session保存方式下登录以及请求/api/user/me/的查询次数和耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="请求次数")
+
+    def handle(self, *args, **options):
+        num = options["requests"]
+        with benchmark_database():
+            user = User.objects.create(id=1, name="学生", identity=1, code="1", uid=1)
+            for name, engine in ENGINES:
+                caches["session"].clear()
+                with override_settings(SESSION_ENGINE=engine):
+                    client = Client(HTTP_HOST="localhost")
+                    with CaptureQueriesContext(connection) as login_queries:
+                        client.force_login(user)
+
+                    # 每个请求开始时会清空connection.queries，需要立即取出结果
+                    login_num = len(login_queries)
+                    # 第一次请求会预热权限、组织结构等缓存，不计入结果
+                    client.get("/api/user/me/")
+                    with CaptureQueriesContext(connection) as me_queries:
+                        client.get("/api/user/me/")
+                    me_num = len(me_queries)
+
+                    start = time.perf_counter()
+                    for _ in range(num):
+                        client.get("/api/user/me/")
+                    seconds = (time.perf_counter() - start) / num
+
+                self.stdout.write(
+                    "%-9s 登录查询 %d 次，/api/user/me/ 每次查询 %d 次、平均 %.2f ms"
+                    % (name, login_num, me_num, seconds * 1000)
+                )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ...leaderboard import check, rebuild
+
+
+class Command(BaseCommand):
+    help = "根据用户表重建学生排行榜，使用--check时只检查两者是否一致"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="只检查，不重建")
+
+    def handle(self, *args, **options):
+        if options["check"]:
+            mismatches = check()
+            for total_study, expected, actual in mismatches:
+                self.stdout.write(
+                    "总学习%d期: 用户表%d人, 排行榜%d人" % (total_study, expected, actual)
+                )
+            if mismatches:
+                raise CommandError("排行榜与用户表不一致，请运行rebuild_leaderboard")
+            self.stdout.write(self.style.SUCCESS("排行榜与用户表一致"))
+            return
+
+        with transaction.atomic():
+            rebuild()
+        self.stdout.write(self.style.SUCCESS("排行榜重建完成"))
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:51
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_buckets(apps, schema_editor):
+    User = apps.get_model('user', 'User')
+    TotalStudyBucket = apps.get_model('user', 'TotalStudyBucket')
+    TotalStudyBucket.objects.bulk_create(
+        TotalStudyBucket(total_study=total_study, user_num=user_num)
+        for total_study, user_num in User.objects.values_list('total_study')
+        .annotate(user_num=Count('id'))
+        .order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0006_auto_20200925_0346'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TotalStudyBucket',
+            fields=[
+                ('total_study', models.IntegerField(primary_key=True, serialize=False, verbose_name='总学习期数')),
+                ('user_num', models.IntegerField(default=0, verbose_name='学生人数')),
+            ],
+        ),
+        migrations.RunPython(fill_buckets, migrations.RunPython.noop),
+    ]
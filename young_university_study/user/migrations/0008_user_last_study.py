@@ -0,0 +1,41 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+def fill_last_study(apps, schema_editor):
+    # 按照学习记录的创建顺序重新计算连续学习期数
+    User = apps.get_model('user', 'User')
+    StudyRecording = apps.get_model('study', 'StudyRecording')
+    streaks = {}
+    recordings = StudyRecording.objects.order_by('id').values_list(
+        'user_id', 'study_id'
+    )
+    for user_id, study_id in recordings.iterator():
+        continue_study, last_study = streaks.get(user_id, (0, None))
+        if last_study is not None and study_id - last_study == 1:
+            continue_study += 1
+        else:
+            continue_study = 1
+        streaks[user_id] = (continue_study, study_id)
+    for user_id, (continue_study, last_study) in streaks.items():
+        User.objects.filter(pk=user_id).update(
+            continue_study=continue_study, last_study=last_study
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0007_totalstudybucket'),
+        ('study', '0008_exportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='last_study',
+            field=models.IntegerField(null=True, verbose_name='最后一次学习的期数'),
+        ),
+        migrations.RunPython(fill_last_study, migrations.RunPython.noop),
+    ]
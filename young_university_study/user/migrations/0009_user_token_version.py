@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0008_user_last_study'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='token_version',
+            field=models.IntegerField(default=0, verbose_name='登录凭证版本'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_tokens(apps, schema_editor):
+    User = apps.get_model('user', 'User')
+    UserSearchToken = apps.get_model('user', 'UserSearchToken')
+    UserSearchToken.objects.bulk_create(
+        (
+            UserSearchToken(user_id=user_id, token=token)
+            for user_id, name in User.objects.values_list('id', 'name').iterator()
+            for token in set(name) | {a + b for a, b in zip(name, name[1:])}
+        ),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0009_user_token_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='name',
+            field=models.CharField(db_index=True, max_length=20, verbose_name='姓名'),
+        ),
+        migrations.CreateModel(
+            name='UserSearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=2, verbose_name='姓名片段')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('token', 'user')},
+            },
+        ),
+        migrations.RunPython(fill_tokens, migrations.RunPython.noop),
+    ]
@@ -5,7 +5,14 @@ from django.contrib.auth.models import (
 )
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from model_utils import FieldTracker
+
+from ..versions import invalidate, track
 
 # Create your models here.
 
@@ -73,7 +80,15 @@ class LeagueBranch(models.Model):
     created = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return "%s-%s" % (self.college.name, self.name)
+        from .org import get_org_tree
+
+        # 学院没有加载时从组织结构缓存中读取学院名，避免每个团支部查询一次学院
+        college_name = None
+        if not LeagueBranch.college.is_cached(self):
+            college_name = get_org_tree().get_college_name(self.college_id)
+        if college_name is None:
+            college_name = self.college.name
+        return "%s-%s" % (college_name, self.name)
 
     class Meta:
         unique_together = (("name", "college"),)
@@ -85,7 +100,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     """
 
     id = models.IntegerField("学号", primary_key=True)
-    name = models.CharField("姓名", max_length=20, null=False)
+    name = models.CharField("姓名", max_length=20, null=False, db_index=True)
     college = models.ForeignKey(
         College, verbose_name="学院", null=True, db_index=True, on_delete=models.SET_NULL
     )
@@ -108,14 +123,29 @@ class User(AbstractBaseUser, PermissionsMixin):
     uid = models.IntegerField("某个uid", null=False, unique=True)
 
     continue_study = models.IntegerField("连续学习期数", default=0)
+    last_study = models.IntegerField("最后一次学习的期数", null=True)
     total_study = models.IntegerField("总学习期数", default=0)
     total_score = models.IntegerField("总积分", default=0)
+    token_version = models.IntegerField("登录凭证版本", default=0)
 
     USERNAME_FIELD = "id"
     REQUIRED_FIELDS = ["name", "code", "uid"]
 
     objects = UserManager()
 
+    # 用于在学院、团支部变化时维护学习汇总表，超级管理员权限变化、停用时使token失效，
+    # 姓名变化时更新搜索索引，总学习期数变化时更新排行榜
+    tracker = FieldTracker(
+        fields=[
+            "college_id",
+            "league_branch_id",
+            "is_superuser",
+            "is_active",
+            "name",
+            "total_study",
+        ]
+    )
+
     def get_full_name(self):
         return self.name
 
@@ -129,6 +159,34 @@ class User(AbstractBaseUser, PermissionsMixin):
     created = models.DateTimeField(auto_now_add=True)
 
 
+# AbstractBaseUser中is_active是类属性True，Django不会为is_active字段设置描述符，
+# FieldTracker包装的是这个类属性，读取到的总是True，这里换成字段的描述符
+User.is_active.descriptor = DeferredAttribute(User._meta.get_field("is_active"))
+
+
+class TotalStudyBucket(models.Model):
+    """
+    学生排行榜，记录每个总学习期数对应的学生人数
+    """
+
+    total_study = models.IntegerField("总学习期数", primary_key=True)
+    user_num = models.IntegerField("学生人数", default=0)
+
+
+class UserSearchToken(models.Model):
+    """
+    姓名的n-gram索引，记录姓名中的每个字和每两个相邻的字，用于按姓名中的片段搜索
+    """
+
+    user = models.ForeignKey(
+        User, related_name="search_tokens", on_delete=models.CASCADE
+    )
+    token = models.CharField("姓名片段", max_length=2)
+
+    class Meta:
+        unique_together = (("token", "user"),)
+
+
 class Permission(models.Model):
     user_id = models.ForeignKey(
         User,
@@ -149,29 +207,102 @@ class Permission(models.Model):
         unique_together = (("user_id", "permission_type", "permission_id"),)
 
 
-def user_has_college_permission(user, college_id):
+# 权限缓存的有效期（秒）
+PERMISSION_CACHE_TIMEOUT = 60 * 60
+
+
+class PermissionSet:
+    """
+    用户拥有权限的学院、团支部
+    """
+
+    def __init__(self, is_superuser, college_ids, league_ids):
+        self.is_superuser = is_superuser
+        self.college_ids = college_ids
+        self.league_ids = league_ids
+
+    def has_college(self, college_id):
+        return self.is_superuser or college_id in self.college_ids
+
+    def user_filter(self):
+        """
+        有权限查看的学生，用于filter
+        """
+        if self.is_superuser:
+            return models.Q()
+        return models.Q(college__in=self.college_ids) | models.Q(
+            league_branch__in=self.league_ids
+        )
+
+    def has_league(self, college_id, league_id):
+        from .org import get_org_tree
+
+        return (
+            self.is_superuser
+            or league_id in self.league_ids
+            or (
+                college_id in self.college_ids
+                and get_org_tree().has_league_branch(college_id, league_id)
+            )
+        )
+
+
+def _permission_cache_key(user_id):
+    from .org import get_org_version
+
+    # 学院、团支部变化时版本号改变，所有用户的缓存一起失效
+    return "user:permissions:%d:%d:%d" % ((user_id,) + get_org_version())
+
+
+def _load_permissions(user_id):
+    college_type = ContentType.objects.get_for_model(College)
+    college_ids, league_ids = set(), set()
+    for permission_type, permission_id in Permission.objects.filter(
+        user_id=user_id
+    ).values_list("permission_type", "permission_id"):
+        if permission_type == college_type.id:
+            college_ids.add(permission_id)
+        else:
+            league_ids.add(permission_id)
+    return college_ids, league_ids
+
+
+def get_permission_set(user):
+    """
+    用户的权限，每个请求只读取一次缓存
+    """
     if user.is_anonymous:
-        return False
-    return (
-        user.is_superuser
-        or user.permissions.filter(
-            permission_type=ContentType.objects.get_for_model(College),
-            permission_id=college_id,
-        ).exists()
-    )
+        return PermissionSet(False, set(), set())
+    permission_set = getattr(user, "_permission_set", None)
+    if permission_set is None:
+        key = _permission_cache_key(user.pk)
+        permissions = cache.get(key)
+        if permissions is None:
+            permissions = _load_permissions(user.pk)
+            cache.set(key, permissions, PERMISSION_CACHE_TIMEOUT)
+        permission_set = PermissionSet(user.is_superuser, *permissions)
+        user._permission_set = permission_set
+    return permission_set
+
+
+def clear_permission_cache(user_id):
+    cache.delete(_permission_cache_key(user_id))
+
+
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def on_permission_changed(sender, instance, **kwargs):
+    invalidate(clear_permission_cache, instance.user_id_id)
+
+
+track(College, LeagueBranch, Permission)
+# 学生的版本号用于缓存全校的排行和导出的文件，只有它们用到的字段变化时才更新
+track(User, fields=["name", "college_id", "league_branch_id", "total_study"])
+
+
+def user_has_college_permission(user, college_id):
+    return get_permission_set(user).has_college(college_id)
 
 
 def user_has_league_permission(user, college_id, league_id):
-    if user.is_anonymous:
-        return False
-    return (
-        user.is_superuser
-        or user.permissions.filter(
-            permission_type=ContentType.objects.get_for_model(LeagueBranch),
-            permission_id=league_id,
-        ).exists()
-        or (
-            user_has_college_permission(user, college_id)
-            and LeagueBranch.objects.filter(id=league_id, college=college_id).exists()
-        )
-    )
+    return get_permission_set(user).has_league(college_id, league_id)
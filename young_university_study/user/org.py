@@ -0,0 +1,63 @@
+"""
+学院、团支部组织结构缓存
+
+组织结构很小且很少变化，整个保存在进程内，
+学院、团支部的版本号（见versions）变化后其他进程重新加载
+"""
+
+from ..versions import get_versions
+from .models import College, LeagueBranch
+
+
+class OrgTree:
+    """
+    colleges为{学院id: 学院名}，league_branches为{团支部id: (学院id, 团支部名)}
+    """
+
+    def __init__(self, version, colleges, league_branches):
+        self.version = version
+        self.colleges = colleges
+        self.league_branches = league_branches
+
+    def get_college_id(self, league_id):
+        """
+        团支部所属的学院，团支部不存在时返回None
+        """
+        league_branch = self.league_branches.get(league_id)
+        return league_branch[0] if league_branch is not None else None
+
+    def get_college_name(self, college_id):
+        return self.colleges.get(college_id)
+
+    def has_league_branch(self, college_id, league_id):
+        """
+        学院中是否有此团支部
+        """
+        return college_id is not None and self.get_college_id(league_id) == college_id
+
+
+_tree = OrgTree(None, {}, {})
+
+
+def get_org_version():
+    return get_versions(College, LeagueBranch)
+
+
+def get_org_tree():
+    """
+    当前的组织结构，返回的对象在多个请求间共享，不能修改
+    """
+    global _tree
+    version = get_org_version()
+    if _tree.version != version:
+        _tree = OrgTree(
+            version,
+            dict(College.objects.values_list("id", "name")),
+            {
+                league_id: (college_id, name)
+                for league_id, college_id, name in LeagueBranch.objects.values_list(
+                    "id", "college", "name"
+                )
+            },
+        )
+    return _tree
@@ -0,0 +1,112 @@
+"""
+学生搜索
+
+姓名按n-gram建立索引（UserSearchToken），搜索姓名中的片段时先用索引找到包含所有片段的学生，
+再用name__contains排除片段顺序不对的结果，不需要扫描整个用户表，SQLite上也可以使用。
+学号按前缀搜索，转换为主键上的范围查询。
+
+索引在学生创建、改名时通过post_save维护，bulk_create之后需要调用rebuild
+"""
+
+from django.db.models import Count, Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import User, UserSearchToken
+
+# 学号最多的位数
+MAX_ID_DIGITS = 10
+
+
+def get_tokens(name):
+    """
+    姓名中的每个字和每两个相邻的字
+    """
+    return set(name) | _bigrams(name)
+
+
+def _bigrams(name):
+    return {a + b for a, b in zip(name, name[1:])}
+
+
+def _query_tokens(name):
+    # 两个字以上时只需要用相邻的两个字查询
+    if len(name) == 1:
+        return {name}
+    return _bigrams(name)
+
+
+def index_users(users):
+    """
+    重新建立users的索引
+    """
+    users = list(users)
+    UserSearchToken.objects.filter(user__in=users).delete()
+    UserSearchToken.objects.bulk_create(
+        UserSearchToken(user=user, token=token)
+        for user in users
+        for token in get_tokens(user.name)
+    )
+
+
+def rebuild(batch_size=2000):
+    """
+    根据用户表重建所有学生的索引
+    """
+    UserSearchToken.objects.all().delete()
+    users = User.objects.only("id", "name").order_by("id")
+    last_id = None
+    while True:
+        batch = users if last_id is None else users.filter(id__gt=last_id)
+        batch = list(batch[:batch_size])
+        if not batch:
+            break
+        UserSearchToken.objects.bulk_create(
+            (
+                UserSearchToken(user=user, token=token)
+                for user in batch
+                for token in get_tokens(user.name)
+            ),
+            batch_size=batch_size,
+        )
+        last_id = batch[-1].id
+
+
+def _id_prefix_q(prefix):
+    """
+    学号以prefix开头，对每种可能的位数生成一个主键范围
+    """
+    q = Q(pk__in=[])
+    # 学号不会以0开头，int会去掉前导0，转换后的范围会包含不相关的学号
+    if prefix.startswith("0"):
+        return q
+    value = int(prefix)
+    for digits in range(len(prefix), MAX_ID_DIGITS + 1):
+        scale = 10 ** (digits - len(prefix))
+        q |= Q(pk__gte=value * scale, pk__lt=(value + 1) * scale)
+    return q
+
+
+def search_users(queryset, name=None, id_prefix=None):
+    """
+    在queryset中搜索姓名包含name、学号以id_prefix开头的学生
+    """
+    if name:
+        tokens = _query_tokens(name)
+        matched = (
+            UserSearchToken.objects.filter(token__in=tokens)
+            .values("user")
+            .annotate(matched=Count("token"))
+            .filter(matched=len(tokens))
+            .values("user")
+        )
+        queryset = queryset.filter(pk__in=matched, name__contains=name)
+    if id_prefix:
+        queryset = queryset.filter(_id_prefix_q(id_prefix))
+    return queryset
+
+
+@receiver(post_save, sender=User)
+def on_user_saved(sender, instance, created, **kwargs):
+    if created or instance.tracker.has_changed("name"):
+        index_users([instance])
@@ -1,20 +1,82 @@
-import requests
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
 from rest_framework import serializers
 
-from ..study.models import get_recording_num
+from ..study.periods import get_period_num
+from ..upstream import UpstreamError
+from . import wechat
 from .models import College, LeagueBranch, Permission, User
+from .org import get_org_tree
+from .uid import verify_uid
+
+# 注册、登录时请求外部服务校验字段的线程池
+_remote_executor = ThreadPoolExecutor(
+    max_workers=settings.REMOTE_VALIDATION_WORKERS, thread_name_prefix="remote"
+)
 
 
-class CodeMixin:
+class RemoteValidationMixin:
+    """
+    需要请求外部服务的字段校验在to_internal_value开始时同时提交到线程池，
+    validate_<字段>中再取出结果，总耗时接近最慢的一个而不是所有请求之和。
+    所有请求共用REMOTE_VALIDATION_TIMEOUT秒的时限
+
+    remote_validators为{字段: (校验函数, 类型转换函数)}，
+    remote_concurrent为False时在validate_<字段>中依次校验
+    """
+
+    remote_validators = {}
+    remote_concurrent = True
+
+    def to_internal_value(self, data):
+        self._remote_deadline = time.monotonic() + settings.REMOTE_VALIDATION_TIMEOUT
+        self._remote_futures = {}
+        if not self.remote_concurrent:
+            return super().to_internal_value(data)
+        for field, (func, convert) in self.remote_validators.items():
+            try:
+                value = convert(data[field])
+            except (KeyError, TypeError, ValueError):
+                # 由字段自己的校验报错
+                continue
+            self._remote_futures[field] = (
+                value,
+                _remote_executor.submit(func, value),
+            )
+        return super().to_internal_value(data)
+
+    def get_remote_result(self, field, value):
+        """
+        字段的外部校验结果，校验函数抛出的异常会原样抛出，超时抛出UpstreamError
+        """
+        func = self.remote_validators[field][0]
+        submitted, future = getattr(self, "_remote_futures", {}).get(
+            field, (None, None)
+        )
+        if future is None or submitted != value:
+            return func(value)
+        try:
+            return future.result(
+                timeout=max(0, self._remote_deadline - time.monotonic())
+            )
+        except FutureTimeoutError:
+            raise UpstreamError("外部校验超时")
+
+
+class CodeMixin(RemoteValidationMixin):
+    remote_validators = {"code": (wechat.get_openid, str)}
+
     def validate_code(self, value):
         """
         检查code
         """
         try:
-            r = requests.get("https://youth.bupt.edu.cn/token/wx_info?code=" + value)
-            data = r.json()
-            return data["openid"]
-        except Exception:
+            return self.get_remote_result("code", value)
+        except UpstreamError:
+            raise serializers.ValidationError("微信登录服务暂时不可用，请稍后重试")
+        except ValueError:
             raise serializers.ValidationError("请输入正确code")
 
 
@@ -72,6 +134,19 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         exclude = ("password", "is_staff", "is_active", "user_permissions", "groups")
 
+    # 权限通过GenericForeignKey关联学院或团支部，prefetch时按权限类型分组，
+    # 每种类型只查询一次，团支部名称中的学院名从组织结构缓存中读取
+    prefetch = ("permissions__permission_name",)
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        批量加载序列化需要的关联对象，用于所有返回用户列表的接口
+        """
+        return queryset.select_related("college", "league_branch").prefetch_related(
+            *cls.prefetch
+        )
+
 
 class UserUpdateSerializer(serializers.ModelSerializer):
     """
@@ -94,20 +169,37 @@ class UserUpdateSerializer(serializers.ModelSerializer):
         if not league_branch:
             raise serializers.ValidationError("请输入团支部")
 
-        if not LeagueBranch.objects.filter(
-            id=league_branch.id, college=college
-        ).exists():
+        if not get_org_tree().has_league_branch(college.id, league_branch.id):
             raise serializers.ValidationError("学院中没有此团支部")
         return data
 
 
-class UserLoginSerializer(serializers.ModelSerializer, CodeMixin):
+class UserLoginSerializer(CodeMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["code"]
 
 
-class UserCreateSerializer(serializers.ModelSerializer, CodeMixin):
+class TokenSerializer(serializers.Serializer):
+    """
+    登录凭证，请求时放在 Authorization: Bearer <token> 中
+    """
+
+    token = serializers.CharField()
+    refresh = serializers.CharField()
+    expires_in = serializers.IntegerField()
+
+
+class TokenRefreshSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+
+
+class UserCreateSerializer(CodeMixin, serializers.ModelSerializer):
+    remote_validators = {
+        **CodeMixin.remote_validators,
+        "uid": (verify_uid, int),
+    }
+
     class Meta:
         model = User
         fields = ["id", "name", "college", "league_branch", "identity", "uid", "code"]
@@ -124,9 +216,11 @@ class UserCreateSerializer(serializers.ModelSerializer, CodeMixin):
         """
         检查uid
         """
-        r = requests.get("http://app.bjtitle.com/rui/bj-band.php?u=%d&t=1" % value)
-
-        if r.text == "参数错误":
+        try:
+            valid = self.get_remote_result("uid", value)
+        except UpstreamError:
+            raise serializers.ValidationError("uid校验服务暂时不可用，请稍后重试")
+        if not valid:
             raise serializers.ValidationError("请正确输入uid")
         return value
 
@@ -139,6 +233,20 @@ class CollegeRequestSerializer(serializers.Serializer):
     college_id = serializers.IntegerField()
 
 
+class UserSearchRequestSerializer(serializers.Serializer):
+    """
+    学生搜索请求，name为姓名中的片段，id为学号的前缀，至少需要一个
+    """
+
+    name = serializers.CharField(required=False, max_length=20)
+    id = serializers.RegexField(r"^[0-9]+$", required=False, max_length=10)
+
+    def validate(self, data):
+        if not data.get("name") and not data.get("id"):
+            raise serializers.ValidationError("请输入姓名或学号")
+        return data
+
+
 class LeagueBranchRequestSerializer(serializers.Serializer):
 
     """
@@ -154,7 +262,7 @@ class RanksMixin(serializers.Serializer):
     RanksMixin
 
     for ranks api
-    加入total_study字段，表示所有学习数量
+    加入total_study字段，表示所有学习数量，没有学生时为0
     """
 
     total_study = serializers.IntegerField()
@@ -220,7 +328,7 @@ class RankInRangeResponseSerializer(serializers.ModelSerializer):
         # Don't pass the 'fields' arg up to the superclass
         study_min = kwargs.pop("study_min", None)
         study_max = kwargs.pop("study_max", None)
-        self.recording_num = get_recording_num(study_min, study_max)
+        self.recording_num = get_period_num(study_min, study_max)
 
         # Instantiate the superclass normally
         super(RankInRangeResponseSerializer, self).__init__(*args, **kwargs)
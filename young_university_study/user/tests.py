@@ -1,19 +1,49 @@
+import base64
+import json
+import tempfile
+import threading
+import time
+from io import StringIO
 from typing import Any
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, models
 from django.db.models import ProtectedError
-from rest_framework import status
-from rest_framework.test import APITestCase
-
+from django.db.models.functions import Coalesce
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status, viewsets
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from .. import response_cache, settings as project_settings
+from ..conditional import ConditionalListMixin
+from ..metrics import registry
+from ..stub import StubServer
 from ..study.models import StudyPeriod, StudyRecording
+from ..testing import QueryCountTestMixin
+from ..upstream import CircuitBreaker, CircuitOpenError, UpstreamClient, UpstreamError
+from ..versions import bump, get_version, get_versions
+from . import leaderboard, search, tokens, uid, wechat
 from .models import (
     College,
     LeagueBranch,
     Permission,
+    TotalStudyBucket,
     User,
+    UserSearchToken,
+    get_permission_set,
     user_has_college_permission,
     user_has_league_permission,
 )
+from .org import get_org_tree
+from .serializers import UserCreateSerializer
 
 
 def setUpTestData(cls):
@@ -164,6 +194,92 @@ class UserPermissionTests(APITestCase):
             )
         )
 
+    def test_permission_cache(self):
+        cache.clear()
+        get_org_tree()
+        permission_set = get_permission_set(User.objects.get(pk=self.user1.pk))
+        self.assertEqual(permission_set.college_ids, {self.college1.id})
+        self.assertEqual(permission_set.league_ids, {self.league_branch2.id})
+
+        # 之后的请求只读取缓存
+        user = User.objects.get(pk=self.user1.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(user_has_college_permission(user, self.college1.id))
+            self.assertFalse(user_has_college_permission(user, self.college2.id))
+            self.assertTrue(
+                user_has_league_permission(
+                    user, self.college1.id, self.league_branch1.id
+                )
+            )
+            self.assertFalse(
+                user_has_league_permission(
+                    user, self.college2.id, self.league_branch1.id
+                )
+            )
+
+    def test_permission_cache_invalidation(self):
+        get_permission_set(User.objects.get(pk=self.user1.pk))
+        permission = Permission.objects.create(
+            user_id=self.user1,
+            permission_type=ContentType.objects.get_for_model(College),
+            permission_id=self.college2.id,
+        )
+        user = User.objects.get(pk=self.user1.pk)
+        self.assertTrue(user_has_college_permission(user, self.college2.id))
+
+        permission.delete()
+        user = User.objects.get(pk=self.user1.pk)
+        self.assertFalse(user_has_college_permission(user, self.college2.id))
+
+        # 学院下新建的团支部
+        league_branch = LeagueBranch.objects.create(
+            college=self.college1, name="test团支部3"
+        )
+        user = User.objects.get(pk=self.user1.pk)
+        self.assertTrue(
+            user_has_league_permission(user, self.college1.id, league_branch.id)
+        )
+
+        league_branch.college = self.college2
+        league_branch.save()
+        user = User.objects.get(pk=self.user1.pk)
+        self.assertFalse(
+            user_has_league_permission(user, self.college1.id, league_branch.id)
+        )
+
+    def test_org_tree(self):
+        tree = get_org_tree()
+        self.assertEqual(tree.get_college_id(self.league_branch2.id), self.college2.id)
+        self.assertIsNone(tree.get_college_id(0))
+        self.assertTrue(
+            tree.has_league_branch(self.college1.id, self.league_branch1.id)
+        )
+        self.assertFalse(
+            tree.has_league_branch(self.college1.id, self.league_branch2.id)
+        )
+
+        # 没有加载学院时不再逐个查询
+        league_branches = list(LeagueBranch.objects.order_by("id"))
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [str(league_branch) for league_branch in league_branches],
+                ["test学院1-test团支部1", "test学院2-test团支部2"],
+            )
+
+        college = College.objects.get(pk=self.college1.pk)
+        college.name = "test学院3"
+        college.save()
+        self.assertEqual(
+            str(LeagueBranch.objects.get(pk=self.league_branch1.pk)),
+            "test学院3-test团支部1",
+        )
+        league_branch = LeagueBranch.objects.create(
+            college=self.college2, name="test团支部3"
+        )
+        self.assertEqual(
+            get_org_tree().get_college_id(league_branch.id), self.college2.id
+        )
+
 
 class SuperUserTests(APITestCase):
     @classmethod
@@ -281,6 +397,12 @@ class SuperUserTests(APITestCase):
         self.assertEqual(len(response.data), 3)
         self.assertTrue("total_study" in response.data[0])
 
+        # 没有学生的学院总学习期数为0，而不是null
+        college = College.objects.create(name="empty学院")
+        response = self.client.get(url, format="json")
+        totals = {c["id"]: c["total_study"] for c in response.data}
+        self.assertEqual(totals[college.id], 0)
+
     def test_college_rank_in_range(self):
         url = "/api/college/rank_in_range/?college_id=1&study_min=1&study_max=1"
         response: Any = self.client.get(url, format="json")
@@ -979,3 +1101,1184 @@ class AnonymousUserTests(APITestCase):
         url = "/api/permission/1/"
         response: Any = self.client.delete(url, format="json")
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class LeaderboardTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        setUpTestData(cls)
+
+    def setUp(self) -> None:
+        # 期数缓存不会随测试回滚
+        cache.clear()
+        self.client.force_login(user=self.user1)
+
+    def test_get_rank(self):
+        self.assertEqual(leaderboard.get_rank(4), (1, 4))
+        self.assertEqual(leaderboard.get_rank(3), (2, 4))
+        self.assertEqual(leaderboard.get_rank(2), (4, 4))
+        self.assertEqual(leaderboard.get_rank(0), (5, 4))
+
+    def test_rank_after_study(self):
+        StudyPeriod.objects.create(season=1, period=3, name="test3", url="url", time=1)
+        response: Any = self.client.post("/api/study_recording/", format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.get("/api/user/rank/", format="json")
+        self.assertEqual(response.data, {"rank": 2, "total": 4})
+        self.assertEqual(leaderboard.check(), [])
+
+    def test_user_create_and_delete(self):
+        user = User.objects.create(
+            id=10005, name="test用户5", identity=1, code="115", uid=115
+        )
+        self.assertEqual(leaderboard.get_rank(0), (5, 5))
+        user.delete()
+        self.assertEqual(leaderboard.get_rank(0), (5, 4))
+        self.assertEqual(leaderboard.check(), [])
+
+    def test_total_study_changed(self):
+        # 后台直接修改总学习期数
+        user = User.objects.get(pk=self.user1.pk)
+        user.total_study = 10
+        user.save()
+        self.assertEqual(leaderboard.get_rank(10), (1, 4))
+        self.assertEqual(leaderboard.check(), [])
+
+        # 没有保存total_study时排行榜不变
+        user.total_study = 20
+        user.save(update_fields=["name"])
+        self.assertEqual(leaderboard.check(), [])
+        user.save(update_fields=["total_study"])
+        self.assertEqual(leaderboard.get_rank(20), (1, 4))
+        self.assertEqual(leaderboard.check(), [])
+
+    def test_check_and_rebuild(self):
+        User.objects.filter(id=self.user1.id).update(total_study=10)
+        self.assertEqual(leaderboard.check(), [(2, 0, 1), (10, 1, 0)])
+        with self.assertRaises(CommandError):
+            call_command("rebuild_leaderboard", check=True, stdout=StringIO())
+
+        call_command("rebuild_leaderboard", stdout=StringIO())
+        self.assertEqual(leaderboard.check(), [])
+        self.assertEqual(leaderboard.get_rank(10), (1, 4))
+        self.assertEqual(TotalStudyBucket.objects.get(total_study=3).user_num, 2)
+
+    def test_get_group_rank(self):
+        colleges = College.objects.annotate(
+            total_study=Coalesce(models.Sum("user__total_study"), 0)
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(leaderboard.get_group_rank(colleges, self.college1.id), 1)
+        self.assertEqual(leaderboard.get_group_rank(colleges, self.college2.id), 2)
+        self.assertEqual(leaderboard.get_group_rank(colleges, self.college3.id), 3)
+
+        # 并列的学院名次相同
+        college = College.objects.create(id=1000, name="test学院1000")
+        User.objects.create(
+            id=10005,
+            name="test用户5",
+            identity=1,
+            code="115",
+            uid=115,
+            college=college,
+            total_study=3,
+        )
+        self.assertEqual(leaderboard.get_group_rank(colleges, college.id), 2)
+        self.assertEqual(leaderboard.get_group_rank(colleges, self.college2.id), 2)
+        self.assertEqual(leaderboard.get_group_rank(colleges, self.college3.id), 3)
+
+    def test_league_branch_rank_large_id(self):
+        league_branch = LeagueBranch.objects.create(
+            id=1000, college=self.college1, name="test团支部1000"
+        )
+        User.objects.create(
+            id=10005,
+            name="test用户5",
+            identity=1,
+            code="115",
+            uid=115,
+            college=self.college1,
+            league_branch=league_branch,
+            total_study=1,
+        )
+        self.client.force_login(user=self.superuser)
+        url = "/api/league_branch/rank/?college_id=1&league_branch_id=1000"
+        response: Any = self.client.get(url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"rank": 2, "total": 5})
+
+    def test_group_rank_not_found(self):
+        colleges = College.objects.annotate(
+            total_study=Coalesce(models.Sum("user__total_study"), 0)
+        )
+        with self.assertNumQueries(1):
+            self.assertIsNone(leaderboard.get_group_rank(colleges, 1000))
+
+        self.client.force_login(user=self.superuser)
+        response: Any = self.client.get("/api/college/rank/?college_id=1000")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        # 团支部不属于这个学院
+        url = "/api/league_branch/rank/?college_id=%d&league_branch_id=%d" % (
+            self.college1.id,
+            self.league_branch2.id,
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+def wx_info(params):
+    if params.get("code") == "bad":
+        return 200, {"errcode": 40029}
+    if params.get("code") == "error":
+        return 502, ""
+    return 200, {"openid": "openid-" + params["code"]}
+
+
+class WeChatTests(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = StubServer({"/token/wx_info": wx_info}).start()
+        cls.url = cls.server.url + "/token/wx_info"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create(
+            id=10001, name="test用户", identity=1, code="openid-111", uid=111
+        )
+
+    def setUp(self):
+        wechat.client.breaker.record_success()
+
+    def test_get_openid(self):
+        with override_settings(WECHAT_INFO_URL=self.url):
+            self.assertEqual(wechat.get_openid("111"), "openid-111")
+            with self.assertRaises(ValueError):
+                wechat.get_openid("bad")
+            with self.assertRaises(UpstreamError):
+                wechat.get_openid("error")
+
+    def test_login(self):
+        url = "/api/user/login/"
+        with override_settings(WECHAT_INFO_URL=self.url):
+            response: Any = self.client.post(url, {"code": "111"}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            response = self.client.post(url, {"code": "bad"}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_timeout(self):
+        client = UpstreamClient("test", read_timeout=0.05)
+        with StubServer({"/": lambda params: (200, "")}, delay=0.5) as server:
+            with self.assertRaises(UpstreamError):
+                client.get(server.url + "/")
+        self.assertEqual(client.metrics.snapshot()["errors"], 1)
+
+    def test_circuit_breaker(self):
+        client = UpstreamClient("test", breaker=CircuitBreaker(2, reset_timeout=60))
+        for _ in range(2):
+            with self.assertRaises(UpstreamError):
+                client.get(self.url, params={"code": "error"})
+
+        # 熔断后不再请求上游
+        hits = self.server.hits
+        with self.assertRaises(CircuitOpenError):
+            client.get(self.url, params={"code": "111"})
+        self.assertEqual(self.server.hits, hits)
+        self.assertEqual(client.metrics.snapshot()["rejected"], 1)
+
+        # 超过reset_timeout后放行一个请求，成功则恢复
+        client.breaker.reset_timeout = 0
+        self.assertEqual(client.get(self.url, params={"code": "111"}).status_code, 200)
+        self.assertEqual(client.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_metrics(self):
+        client = UpstreamClient("test")
+        for _ in range(3):
+            client.get(self.url, params={"code": "111"})
+        metrics = client.metrics.snapshot()
+        self.assertEqual(metrics["requests"], 3)
+        self.assertEqual(metrics["errors"], 0)
+        self.assertGreater(metrics["p99"], 0)
+
+
+def bj_band(params):
+    if params["u"] == "0":
+        return 200, "参数错误"
+    return 200, "ok"
+
+
+class UidTests(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = StubServer(
+            {"/token/wx_info": wx_info, "/rui/bj-band.php": bj_band}
+        ).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.college1 = College.objects.create(name="test学院1")
+        cls.league_branch1 = LeagueBranch.objects.create(
+            college=cls.college1, name="test团支部1"
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.settings = override_settings(
+            WECHAT_INFO_URL=self.server.url + "/token/wx_info",
+            UID_VERIFY_URL=self.server.url + "/rui/bj-band.php",
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+
+    def test_verify_cached(self):
+        hits = self.server.hits
+        self.assertTrue(uid.verify_uid(111))
+        self.assertTrue(uid.verify_uid(111))
+        self.assertFalse(uid.verify_uid(0))
+        self.assertFalse(uid.verify_uid(0))
+        self.assertEqual(self.server.hits, hits + 2)
+
+    def test_register(self):
+        url = "/api/user/"
+        data = {
+            "id": 10001,
+            "name": "test用户",
+            "college": self.college1.id,
+            "league_branch": self.league_branch1.id,
+            "identity": 1,
+            "uid": 111,
+            "code": "111",
+        }
+        response: Any = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(User.objects.get(pk=10001).code, "openid-111")
+
+        data.update(id=10002, uid=0, code="112")
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("uid", response.data)
+
+    @override_settings(
+        UID_VERIFY_BACKEND="young_university_study.user.uid.StubUidBackend"
+    )
+    def test_stub_backend(self):
+        hits = self.server.hits
+        self.assertTrue(uid.verify_uid(0))
+        self.assertEqual(self.server.hits, hits)
+
+    def test_concurrency_limit(self):
+        # 上游变慢时超过并发上限的请求排队超时后失败
+        with StubServer({"/rui/bj-band.php": bj_band}, delay=0.3) as server:
+            with override_settings(
+                UID_VERIFY_URL=server.url + "/rui/bj-band.php",
+                UID_VERIFY_MAX_CONCURRENCY=1,
+                UID_VERIFY_QUEUE_TIMEOUT=0.05,
+            ):
+                verifier = uid.get_verifier()
+                thread = threading.Thread(target=verifier.verify, args=(111,))
+                thread.start()
+                time.sleep(0.1)
+                with self.assertRaises(UpstreamError):
+                    verifier.verify(112)
+                thread.join()
+
+    def test_register_concurrent(self):
+        # 两个外部校验同时进行，注册耗时接近一次请求的延迟
+        routes = {"/token/wx_info": wx_info, "/rui/bj-band.php": bj_band}
+        with StubServer(routes, delay=0.3) as server:
+            with override_settings(
+                WECHAT_INFO_URL=server.url + "/token/wx_info",
+                UID_VERIFY_URL=server.url + "/rui/bj-band.php",
+            ):
+                serializer = UserCreateSerializer(
+                    data={
+                        "id": 10001,
+                        "name": "test用户",
+                        "college": self.college1.id,
+                        "league_branch": self.league_branch1.id,
+                        "identity": 1,
+                        "uid": 111,
+                        "code": "111",
+                    }
+                )
+                start = time.perf_counter()
+                self.assertTrue(serializer.is_valid())
+                self.assertLess(time.perf_counter() - start, 0.5)
+
+                # 超过总时限时两个字段都报错
+                with override_settings(REMOTE_VALIDATION_TIMEOUT=0.1):
+                    serializer = UserCreateSerializer(
+                        data=dict(serializer.initial_data, uid=112, code="112")
+                    )
+                    self.assertFalse(serializer.is_valid())
+                    self.assertEqual(set(serializer.errors), {"code", "uid"})
+
+
+class TokenTests(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = StubServer({"/token/wx_info": wx_info}).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.college1 = College.objects.create(name="test学院1")
+        cls.user1 = User.objects.create(
+            id=10001, name="test用户", identity=1, code="openid-111", uid=111
+        )
+        Permission.objects.create(
+            user_id=cls.user1,
+            permission_type=ContentType.objects.get_for_model(College),
+            permission_id=cls.college1.id,
+        )
+
+    def setUp(self):
+        # token_version的缓存不会随测试回滚
+        cache.clear()
+
+    def get_tokens(self):
+        with override_settings(WECHAT_INFO_URL=self.server.url + "/token/wx_info"):
+            response: Any = self.client.post(
+                "/api/user/token/", {"code": "111"}, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_token(self):
+        token = self.get_tokens()["token"]
+        response: Any = self.client.get(
+            "/api/user/me/", HTTP_AUTHORIZATION="Bearer " + token
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["id"], self.user1.id)
+        self.assertNotIn("sessionid", self.client.cookies)
+
+        response = self.client.get(
+            "/api/user/me/", HTTP_AUTHORIZATION="Bearer " + token + "x"
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_authenticate_without_query(self):
+        token = self.get_tokens()["token"]
+        request = APIRequestFactory().get("/", HTTP_AUTHORIZATION="Bearer " + token)
+        get_permission_set(User.objects.get(pk=self.user1.pk))
+        with self.assertNumQueries(0):
+            user, _ = tokens.TokenAuthentication().authenticate(request)
+            self.assertTrue(user.is_authenticated)
+            self.assertTrue(user_has_college_permission(user, self.college1.id))
+        # 用到其他字段时才读取用户
+        self.assertEqual(user.name, "test用户")
+
+    def test_refresh(self):
+        refresh = self.get_tokens()["refresh"]
+        url = "/api/user/refresh_token/"
+        response: Any = self.client.post(url, {"refresh": refresh}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(
+            "/api/user/me/", HTTP_AUTHORIZATION="Bearer " + response.data["token"]
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # access token不能用来刷新
+        token = self.get_tokens()["token"]
+        response = self.client.post(url, {"refresh": token}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoke(self):
+        data = self.get_tokens()
+        auth = "Bearer " + data["token"]
+        response: Any = self.client.post(
+            "/api/user/revoke_token/", HTTP_AUTHORIZATION=auth
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.get("/api/user/me/", HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(
+            "/api/user/refresh_token/", {"refresh": data["refresh"]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_superuser_changed(self):
+        auth = "Bearer " + self.get_tokens()["token"]
+        user = User.objects.get(pk=self.user1.pk)
+        user.is_superuser = True
+        user.save()
+        response: Any = self.client.get("/api/user/me/", HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_deactivated(self):
+        data = self.get_tokens()
+        user = User.objects.get(pk=self.user1.pk)
+        user.is_active = False
+        user.save()
+
+        response: Any = self.client.get(
+            "/api/user/me/", HTTP_AUTHORIZATION="Bearer " + data["token"]
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(
+            "/api/user/refresh_token/", {"refresh": data["refresh"]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        with override_settings(WECHAT_INFO_URL=self.server.url + "/token/wx_info"):
+            response = self.client.post(
+                "/api/user/token/", {"code": "111"}, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        with self.assertRaises(tokens.InvalidToken):
+            tokens.issue_tokens(user)
+
+
+class SessionEngineTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create(
+            id=10001, name="test用户", identity=1, code="10001", uid=10001
+        )
+
+    def setUp(self):
+        cache.clear()
+        caches["session"].clear()
+
+    def me_queries(self, engine):
+        with override_settings(SESSION_ENGINE=engine):
+            client = self.client_class()
+            client.force_login(self.user1)
+            # 预热权限等缓存
+            client.get("/api/user/me/")
+            with CaptureQueriesContext(connection) as queries:
+                response: Any = client.get("/api/user/me/")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data["id"], self.user1.id)
+            return len(queries)
+
+    def test_cached_session(self):
+        db = self.me_queries("django.contrib.sessions.backends.db")
+        cached_db = self.me_queries("django.contrib.sessions.backends.cached_db")
+        cache_only = self.me_queries("django.contrib.sessions.backends.cache")
+        # 不再需要查询session表
+        self.assertEqual(cached_db, db - 1)
+        self.assertEqual(cache_only, db - 1)
+
+    def test_session_survives_cache_clear(self):
+        with override_settings(SESSION_ENGINE="django.contrib.sessions.backends.cache"):
+            self.client.force_login(self.user1)
+            cache.clear()
+            response: Any = self.client.get("/api/user/me/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cache_max_entries(self):
+        # 超过Django默认的300条后不会随机删除session和版本号
+        for alias in ("default", "session"):
+            caches[alias].set_many({"key%d" % i: i for i in range(1000)})
+            self.assertEqual(
+                len(caches[alias].get_many(["key%d" % i for i in range(1000)])), 1000
+            )
+        with tempfile.TemporaryDirectory() as location:
+            config = project_settings._cache_config("file", "session")
+            file_cache = FileBasedCache(location, config)
+            for i in range(1000):
+                file_cache.set("key%d" % i, i)
+            self.assertEqual(
+                len(file_cache.get_many(["key%d" % i for i in range(1000)])), 1000
+            )
+
+    def test_cache_session_engine(self):
+        # 只保存在缓存中的session需要redis
+        for backend in ("file", "locmem"):
+            with self.assertRaises(ImproperlyConfigured):
+                project_settings._session_engine("cache", backend)
+            self.assertEqual(
+                project_settings._session_engine("cached_db", backend),
+                "django.contrib.sessions.backends.cached_db",
+            )
+        self.assertEqual(
+            project_settings._session_engine("cache", "redis"),
+            "django.contrib.sessions.backends.cache",
+        )
+
+
+class MetricsTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create(
+            id=10001, name="test用户", identity=1, code="10001", uid=10001
+        )
+
+    def setUp(self):
+        registry.clear()
+        self.client.force_login(self.user1)
+
+    @override_settings(METRICS_SAMPLE_RATE=1, METRICS_SERVER_TIMING=True)
+    def test_sampled(self):
+        response: Any = self.client.get("/api/user/me/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("queries", response["Server-Timing"])
+
+        data = registry.snapshot()[("user-me", "GET", 200)]
+        self.assertEqual(data["requests"], 1)
+        self.assertEqual(data["sampled"], 1)
+        self.assertGreater(data["queries"], 0)
+        self.assertGreater(data["render_seconds"], 0)
+        self.assertEqual(data["response_bytes"], len(response.content))
+
+    @override_settings(METRICS_SAMPLE_RATE=1, METRICS_SERVER_TIMING=False)
+    def test_server_timing_hidden(self):
+        response: Any = self.client.get("/api/user/me/")
+        self.assertFalse(response.has_header("Server-Timing"))
+        self.client.logout()
+        response = self.client.get("/api/user/me/")
+        self.assertFalse(response.has_header("Server-Timing"))
+
+        with override_settings(METRICS_ALLOWED_IPS=["127.0.0.1"]):
+            response = self.client.get("/api/user/me/")
+            self.assertTrue(response.has_header("Server-Timing"))
+        admin = User.objects.create(
+            id=10002, name="管理员", identity=1, code="10002", uid=10002, is_superuser=True
+        )
+        token = tokens.issue_tokens(admin)["token"]
+        response = self.client.get(
+            "/api/user/me/", HTTP_AUTHORIZATION="Bearer " + token
+        )
+        self.assertTrue(response.has_header("Server-Timing"))
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        response: Any = self.client.get("/api/user/me/")
+        self.assertFalse(response.has_header("Server-Timing"))
+        data = registry.snapshot()[("user-me", "GET", 200)]
+        self.assertEqual(data["requests"], 1)
+        self.assertEqual(data["sampled"], 0)
+        self.assertEqual(data["queries"], 0)
+
+    @override_settings(METRICS_SAMPLE_RATE=1, METRICS_SLOW_QUERY_MS=0)
+    def test_slow_query(self):
+        with self.assertLogs("young_university_study.metrics", "WARNING"):
+            self.client.get("/api/user/me/")
+        data = registry.snapshot()[("user-me", "GET", 200)]
+        self.assertEqual(data["slow_queries"], data["queries"])
+
+    @override_settings(METRICS_SAMPLE_RATE=1, METRICS_ALLOWED_IPS=["127.0.0.1"])
+    def test_metrics_view(self):
+        self.client.get("/api/user/me/")
+        self.client.logout()
+        response: Any = self.client.get("/api/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        text = response.content.decode()
+        self.assertIn(
+            'http_requests_total{view="user-me",method="GET",status="200"} 1', text
+        )
+        self.assertIn("# TYPE db_queries_total counter", text)
+        self.assertIn('upstream_requests_total{upstream="微信登录服务"}', text)
+
+        with override_settings(METRICS_ALLOWED_IPS=[]):
+            response = self.client.get("/api/metrics")
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+            admin = User.objects.create(
+                id=10002,
+                name="管理员",
+                identity=1,
+                code="10002",
+                uid=10002,
+                is_superuser=True,
+            )
+            self.client.force_login(admin)
+            response = self.client.get("/api/metrics")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            # 小程序使用token登录的超级管理员
+            self.client.logout()
+            token = tokens.issue_tokens(admin)["token"]
+            response = self.client.get(
+                "/api/metrics", HTTP_AUTHORIZATION="Bearer " + token
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            token = tokens.issue_tokens(self.user1)["token"]
+            response = self.client.get(
+                "/api/metrics", HTTP_AUTHORIZATION="Bearer " + token
+            )
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_token(self):
+        self.client.logout()
+        # 默认不允许任何地址
+        response: Any = self.client.get("/api/metrics")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get("/api/metrics", HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get("/api/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with override_settings(METRICS_TOKEN=""):
+            response = self.client.get("/api/metrics", HTTP_AUTHORIZATION="Bearer ")
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class QueryCountTests(QueryCountTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.college_id = self.data.college.id
+        self.league_branch_id = self.data.league_branch.id
+        self.study_min = self.data.periods[0].id
+        self.study_max = self.data.periods[-1].id
+
+    def test_me(self):
+        self.assertMaxQueries(1, self.data.student, "/api/user/me/")
+        self.assertMaxQueries(1, self.data.student, "/api/user/rank/")
+
+    def test_ranks(self):
+        response = self.assertMaxQueries(
+            2,
+            self.data.league_admin,
+            "/api/user/ranks/?college_id=%d&league_branch_id=%d"
+            % (self.college_id, self.league_branch_id),
+        )
+        self.assertGreater(len(response.data), 1)
+        response = self.assertMaxQueries(
+            1,
+            self.data.league_admin,
+            "/api/user/ranks_in_range/?college_id=%d&league_branch_id=%d"
+            "&study_min=%d&study_max=%d"
+            % (self.college_id, self.league_branch_id, self.study_min, self.study_max),
+        )
+        self.assertGreater(len(response.data), 1)
+
+    def test_permission_names(self):
+        # 团支部中的学生都有学院和团支部的权限，权限名称不能每条查询一次
+        college_type = ContentType.objects.get_for_model(College)
+        league_type = ContentType.objects.get_for_model(LeagueBranch)
+        users = User.objects.filter(league_branch=self.league_branch_id)
+        for user in users:
+            Permission.objects.create(
+                user_id=user,
+                permission_type=college_type,
+                permission_id=self.college_id,
+            )
+            Permission.objects.create(
+                user_id=user,
+                permission_type=league_type,
+                permission_id=self.league_branch_id,
+            )
+
+        response = self.assertMaxQueries(
+            4,
+            self.data.league_admin,
+            "/api/user/ranks/?college_id=%d&league_branch_id=%d"
+            % (self.college_id, self.league_branch_id),
+        )
+        names = {p["permission_name"] for u in response.data for p in u["permissions"]}
+        self.assertEqual(names, {self.data.college.name, str(self.data.league_branch)})
+        self.assertMaxQueries(
+            4, self.data.superuser, "/api/user/search/?name=%s" % users[0].name
+        )
+        response = self.assertMaxQueries(3, users[0], "/api/user/me/")
+        self.assertEqual(len(response.data["permissions"]), 2)
+
+    def test_search(self):
+        name = self.data.student.name
+        self.assertMaxQueries(4, self.data.superuser, "/api/user/search/?name=" + name)
+        self.assertMaxQueries(
+            4, self.data.college_admin, "/api/user/search/?name=" + name[0]
+        )
+        self.assertMaxQueries(
+            4, self.data.league_admin, "/api/user/search/?id=%d" % self.data.student.id
+        )
+
+    def test_group_ranks(self):
+        superuser = self.data.superuser
+        # 全校的排行有响应缓存，预热后使缓存失效
+        self.assertMaxQueries(1, superuser, "/api/college/ranks/", (User,))
+        self.assertMaxQueries(
+            1,
+            superuser,
+            "/api/college/ranks_in_range/?study_min=%d&study_max=%d"
+            % (self.study_min, self.study_max),
+            (User,),
+        )
+        self.assertMaxQueries(
+            1, superuser, "/api/league_branch/ranks/?college_id=%d" % self.college_id
+        )
+        self.assertMaxQueries(
+            1, superuser, "/api/league_branch/ranks/?college_id=-1", (User,)
+        )
+        self.assertMaxQueries(
+            1,
+            superuser,
+            "/api/league_branch/ranks_in_range/?college_id=%d"
+            "&study_min=%d&study_max=%d"
+            % (self.college_id, self.study_min, self.study_max),
+        )
+
+    def test_list(self):
+        self.assertMaxQueries(1, self.data.student, "/api/college/")
+        self.assertMaxQueries(1, self.data.student, "/api/league_branch/")
+
+
+class SearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.college1 = College.objects.create(name="test学院1")
+        cls.college2 = College.objects.create(name="test学院2")
+        cls.league_branch1 = LeagueBranch.objects.create(
+            college=cls.college1, name="团支部1"
+        )
+        cls.league_branch2 = LeagueBranch.objects.create(
+            college=cls.college2, name="团支部2"
+        )
+        for i, (name, college, league_branch) in enumerate(
+            (
+                ("王小明", cls.college1, cls.league_branch1),
+                ("李明", cls.college1, cls.league_branch1),
+                ("王明小", cls.college2, cls.league_branch2),
+                ("张三", cls.college2, None),
+            )
+        ):
+            User.objects.create(
+                id=2020211001 + i,
+                name=name,
+                college=college,
+                league_branch=league_branch,
+                identity=1,
+                code="code%d" % i,
+                uid=i + 1,
+            )
+        cls.superuser = User.objects.create(
+            id=1, name="管理员", identity=1, code="admin", uid=100, is_superuser=True
+        )
+        cls.league_admin = User.objects.create(
+            id=2, name="团支书", identity=1, code="league", uid=101
+        )
+        Permission.objects.create(
+            user_id=cls.league_admin,
+            permission_type=ContentType.objects.get_for_model(LeagueBranch),
+            permission_id=cls.league_branch2.id,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, user, params):
+        # 权限会缓存在用户对象上，每次请求使用新的对象
+        self.client.force_authenticate(User.objects.get(pk=user.pk))
+        response: Any = self.client.get("/api/user/search/", params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [u["name"] for u in response.data]
+
+    def test_name(self):
+        self.assertEqual(self.search(self.superuser, {"name": "小明"}), ["王小明"])
+        self.assertEqual(
+            self.search(self.superuser, {"name": "明"}), ["王小明", "李明", "王明小"]
+        )
+        self.assertEqual(self.search(self.superuser, {"name": "王明小"}), ["王明小"])
+        self.assertEqual(self.search(self.superuser, {"name": "明王"}), [])
+        self.assertEqual(self.search(self.superuser, {"name": "小明小"}), [])
+
+    def test_id(self):
+        self.assertEqual(
+            self.search(self.superuser, {"id": "2020211"}),
+            ["王小明", "李明", "王明小", "张三"],
+        )
+        self.assertEqual(self.search(self.superuser, {"id": "2020211002"}), ["李明"])
+        self.assertEqual(
+            self.search(self.superuser, {"id": "2020211", "name": "王"}),
+            ["王小明", "王明小"],
+        )
+        self.assertEqual(self.search(self.superuser, {"id": "3"}), [])
+        for prefix in ("0", "02", "0020211"):
+            self.assertEqual(self.search(self.superuser, {"id": prefix}), [])
+
+    def test_scope(self):
+        # 团支部管理员只能搜索本团支部的学生
+        self.assertEqual(self.search(self.league_admin, {"name": "明"}), ["王明小"])
+
+        Permission.objects.create(
+            user_id=self.league_admin,
+            permission_type=ContentType.objects.get_for_model(College),
+            permission_id=self.college2.id,
+        )
+        self.assertEqual(
+            self.search(self.league_admin, {"id": "2020211"}), ["王明小", "张三"]
+        )
+
+        student = User.objects.get(name="李明")
+        self.assertEqual(self.search(student, {"name": "明"}), [])
+
+    def test_rename(self):
+        user = User.objects.get(name="张三")
+        user.name = "张小明"
+        user.save()
+        self.assertEqual(self.search(self.superuser, {"name": "小明"}), ["王小明", "张小明"])
+        self.assertEqual(self.search(self.superuser, {"name": "三"}), [])
+
+    def test_pagination(self):
+        self.client.force_authenticate(self.superuser)
+        response: Any = self.client.get(
+            "/api/user/search/", {"name": "明", "page_size": 2}
+        )
+        self.assertEqual([u["name"] for u in response.data["results"]], ["王小明", "李明"])
+        response = self.client.get(response.data["next"])
+        self.assertEqual([u["name"] for u in response.data["results"]], ["王明小"])
+        self.assertIsNone(response.data["next"])
+
+    def test_invalid(self):
+        self.client.force_authenticate(self.superuser)
+        for params in ({}, {"id": "abc"}, {"name": ""}):
+            response: Any = self.client.get("/api/user/search/", params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild(self):
+        UserSearchToken.objects.all().delete()
+        search.rebuild(batch_size=2)
+        self.assertEqual(self.search(self.superuser, {"name": "小明"}), ["王小明"])
+        self.assertEqual(
+            UserSearchToken.objects.count(),
+            sum(len(search.get_tokens(u.name)) for u in User.objects.all()),
+        )
+
+
+class KeysetPaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.college1 = College.objects.create(name="test学院1")
+        cls.college2 = College.objects.create(name="test学院2")
+        # 没有学生的学院
+        cls.college3 = College.objects.create(name="test学院3")
+        cls.league_branch = LeagueBranch.objects.create(
+            college=cls.college1, name="团支部1"
+        )
+        LeagueBranch.objects.create(college=cls.college2, name="团支部2")
+        # 学习期数有相同的
+        for i, total_study in enumerate((3, 5, 3, 3, 1, 5, 0)):
+            User.objects.create(
+                id=2020211001 + i,
+                name="学生%d" % i,
+                college=cls.college1 if i % 3 else cls.college2,
+                league_branch=cls.league_branch if i % 3 else None,
+                identity=1,
+                code="code%d" % i,
+                uid=i + 1,
+                total_study=total_study,
+            )
+        cls.superuser = User.objects.create(
+            id=1, name="管理员", identity=1, code="admin", uid=100, is_superuser=True
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.superuser)
+
+    def pages(self, url, params, page_size):
+        response: Any = self.client.get(url, dict(params, page_size=page_size))
+        results = []
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), page_size)
+            results.extend(response.data["results"])
+            if response.data["next"] is None:
+                return results
+            response = self.client.get(response.data["next"])
+
+    def test_ranks(self):
+        params = {
+            "college_id": self.college1.id,
+            "league_branch_id": self.league_branch.id,
+        }
+        response: Any = self.client.get("/api/user/ranks/", params)
+        expected = [u["id"] for u in response.data]
+        self.assertEqual(
+            expected,
+            list(
+                User.objects.filter(league_branch=self.league_branch)
+                .order_by("-total_study", "id")
+                .values_list("id", flat=True)
+            ),
+        )
+        for page_size in (1, 2, 3, 100):
+            results = self.pages("/api/user/ranks/", params, page_size)
+            self.assertEqual([u["id"] for u in results], expected)
+
+    def test_college_ranks(self):
+        response: Any = self.client.get("/api/college/ranks/")
+        self.assertEqual(response.data[-1]["total_study"], 0)
+        results = self.pages("/api/college/ranks/", {}, 1)
+        self.assertEqual(results, response.data)
+
+    def test_invalid_cursor(self):
+        for cursor in ("abc", "WzEsIDJd", "e30="):
+            response: Any = self.client.get("/api/college/", {"cursor": cursor})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_cursor_value(self):
+        # 游标的长度正确，但值的类型不对
+        user_params = {
+            "college_id": self.college1.id,
+            "league_branch_id": self.league_branch.id,
+        }
+        for url, params in (
+            ("/api/user/ranks/", user_params),
+            ("/api/college/ranks/", {}),
+            ("/api/college/", {}),
+        ):
+            response: Any = self.client.get(url, dict(params, page_size=1))
+            cursor = parse_qs(urlparse(response.data["next"]).query)["cursor"][0]
+            length = len(json.loads(base64.urlsafe_b64decode(cursor)))
+            for value in ("abc", [1], {"a": 1}):
+                cursor = base64.urlsafe_b64encode(
+                    json.dumps([value] * length).encode()
+                ).decode()
+                response = self.client.get(url, dict(params, cursor=cursor))
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_without_params(self):
+        response: Any = self.client.get("/api/college/")
+        self.assertEqual(len(response.data), 3)
+        response = self.client.get("/api/college/", {"page_size": 2})
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertIsNotNone(response.data["next"])
+
+
+class ConditionalListTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.college = College.objects.create(name="test学院1")
+        LeagueBranch.objects.create(college=cls.college, name="团支部1")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_not_modified(self):
+        for url in ("/api/college/", "/api/league_branch/"):
+            response: Any = self.client.get(url)
+            etag = response["ETag"]
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response["ETag"], etag)
+
+            # 分页参数不同时ETag不同
+            response = self.client.get(url, {"page_size": 1}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_changed(self):
+        response: Any = self.client.get("/api/college/")
+        college_etag = response["ETag"]
+        response = self.client.get("/api/league_branch/")
+        league_etag = response["ETag"]
+
+        LeagueBranch.objects.create(college=self.college, name="团支部2")
+        response = self.client.get("/api/college/", HTTP_IF_NONE_MATCH=college_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(
+            "/api/league_branch/", HTTP_IF_NONE_MATCH=league_etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+
+    def test_validator_required(self):
+        with self.assertRaises(ImproperlyConfigured):
+
+            class NoValidatorViewSet(ConditionalListMixin, viewsets.GenericViewSet):
+                queryset = College.objects.all()
+
+
+class VersionTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.college = College.objects.create(name="test学院1")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_signal(self):
+        version = get_version(College)
+        self.assertEqual(get_version(College), version)
+
+        league_version = get_version(LeagueBranch)
+        league_branch = LeagueBranch.objects.create(college=self.college, name="团支部")
+        self.assertNotEqual(get_version(LeagueBranch), league_version)
+        # 其他模型的版本号不变
+        self.assertEqual(get_version(College), version)
+
+        league_version = get_version(LeagueBranch)
+        league_branch.delete()
+        self.assertNotEqual(get_version(LeagueBranch), league_version)
+
+    def test_update(self):
+        versions = get_versions(College, User)
+        College.objects.update(name="test学院2")
+        self.assertEqual(get_versions(College, User), versions)
+        bump(College)
+        self.assertNotEqual(get_version(College), versions[0])
+        self.assertEqual(get_version(User), versions[1])
+
+    def test_fields(self):
+        user = User.objects.create(id=1, name="学生", identity=1, code="1", uid=1)
+        version = get_version(User)
+        # 只有track传入的字段变化时才更新
+        user.total_score = 10
+        user.identity = 2
+        user.save()
+        self.assertEqual(get_version(User), version)
+        user.name = "新名字"
+        user.save(update_fields=["total_score"])
+        self.assertEqual(get_version(User), version)
+        user.college = self.college
+        user.save()
+        self.assertNotEqual(get_version(User), version)
+
+        version = get_version(User)
+        user.delete()
+        self.assertNotEqual(get_version(User), version)
+
+    def test_revoke_tokens(self):
+        user = User.objects.create(id=1, name="学生", identity=1, code="1", uid=1)
+        version = get_version(User)
+        # token_version不影响其他数据，不需要使依赖学生版本号的缓存失效
+        tokens.revoke_tokens(user.pk)
+        self.assertEqual(get_version(User), version)
+
+    def test_cache_cleared(self):
+        version = get_version(College)
+        cache.clear()
+        self.assertNotEqual(get_version(College), version)
+
+
+class ResponseCacheTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.college = College.objects.create(name="test学院1")
+        cls.league_branch = LeagueBranch.objects.create(
+            college=cls.college, name="团支部1"
+        )
+        cls.period = StudyPeriod.objects.create(
+            season=1, period=1, name="test1", url="url", time=300
+        )
+        cls.student = User.objects.create(
+            id=2020211001,
+            name="学生",
+            identity=1,
+            code="student",
+            uid=1,
+            college=cls.college,
+            league_branch=cls.league_branch,
+        )
+        cls.superuser = User.objects.create(
+            id=1, name="管理员", identity=1, code="admin", uid=100, is_superuser=True
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.superuser)
+
+    def test_ranks(self):
+        params = {"study_min": self.period.id, "study_max": self.period.id}
+        for url, params in (
+            ("/api/college/ranks/", {}),
+            ("/api/college/ranks_in_range/", params),
+            ("/api/league_branch/ranks/", {"college_id": -1}),
+        ):
+            response: Any = self.client.get(url, params)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url, params).data, response.data)
+
+    def test_invalidation(self):
+        url = "/api/college/ranks_in_range/"
+        params = {"study_min": self.period.id, "study_max": self.period.id}
+        response: Any = self.client.get(url, params)
+        self.assertEqual(response.data[0]["total_study_in_range"], 0)
+        response = self.client.get("/api/league_branch/ranks/", {"college_id": -1})
+        self.assertEqual(response.data[0]["total_study"], 0)
+
+        StudyRecording.objects.create(
+            user_id=self.student, study_id=self.period, score=1
+        )
+        response = self.client.get(url, params)
+        self.assertEqual(response.data[0]["total_study_in_range"], 1)
+        response = self.client.get("/api/league_branch/ranks/", {"college_id": -1})
+        self.assertEqual(response.data[0]["total_study"], 1)
+
+    def test_login(self):
+        url = "/api/college/ranks/"
+        response: Any = self.client.get(url)
+        # 登录时保存last_login，不影响排行
+        Client().force_login(self.student)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).data, response.data)
+
+        self.student.total_study = 1
+        self.student.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data[0]["total_study"], 1)
+
+    def test_stale_while_revalidate(self):
+        calls = []
+
+        def compute():
+            calls.append(None)
+            return len(calls)
+
+        def get():
+            return response_cache.get_or_compute("test", {"id": 1}, (User,), compute)
+
+        self.assertEqual(get(), 1)
+        self.assertEqual(get(), 1)
+
+        # 其他请求正在重新计算时返回旧数据
+        lock_key = response_cache._cache_key("test", {"id": 1}) + ":lock"
+        bump(User)
+        cache.add(lock_key, True)
+        self.assertEqual(get(), 1)
+        cache.delete(lock_key)
+        self.assertEqual(get(), 2)
+        self.assertEqual(get(), 2)
+
+        # 没有旧数据时等待，超时后自己计算
+        cache.delete(response_cache._cache_key("test", {"id": 1}))
+        cache.add(lock_key, True)
+        with mock.patch.object(response_cache, "LOCK_TIMEOUT", 0):
+            self.assertEqual(get(), 3)
+
+    def test_single_flight(self):
+        calls = []
+
+        def compute():
+            calls.append(None)
+            time.sleep(0.2)
+            return len(calls)
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    response_cache.get_or_compute("test", {}, (User,), compute)
+                )
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [1] * 5)
@@ -0,0 +1,172 @@
+"""
+登录凭证
+
+小程序可以不使用session，而是在请求头中带上 Authorization: Bearer <token>。
+token为HS256签名的JWT，包含学号、是否为超级管理员和User.token_version，
+校验时只需要从缓存中读取token_version，不需要查询session表和用户表。
+token_version增加后该用户之前签发的所有token都会失效，停用的用户不能使用和获取token
+"""
+
+import datetime
+
+import jwt
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.functional import SimpleLazyObject
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from ..versions import invalidate
+from .models import User
+
+ACCESS = "access"
+REFRESH = "refresh"
+# token_version的缓存时间（秒）
+TOKEN_VERSION_CACHE_TIMEOUT = 60 * 60
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _token_version_key(user_id):
+    return "user:token_version:%d" % user_id
+
+
+def get_token_version(user_id):
+    """
+    用户的token_version，用户已经被删除或停用时返回None
+    """
+    key = _token_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = (
+            User.objects.filter(pk=user_id, is_active=True)
+            .values_list("token_version", flat=True)
+            .first()
+        )
+        if version is None:
+            return None
+        cache.set(key, version, TOKEN_VERSION_CACHE_TIMEOUT)
+    return version
+
+
+def _clear_token_version(user_id):
+    cache.delete(_token_version_key(user_id))
+
+
+def revoke_tokens(user_id):
+    """
+    使该用户之前签发的所有token失效
+    """
+    User.objects.filter(pk=user_id).update(token_version=F("token_version") + 1)
+    invalidate(_clear_token_version, user_id)
+
+
+def _encode(payload, lifetime):
+    payload["exp"] = datetime.datetime.utcnow() + lifetime
+    return jwt.encode(payload, settings.SECRET_KEY, algorithm="HS256")
+
+
+def issue_tokens(user):
+    """
+    签发access token和refresh token，用户已经停用时抛出InvalidToken
+    """
+    version = get_token_version(user.pk)
+    if version is None:
+        raise InvalidToken("用户已停用")
+    access = _encode(
+        {"typ": ACCESS, "uid": user.pk, "ver": version, "su": user.is_superuser},
+        settings.TOKEN_LIFETIME,
+    )
+    refresh = _encode(
+        {"typ": REFRESH, "uid": user.pk, "ver": version},
+        settings.REFRESH_TOKEN_LIFETIME,
+    )
+    return {
+        "token": access,
+        "refresh": refresh,
+        "expires_in": int(settings.TOKEN_LIFETIME.total_seconds()),
+    }
+
+
+def decode(token, token_type):
+    """
+    校验token并返回其中的内容，失败时抛出InvalidToken
+    """
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        raise InvalidToken("token无效或已过期")
+    if payload.get("typ") != token_type:
+        raise InvalidToken("token类型错误")
+    version = get_token_version(payload["uid"])
+    if version is None or payload.get("ver") != version:
+        raise InvalidToken("token已失效")
+    return payload
+
+
+class TokenUser(SimpleLazyObject):
+    """
+    由token得到的用户，学号和是否为超级管理员直接从token中读取，
+    用到其他字段时才从数据库中读取用户
+    """
+
+    _local_attrs = (
+        "pk",
+        "id",
+        "is_superuser",
+        "is_authenticated",
+        "is_anonymous",
+        "_permission_set",
+    )
+
+    def __init__(self, payload):
+        user_id = payload["uid"]
+        super().__init__(lambda: User.objects.get(pk=user_id))
+        self.__dict__.update(
+            pk=user_id,
+            id=user_id,
+            is_superuser=payload["su"],
+            is_authenticated=True,
+            is_anonymous=False,
+            _permission_set=None,
+        )
+
+    def __setattr__(self, name, value):
+        if name in self._local_attrs:
+            self.__dict__[name] = value
+        else:
+            super().__setattr__(name, value)
+
+
+class TokenAuthentication(BaseAuthentication):
+    keyword = b"bearer"
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword:
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed("token格式错误")
+        try:
+            payload = decode(auth[1].decode(), ACCESS)
+        except (InvalidToken, UnicodeDecodeError) as e:
+            raise exceptions.AuthenticationFailed(str(e))
+        return TokenUser(payload), None
+
+    def authenticate_header(self, request):
+        return "Bearer"
+
+
+@receiver(post_save, sender=User)
+def on_user_saved(sender, instance, created, **kwargs):
+    # 超级管理员权限变化时之前签发的token中的权限已经过时，停用时token也需要失效
+    if not created and (
+        instance.tracker.has_changed("is_superuser")
+        or instance.tracker.has_changed("is_active")
+    ):
+        revoke_tokens(instance.pk)
@@ -0,0 +1,108 @@
+"""
+uid校验
+
+注册时需要向app.bjtitle.com确认uid存在。校验结果（包括失败的结果）缓存一段时间，
+报名期间同一个uid重复注册不再请求上游；同时请求上游的数量有上限，
+上游变慢时多出的请求很快失败，而不是占满所有worker。
+
+校验的实现由UID_VERIFY_BACKEND指定，本地开发和测试可以换成StubUidBackend
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from ..upstream import CircuitBreaker, UpstreamClient, UpstreamError
+
+
+class HttpUidBackend:
+    """
+    请求app.bjtitle.com校验uid
+    """
+
+    def __init__(self):
+        self.client = UpstreamClient(
+            "uid校验服务",
+            connect_timeout=settings.UPSTREAM_CONNECT_TIMEOUT,
+            read_timeout=settings.UPSTREAM_READ_TIMEOUT,
+            pool_size=settings.UID_VERIFY_MAX_CONCURRENCY,
+            breaker=CircuitBreaker(
+                settings.UPSTREAM_BREAKER_FAILURES, settings.UPSTREAM_BREAKER_RESET
+            ),
+        )
+
+    def verify(self, uid):
+        response = self.client.get(settings.UID_VERIFY_URL, params={"u": uid, "t": 1})
+        return response.text != "参数错误"
+
+
+class StubUidBackend:
+    """
+    不请求上游，所有uid都有效
+    """
+
+    def verify(self, uid):
+        return True
+
+
+class UidVerifier:
+    def __init__(self, backend, max_concurrency, queue_timeout):
+        self.backend = backend
+        self.queue_timeout = queue_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+    def verify(self, uid):
+        """
+        uid是否有效，上游服务失败或者排队超时时抛出UpstreamError
+        """
+        key = "user:uid:%d" % uid
+        valid = cache.get(key)
+        if valid is not None:
+            return valid
+
+        if not self._semaphore.acquire(timeout=self.queue_timeout):
+            raise UpstreamError("uid校验服务繁忙")
+        try:
+            valid = self.backend.verify(uid)
+        finally:
+            self._semaphore.release()
+
+        cache.set(
+            key,
+            valid,
+            settings.UID_VERIFY_CACHE_TIMEOUT
+            if valid
+            else settings.UID_VERIFY_NEGATIVE_CACHE_TIMEOUT,
+        )
+        return valid
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_verifier():
+    global _verifier
+    with _verifier_lock:
+        if _verifier is None:
+            _verifier = UidVerifier(
+                import_string(settings.UID_VERIFY_BACKEND)(),
+                settings.UID_VERIFY_MAX_CONCURRENCY,
+                settings.UID_VERIFY_QUEUE_TIMEOUT,
+            )
+        return _verifier
+
+
+def verify_uid(uid):
+    return get_verifier().verify(uid)
+
+
+@receiver(setting_changed)
+def on_setting_changed(setting, **kwargs):
+    global _verifier
+    if setting.startswith("UID_VERIFY_") or setting.startswith("UPSTREAM_"):
+        _verifier = None
@@ -2,21 +2,30 @@ from django.contrib.auth import login
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
-from django.db.models import Q
+from django.db.models import prefetch_related_objects
+from django.db.models.functions import Coalesce
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import mixins, permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.status import HTTP_200_OK
 
+from ..conditional import ConditionalListMixin
+from ..response_cache import get_or_compute
+from ..study.models import StudyPeriod, StudyRecording
+from ..study.rollup import finished_in_range
+from . import leaderboard, tokens
 from .models import (
     College,
     LeagueBranch,
     Permission,
     User,
+    get_permission_set,
     user_has_college_permission,
     user_has_league_permission,
 )
+from .org import get_org_version
+from .search import search_users
 from .serializers import (
     CollegeRankInRangeRequestSerializer,
     CollegeRankInRangeResponseSerializer,
@@ -30,10 +39,13 @@ from .serializers import (
     LeagueRankInRangeResponseSerializer,
     PermissionSerializer,
     RankResponseSerializer,
+    TokenRefreshSerializer,
+    TokenSerializer,
     UserCreateSerializer,
     UserLoginSerializer,
     UserRankInRangeRequestSerializer,
     UserRankInRangeResponseSerializer,
+    UserSearchRequestSerializer,
     UserSerializer,
     UserUpdateSerializer,
 )
@@ -80,8 +92,16 @@ class UserViewSet(
         "update": UserUpdateSerializer,
         "create": UserCreateSerializer,
         "login": UserLoginSerializer,
+        "token": UserLoginSerializer,
+        "refresh_token": TokenRefreshSerializer,
     }
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ("list", "retrieve"):
+            queryset = UserSerializer.setup_eager_loading(queryset)
+        return queryset
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -105,12 +125,60 @@ class UserViewSet(
         login(request, user)
         return Response("", status=status.HTTP_200_OK)
 
+    @swagger_auto_schema(
+        operation_description="使用微信code获取登录凭证，不创建session",
+        request_body=UserLoginSerializer,
+        responses={200: TokenSerializer()},
+    )
+    @action(methods=["POST"], detail=False)
+    def token(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            user = User.objects.get(code=serializer.data["code"])
+            data = tokens.issue_tokens(user)
+        except (tokens.InvalidToken, ObjectDoesNotExist):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+        return Response(data, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="使用refresh token获取新的登录凭证",
+        request_body=TokenRefreshSerializer,
+        responses={200: TokenSerializer()},
+    )
+    @action(methods=["POST"], detail=False)
+    def refresh_token(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            payload = tokens.decode(
+                serializer.validated_data["refresh"], tokens.REFRESH
+            )
+            user = User.objects.get(pk=payload["uid"])
+            data = tokens.issue_tokens(user)
+        except (tokens.InvalidToken, ObjectDoesNotExist):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+        return Response(data, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(operation_description="使当前用户所有的登录凭证失效")
+    @action(methods=["POST"], detail=False)
+    def revoke_token(self, request):
+        if request.user.is_anonymous:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        tokens.revoke_tokens(request.user.pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     @action(methods=["GET", "PUT"], detail=False)
     def me(self, request):
         u = self.request.user
         if u.is_anonymous:
             return Response(status=status.HTTP_403_FORBIDDEN)
         if request.method == "GET":
+            prefetch_related_objects([u], *UserSerializer.prefetch)
             serializer = UserSerializer(u)
             return Response(serializer.data)
         if request.method == "PUT":
@@ -154,30 +222,27 @@ class UserViewSet(
         return Response(status=status.HTTP_200_OK)
 
     @action(methods=["GET"], detail=False)
+    @swagger_auto_schema(
+        operation_description="在有权限的学生中按姓名片段、学号前缀搜索，传入page_size或cursor时分页返回",
+        query_serializer=UserSearchRequestSerializer,
+        responses={200: UserSerializer(many=True)},
+    )
     def search(self, request):
-        name = self.request.query_params.get("name", None)
-        if name is None:
-            return Response(status.HTTP_400_BAD_REQUEST)
-
-        users = User.objects.all()
-        if not self.request.user.is_superuser:
-            QQ = Q(id=0)
-            for p in self.request.user.permissions.all():
-                if p.permission_type == ContentType.objects.get_for_model(College):
-                    QQ = QQ | Q(college=p.permission_id)
-                elif p.permission_type == ContentType.objects.get_for_model(
-                    LeagueBranch
-                ):
-                    QQ = QQ | Q(leagur_branch=p.permission_id)
-
-            users = users.filter(QQ)
-
-        users = (
-            users.filter(name=name)
-            .select_related("college")
-            .select_related("league_branch")
-            .prefetch_related("permissions")
-        )
+        serializer = UserSearchRequestSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        users = search_users(
+            User.objects.filter(get_permission_set(request.user).user_filter()),
+            name=serializer.validated_data.get("name"),
+            id_prefix=serializer.validated_data.get("id"),
+        ).order_by("id")
+        users = UserSerializer.setup_eager_loading(users)
+
+        page = self.paginate_queryset(users)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
         serializer = self.get_serializer(users, many=True)
         return Response(serializer.data)
 
@@ -187,10 +252,7 @@ class UserViewSet(
         responses={200: RankResponseSerializer()},
     )
     def rank(self, request):
-        rank = (
-            User.objects.filter(total_study__gt=request.user.total_study).count() + 1
-        )  # 计算为前面有多少人，所以+1
-        total = User.objects.all().count()
+        rank, total = leaderboard.get_rank(request.user.total_study)
         return Response({"rank": rank, "total": total}, status=HTTP_200_OK)
 
     @action(methods=["GET"], detail=False)
@@ -210,11 +272,10 @@ class UserViewSet(
         if not user_has_league_permission(u, college_id, league_branch_id):
             return Response(status=status.HTTP_403_FORBIDDEN)
 
-        queryset = (
-            User.objects.filter(college=college_id, league_branch=league_branch_id)
-            .select_related("college")
-            .select_related("league_branch")
-            .prefetch_related("permissions")
+        queryset = UserSerializer.setup_eager_loading(
+            User.objects.filter(
+                college=college_id, league_branch=league_branch_id
+            ).order_by("-total_study")
         )
 
         page = self.paginate_queryset(queryset)
@@ -275,6 +336,7 @@ class UserViewSet(
 
 
 class CollegeViewSet(
+    ConditionalListMixin,
     mixins.CreateModelMixin,
     mixins.DestroyModelMixin,
     mixins.ListModelMixin,
@@ -288,6 +350,7 @@ class CollegeViewSet(
         "rank_in_range": LeagueRankInRangeRequestSerializer,
         "ranks_in_range": CollegeRankInRangeRequestSerializer,
     }
+    list_validator = staticmethod(get_org_version)
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -323,17 +386,14 @@ class CollegeViewSet(
             return Response(status=status.HTTP_403_FORBIDDEN)
 
         total = College.objects.count()
-        rank = 1
-        # TODO 优化这个for
-        for c in (
-            College.objects.annotate(total_study=models.Sum("user__total_study"))
-            .order_by("-total_study")
-            .all()
-            .iterator()
-        ):
-            if c.id is serializer.validated_data["college_id"]:
-                break
-            rank += 1
+        rank = leaderboard.get_group_rank(
+            College.objects.annotate(
+                total_study=Coalesce(models.Sum("user__total_study"), 0)
+            ),
+            serializer.validated_data["college_id"],
+        )
+        if rank is None:
+            return Response("学院不存在！", status=status.HTTP_404_NOT_FOUND)
         return Response({"rank": rank, "total": total}, status=HTTP_200_OK)
 
     @action(methods=["GET"], detail=False)
@@ -346,7 +406,7 @@ class CollegeViewSet(
             return Response(status=status.HTTP_403_FORBIDDEN)
 
         queryset = College.objects.annotate(
-            total_study=models.Sum("user__total_study")
+            total_study=Coalesce(models.Sum("user__total_study"), 0)
         ).order_by("-total_study")
 
         page = self.paginate_queryset(queryset)
@@ -354,8 +414,14 @@ class CollegeViewSet(
             serializer = CollegeRanksResponseSerializer(page, many=True)
             return self.get_paginated_response(serializer.data)
 
-        serializer = CollegeRanksResponseSerializer(queryset, many=True)
-        return Response(serializer.data)
+        # 全校的排行缓存到学院或学生变化
+        data = get_or_compute(
+            "college:ranks",
+            {},
+            (College, User),
+            lambda: CollegeRanksResponseSerializer(queryset, many=True).data,
+        )
+        return Response(data)
 
     @action(methods=["GET"], detail=False)
     @swagger_auto_schema(
@@ -374,15 +440,8 @@ class CollegeViewSet(
         study_max = serializer.validated_data["study_max"]
 
         queryset = College.objects.annotate(
-            user_num=models.Count("user__id", distinct=True),
-            total_study_in_range=models.Count(
-                "user__recording__id",
-                distinct=True,
-                filter=models.Q(
-                    user__recording__study_id__gte=study_min,
-                    user__recording__study_id__lte=study_max,
-                ),
-            ),
+            user_num=models.Count("user__id"),
+            total_study_in_range=finished_in_range("college", study_min, study_max),
         ).order_by("-total_study_in_range")
 
         page = self.paginate_queryset(queryset)
@@ -392,10 +451,15 @@ class CollegeViewSet(
             )
             return self.get_paginated_response(serializer.data)
 
-        serializer = CollegeRankInRangeResponseSerializer(
-            queryset, many=True, study_min=study_min, study_max=study_max
+        data = get_or_compute(
+            "college:ranks_in_range",
+            {"study_min": study_min, "study_max": study_max},
+            (College, User, StudyPeriod, StudyRecording),
+            lambda: CollegeRankInRangeResponseSerializer(
+                queryset, many=True, study_min=study_min, study_max=study_max
+            ).data,
         )
-        return Response(serializer.data)
+        return Response(data)
 
     @action(methods=["GET"], detail=False)
     def rank_in_range(self, request):
@@ -413,15 +477,8 @@ class CollegeViewSet(
 
         queryset = (
             College.objects.annotate(
-                user_num=models.Count("user__id", distinct=True),
-                total_study_in_range=models.Count(
-                    "user__recording__id",
-                    distinct=True,
-                    filter=models.Q(
-                        user__recording__study_id__gte=study_min,
-                        user__recording__study_id__lte=study_max,
-                    ),
-                ),
+                user_num=models.Count("user__id"),
+                total_study_in_range=finished_in_range("college", study_min, study_max),
             )
             .order_by("-total_study_in_range")
             .get(id=college_id)
@@ -434,6 +491,7 @@ class CollegeViewSet(
 
 
 class LeagueBranchViewSet(
+    ConditionalListMixin,
     mixins.CreateModelMixin,
     mixins.DestroyModelMixin,
     mixins.ListModelMixin,
@@ -447,6 +505,7 @@ class LeagueBranchViewSet(
         "rank_in_range": UserRankInRangeRequestSerializer,
         "ranks_in_range": LeagueRankInRangeRequestSerializer,
     }
+    list_validator = staticmethod(get_org_version)
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -485,18 +544,15 @@ class LeagueBranchViewSet(
             return Response(status=status.HTTP_403_FORBIDDEN)
 
         total = LeagueBranch.objects.count()
-        rank = 1
-
-        leagues = (
-            LeagueBranch.objects.filter(college=serializer.validated_data["college_id"])
-            .annotate(total_study=models.Sum("user__total_study"))
-            .order_by("-total_study")
+        rank = leaderboard.get_group_rank(
+            LeagueBranch.objects.filter(college=college_id).annotate(
+                total_study=Coalesce(models.Sum("user__total_study"), 0)
+            ),
+            league_branch_id,
         )
-        # TODO 优化这个for
-        for league in leagues.iterator():
-            if league.id is serializer.validated_data["league_branch_id"]:
-                break
-            rank += 1
+        if rank is None:
+            # 团支部不存在或者不属于这个学院
+            return Response("团支部不存在！", status=status.HTTP_404_NOT_FOUND)
 
         return Response({"rank": rank, "total": total}, status=HTTP_200_OK)
 
@@ -518,12 +574,12 @@ class LeagueBranchViewSet(
         queryset = None
         if college_id == -1:
             queryset = LeagueBranch.objects.annotate(
-                total_study=models.Count("user__recording__id")
+                total_study=finished_in_range("league_branch")
             ).order_by("-total_study")
         else:
             queryset = (
                 LeagueBranch.objects.filter(college=college_id)
-                .annotate(total_study=models.Count("user__recording__id"))
+                .annotate(total_study=finished_in_range("league_branch"))
                 .order_by("-total_study")
             )
 
@@ -532,6 +588,15 @@ class LeagueBranchViewSet(
             serializer = LeagueBranchRanksResponseSerializer(page, many=True)
             return self.get_paginated_response(serializer.data)
 
+        if college_id == -1:
+            data = get_or_compute(
+                "league_branch:ranks",
+                {},
+                (LeagueBranch, User, StudyRecording),
+                lambda: LeagueBranchRanksResponseSerializer(queryset, many=True).data,
+            )
+            return Response(data)
+
         serializer = LeagueBranchRanksResponseSerializer(queryset, many=True)
         return Response(serializer.data)
 
@@ -551,14 +616,9 @@ class LeagueBranchViewSet(
 
         queryset = (
             LeagueBranch.objects.annotate(
-                user_num=models.Count("user__id", distinct=True),
-                total_study_in_range=models.Count(
-                    "user__recording__id",
-                    distinct=True,
-                    filter=models.Q(
-                        user__recording__study_id__gte=study_min,
-                        user__recording__study_id__lte=study_max,
-                    ),
+                user_num=models.Count("user__id"),
+                total_study_in_range=finished_in_range(
+                    "league_branch", study_min, study_max
                 ),
             )
             .order_by("-total_study_in_range")
@@ -592,14 +652,9 @@ class LeagueBranchViewSet(
         if college_id != -1:
             queryset = queryset.filter(college=college_id)
         queryset = queryset.annotate(
-            user_num=models.Count("user__id", distinct=True),
-            total_study_in_range=models.Count(
-                "user__recording__id",
-                distinct=True,
-                filter=models.Q(
-                    user__recording__study_id__gte=study_min,
-                    user__recording__study_id__lte=study_max,
-                ),
+            user_num=models.Count("user__id"),
+            total_study_in_range=finished_in_range(
+                "league_branch", study_min, study_max
             ),
         ).order_by("-total_study_in_range")
 
@@ -0,0 +1,29 @@
+"""
+微信登录
+
+用小程序的code向youth.bupt.edu.cn换取openid
+"""
+
+from django.conf import settings
+
+from ..upstream import CircuitBreaker, UpstreamClient
+
+client = UpstreamClient(
+    "微信登录服务",
+    connect_timeout=settings.UPSTREAM_CONNECT_TIMEOUT,
+    read_timeout=settings.UPSTREAM_READ_TIMEOUT,
+    breaker=CircuitBreaker(
+        settings.UPSTREAM_BREAKER_FAILURES, settings.UPSTREAM_BREAKER_RESET
+    ),
+)
+
+
+def get_openid(code):
+    """
+    返回code对应的openid，code错误时抛出ValueError，上游服务失败时抛出UpstreamError
+    """
+    response = client.get(settings.WECHAT_INFO_URL, params={"code": code})
+    try:
+        return response.json()["openid"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("code错误")
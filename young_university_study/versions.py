@@ -0,0 +1,107 @@
+"""
+数据版本号
+
+每个模型在共享缓存中保存一个版本号，数据变化时更新。版本号没有变化说明数据没有变化，
+可以作为缓存键或ETag的一部分，读取缓存时不需要再查询数据库判断是否过期。
+
+track注册的模型在post_save、post_delete时自动更新版本号，
+QuerySet.update、bulk_create不会发送信号，需要在修改后调用bump
+"""
+
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+VERSION_KEY = "versions:%s"
+# 版本号的有效期，防止直接修改数据库后缓存一直不更新
+VERSION_TIMEOUT = 60 * 60
+
+
+def _key(model):
+    return VERSION_KEY % model._meta.label_lower
+
+
+def get_versions(*models):
+    """
+    models的版本号，缓存中没有时生成新的版本号
+    """
+    keys = [_key(model) for model in models]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        version = time.time_ns()
+        for key in missing:
+            cache.add(key, version, VERSION_TIMEOUT)
+        versions.update(cache.get_many(missing))
+        # 缓存不可用时每次都返回新的版本号
+        for key in missing:
+            versions.setdefault(key, version)
+    return tuple(versions[key] for key in keys)
+
+
+def get_version(model):
+    return get_versions(model)[0]
+
+
+def _set(keys):
+    version = time.time_ns()
+    cache.set_many({key: version for key in keys}, VERSION_TIMEOUT)
+
+
+def invalidate(func, *args):
+    """
+    立即调用func(*args)使缓存失效，事务提交后再调用一次
+    """
+    func(*args)
+    # 事务提交前其他请求可能又读取了旧数据，提交后再调用一次
+    transaction.on_commit(lambda: func(*args))
+
+
+def bump(*models):
+    """
+    models的数据发生了变化
+    """
+    invalidate(_set, [_key(model) for model in models])
+
+
+# track时传入的fields
+_fields = {}
+
+
+def _has_changed(instance, fields, update_fields):
+    for name in fields:
+        field = instance._meta.get_field(name)
+        # update_fields中没有的字段即使在内存中修改了也没有写入数据库
+        if (
+            update_fields is not None
+            and not {field.name, field.attname} & update_fields
+        ):
+            continue
+        if instance.tracker.has_changed(name):
+            return True
+    return False
+
+
+def _on_saved(sender, instance, created, update_fields=None, **kwargs):
+    fields = _fields[sender]
+    if created or fields is None or _has_changed(instance, fields, update_fields):
+        bump(sender)
+
+
+def _on_deleted(sender, **kwargs):
+    bump(sender)
+
+
+def track(*models, fields=None):
+    """
+    models保存、删除时自动更新版本号，
+    传入fields时只有这些字段变化才更新（需要在模型的FieldTracker中），
+    例如登录时保存last_login、兑换商品时修改积分不会使学生的版本号变化
+    """
+    for model in models:
+        _fields[model] = fields
+        uid = "versions:" + model._meta.label_lower
+        post_save.connect(_on_saved, sender=model, dispatch_uid=uid)
+        post_delete.connect(_on_deleted, sender=model, dispatch_uid=uid)